@@ -0,0 +1,310 @@
+# coding=utf-8
+"""
+Aggregate expenses inside the database, so that the cost of building totals
+depends on the number of groups returned rather than the number of expenses.
+"""
+from __future__ import absolute_import, unicode_literals, print_function, division
+import datetime
+from decimal import Decimal
+import pytz
+from django.conf import settings
+from django.db import connections
+from django.db.models import Count, Max, Min, Q, Sum
+from django.utils import six, timezone
+from django.utils.dateparse import parse_date
+from expense.models import BucketTotal, DateRollup, WeeklyTotal
+
+# The lengths of time expenses can be totalled over. Weeks are ISO weeks, starting on Monday.
+BUCKETS = ('day', 'week', 'month', 'quarter', 'year')
+
+
+def iso_year_week_sql(connection, field_name):
+    """
+    Build the SQL which converts a datetime column to its ISO year and week in the
+    current time zone, as a single integer of the form YYYYWW.
+    :param connection: The database connection the SQL will run on
+    :param field_name: The quoted column name
+    :return: A tuple of the SQL and its parameters
+    """
+    tzname = timezone.get_current_timezone_name() if settings.USE_TZ else None
+
+    if connection.vendor == 'sqlite':
+        # Registered on every connection by expense.models.register_sqlite_functions
+        return 'expense_iso_year_week({0}, %s)'.format(field_name), [tzname]
+
+    if connection.vendor == 'postgresql':
+        params = []
+        if tzname:
+            field_name = '{0} AT TIME ZONE %s'.format(field_name)
+            params = [tzname, tzname]
+        sql = "CAST(EXTRACT('isoyear' FROM {0}) * 100 + EXTRACT('week' FROM {0}) AS integer)".format(field_name)
+        return sql, params
+
+    if connection.vendor == 'mysql':
+        params = []
+        if tzname:
+            field_name = "CONVERT_TZ({0}, 'UTC', %s)".format(field_name)
+            params = [tzname]
+        # Mode 3 weeks start on Monday and week 1 is the first with 4 or more days, the same as ISO 8601
+        return 'YEARWEEK({0}, 3)'.format(field_name), params
+
+    raise NotImplementedError('ISO week aggregation is not supported on {0}'.format(connection.vendor))
+
+
+def weekly_aggregates(expenses, *fields):
+    """
+    Group the expenses by ISO week in the database, counting and totalling each week.
+    :param expenses: A queryset of Expense objects, or of ExpenseHistory objects to include archived expenses
+    :param fields: Any further fields to group by, such as 'user'
+    :return: A queryset of dictionaries with the fields, year_week (YYYYWW), count and total
+    """
+    connection = connections[expenses.db]
+    qn = connection.ops.quote_name
+    opts = expenses.model._meta
+    field_name = '{0}.{1}'.format(qn(opts.db_table), qn(opts.get_field('date').column))
+    year_week_sql, params = iso_year_week_sql(connection, field_name)
+
+    return (expenses.order_by()
+            .extra(select={'year_week': year_week_sql}, select_params=params)
+            .values(*(fields + ('year_week', )))
+            .annotate(count=Count('id'), total=Sum('amount'))
+            .order_by(*(fields + ('year_week', ))))
+
+
+def weekly_totals(expenses):
+    """
+    Build a list of WeeklyTotal by grouping the expenses by ISO week in the database.
+    :param expenses: A queryset of expense objects
+    :return: a list of WeeklyTotal, sorted by week
+    """
+    return [WeeklyTotal(row['year_week'] // 100, row['year_week'] % 100, row['count'], row['total'])
+            for row in weekly_aggregates(expenses)]
+
+
+def bucket_start(date, bucket):
+    """
+    The first day of the bucket a date falls in.
+    :param date: A date
+    :param bucket: One of BUCKETS
+    :return: The date the bucket starts
+    """
+    if bucket == 'day':
+        return date
+    if bucket == 'week':
+        return date - datetime.timedelta(days=date.weekday())
+    if bucket == 'month':
+        return date.replace(day=1)
+    if bucket == 'quarter':
+        return date.replace(month=(date.month - 1) // 3 * 3 + 1, day=1)
+    if bucket == 'year':
+        return date.replace(month=1, day=1)
+    raise ValueError('Unknown bucket {0}'.format(bucket))
+
+
+def next_bucket_start(date, bucket):
+    """
+    The first day of the bucket after the one a date falls in.
+    :param date: A date
+    :param bucket: One of BUCKETS
+    :return: The date the next bucket starts
+    """
+    start = bucket_start(date, bucket)
+    if bucket in ('day', 'week'):
+        return start + datetime.timedelta(days=1 if bucket == 'day' else 7)
+    years, month = divmod(start.month - 1 + {'month': 1, 'quarter': 3, 'year': 12}[bucket], 12)
+    return start.replace(year=start.year + years, month=month + 1)
+
+
+def local_midnight(date):
+    """
+    The start of a day in the current time zone.
+    :param date: A date
+    :return: An aware datetime
+    """
+    tz = timezone.get_current_timezone()
+    midnight = datetime.datetime.combine(date, datetime.time())
+    # pytz picks an offset for a midnight which is skipped or repeated by a change to daylight saving
+    return tz.normalize(tz.localize(midnight)) if hasattr(tz, 'localize') else midnight.replace(tzinfo=tz)
+
+
+def utc_offsets(tz, start, end):
+    """
+    The UTC offsets of a time zone between two times.
+    :param tz: A pytz time zone
+    :param start: The aware datetime to start at
+    :param end: The aware datetime to end at
+    :return: A list of tuples of the naive UTC datetime each offset starts at (None for the first)
+             and the offset in seconds
+    """
+    def offset_at(utc):
+        return int(timezone.localtime(pytz.utc.localize(utc), tz).utcoffset().total_seconds())
+
+    start = timezone.make_naive(start, pytz.utc)
+    end = timezone.make_naive(end, pytz.utc)
+    offsets = [(None, offset_at(start))]
+    # Only zones with daylight saving or historical changes have transitions
+    for transition in getattr(tz, '_utc_transition_times', []):
+        if start < transition <= end and offset_at(transition) != offsets[-1][1]:
+            offsets.append((transition, offset_at(transition)))
+    return offsets
+
+
+def _sqlite_local_datetime_sql(connection, field_name, offsets):
+    """
+    SQLite has no time zone support, so the local time is found by adding the UTC
+    offset in force at the time, picked from the offsets by comparing with the time
+    they start.
+    """
+    if len(offsets) == 1:
+        return "datetime({0}, '{1} seconds')".format(field_name, offsets[0][1]), []
+    sql = ['CASE']
+    params = []
+    for (_, offset), (next_start, _) in zip(offsets, offsets[1:]):
+        sql.append('WHEN {0} < %s THEN {1}'.format(field_name, offset))
+        params.append(connection.ops.value_to_db_datetime(next_start))
+    sql.append('ELSE {0} END'.format(offsets[-1][1]))
+    return "datetime({0}, ({1}) || ' seconds')".format(field_name, ' '.join(sql)), params
+
+
+def bucket_sql(connection, field_name, bucket, start, end):
+    """
+    Build the SQL which converts a datetime column to the first day of its bucket in the
+    current time zone.
+    :param connection: The database connection the SQL will run on
+    :param field_name: The quoted column name
+    :param bucket: One of BUCKETS
+    :param start: The earliest datetime the column may hold
+    :param end: The latest datetime the column may hold
+    :return: A tuple of the SQL and its parameters
+    """
+    if bucket not in BUCKETS:
+        raise ValueError('Unknown bucket {0}'.format(bucket))
+    tz = timezone.get_current_timezone() if settings.USE_TZ else None
+
+    if connection.vendor == 'sqlite':
+        if tz:
+            local, params = _sqlite_local_datetime_sql(connection, field_name, utc_offsets(tz, start, end))
+        else:
+            local, params = field_name, []
+        if bucket == 'quarter':
+            # Back to the start of the month, then to the first month of the quarter
+            sql = ("date({0}, 'start of month', '-' || ((CAST(strftime('%%m', {0}) AS integer) - 1) %% 3) || "
+                   "' months')").format(local)
+            return sql, params * 2
+        return {
+            'day': 'date({0})',
+            'week': "date({0}, '-6 days', 'weekday 1')",
+            'month': "date({0}, 'start of month')",
+            'year': "date({0}, 'start of year')",
+        }[bucket].format(local), params
+
+    if connection.vendor == 'postgresql':
+        params = [bucket]
+        if tz:
+            field_name = '{0} AT TIME ZONE %s'.format(field_name)
+            params.append(timezone.get_current_timezone_name())
+        return 'CAST(DATE_TRUNC(%s, {0}) AS date)'.format(field_name), params
+
+    if connection.vendor == 'mysql':
+        params = []
+        if tz:
+            field_name = "CONVERT_TZ({0}, 'UTC', %s)".format(field_name)
+            params = [timezone.get_current_timezone_name()]
+        sql = {
+            'day': 'DATE({0})',
+            'week': 'DATE_SUB(DATE({0}), INTERVAL WEEKDAY({0}) DAY)',
+            'month': "DATE_FORMAT({0}, '%%Y-%%m-01')",
+            'quarter': 'MAKEDATE(YEAR({0}), 1) + INTERVAL QUARTER({0}) - 1 QUARTER',
+            'year': 'MAKEDATE(YEAR({0}), 1)',
+        }[bucket]
+        return sql.format(field_name), params * sql.count('{0}')
+
+    raise NotImplementedError('Bucket aggregation is not supported on {0}'.format(connection.vendor))
+
+
+def bucket_aggregates(expenses, bucket, *fields):
+    """
+    Group the expenses by day, week, month, quarter or year in the database, in the
+    current time zone, counting and totalling each bucket.
+    :param expenses: A queryset of Expense objects, or of ExpenseHistory objects to include archived expenses
+    :param bucket: One of BUCKETS
+    :param fields: Any further fields to group by, such as 'user'
+    :return: A list of dictionaries with the fields, start_date, count, total, minimum and maximum,
+             sorted by the fields and start_date
+    """
+    bounds = expenses.order_by().aggregate(start=Min('date'), end=Max('date'))
+    if bounds['start'] is None:
+        return []
+
+    connection = connections[expenses.db]
+    qn = connection.ops.quote_name
+    opts = expenses.model._meta
+    field_name = '{0}.{1}'.format(qn(opts.db_table), qn(opts.get_field('date').column))
+    sql, params = bucket_sql(connection, field_name, bucket, bounds['start'], bounds['end'])
+
+    rows = list(expenses.order_by()
+                .extra(select={'bucket': sql}, select_params=params)
+                .values(*(fields + ('bucket', )))
+                .annotate(count=Count('id'), total=Sum('amount'), minimum=Min('amount'), maximum=Max('amount'))
+                .order_by(*(fields + ('bucket', ))))
+    for row in rows:
+        start_date = row.pop('bucket')
+        if isinstance(start_date, six.string_types):
+            start_date = parse_date(start_date)
+        elif isinstance(start_date, datetime.datetime):
+            start_date = start_date.date()
+        row['start_date'] = start_date
+    return rows
+
+
+def bucket_totals(expenses, bucket):
+    """
+    Build a list of BucketTotal by grouping the expenses by day, week, month, quarter
+    or year in the database, in the current time zone.
+    :param expenses: A queryset of Expense objects, or of ExpenseHistory objects to include archived expenses
+    :param bucket: One of BUCKETS
+    :return: A list of BucketTotal, sorted by date
+    """
+    return [BucketTotal(bucket, row['start_date'], row['count'], row['total'], row['minimum'], row['maximum'])
+            for row in bucket_aggregates(expenses, bucket)]
+
+
+def rollup_spans(start, end, buckets=('year', 'month', 'day')):
+    """
+    Split the days from one date up to another into the fewest whole years, months
+    and days, so that their totals can be read from the date rollup.
+    :param start: The first day
+    :param end: The day after the last day
+    :param buckets: The buckets to split into, largest first
+    :return: A list of (bucket, first start_date, end start_date), where the end is not included
+    """
+    if start >= end:
+        return []
+    bucket, smaller = buckets[0], buckets[1:]
+    if not smaller:
+        return [(bucket, start, end)]
+
+    first = bucket_start(start, bucket)
+    if first < start:
+        first = next_bucket_start(start, bucket)
+    last = bucket_start(end, bucket)
+    if first >= last:
+        # There isn't a whole bucket in the range
+        return rollup_spans(start, end, smaller)
+    return rollup_spans(start, first, smaller) + [(bucket, first, last)] + rollup_spans(last, end, smaller)
+
+
+def rollup_totals(user, spans):
+    """
+    Count and total a user's expenses over the given spans of the date rollup in one query.
+    :param user: The user who owns the expenses
+    :param spans: A list of (bucket, first start_date, end start_date) from rollup_spans
+    :return: A tuple of the count and total amount
+    """
+    if not spans:
+        return 0, Decimal('0')
+    bounds = Q()
+    for bucket, first, end in spans:
+        bounds |= Q(bucket=bucket, start_date__gte=first, start_date__lt=end)
+    totals = DateRollup.objects.filter(bounds, user=user).aggregate(count=Sum('count'), cents=Sum('total_cents'))
+    return totals['count'] or 0, Decimal(totals['cents'] or 0).scaleb(-2)
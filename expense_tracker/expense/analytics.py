@@ -0,0 +1,251 @@
+# coding=utf-8
+"""
+Spending statistics over a user's weeks and expenses: rolling averages, week over
+week change, a linear trend and percentiles. The data is read in two grouped
+queries, the weeks from the weekly rollup and a histogram of the expense amounts
+(one row per distinct amount, read from the index on user and amount), so little
+more than the number of weeks and distinct amounts is read into Python.
+
+The arithmetic is done on whole cents in arrays, with NumPy when it is installed
+and the array module otherwise, and only the results are converted to Decimal, so
+both give exactly the same answers.
+"""
+from __future__ import absolute_import, unicode_literals, print_function, division
+import bisect
+import datetime
+from array import array
+from decimal import Decimal
+from fractions import Fraction
+from django.db import connections
+from expense.aggregation import local_midnight
+from expense.archive import NOT_READ, expense_model
+from expense.models import WeeklyRollup, WeeklySpending
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# The percentiles of the expense amounts and weekly totals in the summary
+PERCENTILES = (10, 25, 50, 75, 90, 95)
+# The number of weeks averaged by each rolling average
+ROLLING_WEEKS = (4, 12)
+
+CENT = Decimal('0.01')
+
+
+def _int_array(values=()):
+    """
+    A compact array of whole numbers (e.g. cents), as a NumPy array if it is installed.
+    """
+    if numpy is not None:
+        return numpy.array(values, dtype=numpy.int64)
+    return array(str('l'), values)
+
+
+def _cumulative_sums(values):
+    """
+    The running totals of an array, starting with 0, so that the sum of values[i:j]
+    is sums[j] - sums[i].
+    """
+    if numpy is not None:
+        return numpy.concatenate(([0], numpy.cumsum(values)))
+    sums = array(str('l'), [0]) * (len(values) + 1)
+    for index, value in enumerate(values):
+        sums[index + 1] = sums[index] + value
+    return sums
+
+
+def _dollars(cents):
+    """
+    Convert a number of cents (which may be a Fraction) to dollars, rounded to the cent.
+    """
+    if isinstance(cents, Fraction):
+        return (Decimal(cents.numerator) / Decimal(cents.denominator) / 100).quantize(CENT)
+    return Decimal(int(cents)).scaleb(-2).quantize(CENT)
+
+
+def percentile(value_at, size, percent):
+    """
+    A percentile of sorted data, interpolating linearly between the closest ranks
+    (as NumPy's percentile function does).
+    :param value_at: A function giving the value of a 0 based rank of the sorted data
+    :param size: The number of values
+    :param percent: The percentile, from 0 to 100
+    :return: The percentile as a Fraction, or None if there is no data
+    """
+    if not size:
+        return None
+    rank = Fraction((size - 1) * percent, 100)
+    lower = int(rank)
+    value = Fraction(int(value_at(lower)))
+    if rank > lower:
+        value += (int(value_at(lower + 1)) - value) * (rank - lower)
+    return value
+
+
+def linear_trend(values):
+    """
+    Fit a straight line through a series by least squares, with x as the index of each value.
+    :param values: An array of whole numbers
+    :return: A tuple of the slope and the intercept (the fitted value at index 0) as Fractions,
+             or None for fewer than two values
+    """
+    size = len(values)
+    if size < 2:
+        return None
+    if numpy is not None:
+        indexes = numpy.arange(size, dtype=numpy.int64)
+        sum_y, sum_xy = int(values.sum()), int(numpy.dot(indexes, values))
+    else:
+        sum_y, sum_xy = sum(values), sum(index * value for index, value in enumerate(values))
+    sum_x = size * (size - 1) // 2
+    sum_xx = (size - 1) * size * (2 * size - 1) // 6
+    denominator = size * sum_xx - sum_x * sum_x
+    return (Fraction(size * sum_xy - sum_x * sum_y, denominator),
+            Fraction(sum_y * sum_xx - sum_x * sum_xy, denominator))
+
+
+def weekly_series(user):
+    """
+    Read a user's weekly totals from their rollup into arrays, with a zero for each
+    week without expenses between the first and last week.
+    :param user: The user who owns the expenses
+    :return: A tuple of the Monday of the first week, and arrays of the count and total
+             (in cents) of each week
+    """
+    rows = list(WeeklyRollup.objects.filter(user=user).order_by('start_date').values_list(
+        'start_date', 'count', 'total_cents'))
+    if not rows:
+        return None, _int_array(), _int_array()
+
+    first = rows[0][0]
+    size = (rows[-1][0] - first).days // 7 + 1
+    counts, totals = _int_array([0] * size), _int_array([0] * size)
+    for start_date, count, cents in rows:
+        index = (start_date - first).days // 7
+        counts[index], totals[index] = count, cents
+    return first, counts, totals
+
+
+def amount_histogram(user, start=None, end=None, archived_until=NOT_READ):
+    """
+    Count a user's expenses of each amount in the database.
+    :param user: The user who owns the expenses
+    :param start: The aware datetime of the first expenses to count, or None
+    :param end: The aware datetime to count the expenses before, or None
+    :param archived_until: The date of the user's newest archived expense, if already read
+    :return: Arrays of the distinct amounts (in cents) in ascending order, and the running
+             count of expenses up to and including each amount
+    """
+    # Only the expense table, unless the archived expenses are counted too
+    model = expense_model(user, start, archived_until)
+    connection = connections[model.objects.db]
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    amount, date, user_id = ['{0}.{1}'.format(table, qn(model._meta.get_field(name).column))
+                             for name in ('amount', 'date', 'user')]
+    where, params = ['{0} = %s'.format(user_id)], [user.pk]
+    if start is not None:
+        where.append('{0} >= %s'.format(date))
+        params.append(connection.ops.value_to_db_datetime(start))
+    if end is not None:
+        where.append('{0} < %s'.format(date))
+        params.append(connection.ops.value_to_db_datetime(end))
+
+    # Grouping by the column lets the database read the amounts in order from the index on
+    # user and amount, while selecting it in cents skips converting each row to a Decimal
+    cursor = connection.cursor()
+    cursor.execute('SELECT {0} * 100, COUNT(*) FROM {1} WHERE {2} GROUP BY {0} ORDER BY {0}'.format(
+        amount, table, ' AND '.join(where)), params)
+    rows = cursor.fetchall()
+    amounts = _int_array([int(round(cents)) for cents, _ in rows])
+    counts = _int_array([count for _, count in rows])
+    return amounts, _cumulative_sums(counts)[1:]
+
+
+def histogram_value_at(amounts, cumulative_counts):
+    """
+    A function giving the value of a rank of the expenses counted in a histogram.
+    """
+    if numpy is not None:
+        return lambda rank: amounts[numpy.searchsorted(cumulative_counts, rank, side='right')]
+    return lambda rank: amounts[bisect.bisect_right(cumulative_counts, rank)]
+
+
+def percentiles(value_at, size):
+    """
+    The PERCENTILES of sorted data in dollars, keyed p10, p25 etc.
+    """
+    results = {}
+    for percent in PERCENTILES:
+        value = percentile(value_at, size, percent)
+        results['p{0}'.format(percent)] = _dollars(value) if value is not None else None
+    return results
+
+
+def spending_analytics(user, first=None, last=None, archived_until=NOT_READ):
+    """
+    Build the weekly spending series and summary statistics of a user. The rolling
+    averages and changes take the weeks before the first into account, while the
+    percentiles and trend only cover the weeks from the first to the last.
+    :param user: The user who owns the expenses
+    :param first: The Monday of the first week to include, or None for the first week with expenses
+    :param last: The Monday of the last week to include, or None for the last week with expenses
+    :param archived_until: The date of the user's newest archived expense, if already read
+    :return: A tuple of a list of WeeklySpending, sorted by start_date, and a dictionary of
+             the expense and weekly total percentiles and the weekly trend
+    """
+    start, counts, totals = weekly_series(user)
+    size = len(totals)
+    begin, end = 0, size
+    if start is not None:
+        if first is not None:
+            begin = max(begin, -((start - first).days // 7))
+        if last is not None:
+            end = min(end, (last - start).days // 7 + 1)
+    end = max(begin, end)
+
+    # Only the weeks listed are converted to Decimal, from lists of plain ints
+    sums = list(_cumulative_sums(totals))
+    week_counts, week_totals = list(counts), list(totals)
+    weeks = []
+    for index in range(begin, end):
+        total, previous = week_totals[index], week_totals[index - 1] if index else None
+        rolling_averages = dict(
+            (length, (Decimal(int(sums[index + 1] - sums[index + 1 - length])) / (length * 100)).quantize(CENT)
+             if index + 1 >= length else None) for length in ROLLING_WEEKS)
+        change, change_percent = None, None
+        if previous is not None:
+            change = _dollars(total - previous)
+            if previous:
+                change_percent = (Decimal(int((total - previous) * 100)) / int(previous)).quantize(CENT)
+        weeks.append(WeeklySpending(start + datetime.timedelta(weeks=index), int(week_counts[index]), _dollars(total),
+                                    rolling_averages[4], rolling_averages[12], change, change_percent))
+
+    listed = totals[begin:end]
+    if numpy is not None:
+        ordered = numpy.sort(listed)
+    else:
+        ordered = sorted(listed)
+    trend = linear_trend(listed)
+
+    amounts, cumulative_counts = _int_array(), _int_array()
+    if weeks and (begin > 0 or end < size):
+        # The weeks are in the current time zone, as in the weekly rollup
+        first_week, after_last_week = weeks[0].start_date, weeks[-1].start_date + datetime.timedelta(weeks=1)
+        amounts, cumulative_counts = amount_histogram(user, local_midnight(first_week), local_midnight(after_last_week),
+                                                      archived_until)
+    elif weeks:
+        amounts, cumulative_counts = amount_histogram(user, archived_until=archived_until)
+    expense_count = int(cumulative_counts[-1]) if len(cumulative_counts) else 0
+
+    summary = {
+        'expense_percentiles': percentiles(histogram_value_at(amounts, cumulative_counts), expense_count),
+        'weekly_percentiles': percentiles(lambda rank: ordered[rank], len(ordered)),
+        'trend': {
+            'slope': _dollars(trend[0]) if trend else None,
+            'intercept': _dollars(trend[1]) if trend else None,
+        },
+    }
+    return weeks, summary
@@ -0,0 +1,253 @@
+# coding=utf-8
+"""
+Move old expenses out of the expense table into the archive, so the table, its
+indexes and its search index only hold the recent expenses most requests read.
+The archive command (see expense.management.commands.archive_expenses) moves the
+expenses from before the start of a year, by default keeping settings.ARCHIVE_KEEP_YEARS
+years (counting the current one) in the expense table.
+
+Archived expenses keep their ids, which are never given to new expenses (see
+create_id_sequence), and their revisions, and are still counted in the weekly
+and date rollups, so moving them in either direction changes nothing a client can
+see: the rollups, expense versions and tombstones are left alone. Every expense can
+be read from the history, a view of both tables (ExpenseHistory). Reads which may
+reach into the archive, such as a list whose date range starts before the newest
+archived expense, read the history (see expense_model); the others only read the
+expense table. The date of each user's newest archived expense is kept with their
+ExpenseVersion, which the list responses read anyway, so choosing between them
+costs no query. An archived expense is moved back before it is changed or deleted.
+"""
+from __future__ import absolute_import, unicode_literals, print_function, division
+import datetime
+import logging
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.utils import timezone
+from expense.models import ArchivedExpense, Expense, ExpenseHistory, ExpenseVersion
+
+logger = logging.getLogger('expense_tracker.archive')
+
+# The number of years, counting the current one, kept in the expense table when not set in settings
+DEFAULT_KEEP_YEARS = 2
+# The number of expenses moved per transaction
+DEFAULT_BATCH_SIZE = 500
+# The archived_until of expense_model when the caller hasn't read it, so that it is read from the database
+NOT_READ = object()
+
+
+def archive_cutoff(today=None):
+    """
+    The first day of the oldest year kept in the expense table, from settings.ARCHIVE_KEEP_YEARS.
+    :param today: The current date, defaults to today in the current time zone
+    :return: A date
+    """
+    today = today or timezone.localtime(timezone.now()).date()
+    return datetime.date(today.year - getattr(settings, 'ARCHIVE_KEEP_YEARS', DEFAULT_KEEP_YEARS) + 1, 1, 1)
+
+
+def create_history_view(connection):
+    """
+    Create the view of the recent and archived expenses read by ExpenseHistory, if it doesn't exist yet.
+    :param connection: The database connection
+    :return: True if the view was created
+    """
+    qn = connection.ops.quote_name
+    view = ExpenseHistory._meta.db_table
+    cursor = connection.cursor()
+    if connection.vendor == 'sqlite':
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'view' AND name = %s", [view])
+    elif connection.vendor == 'postgresql':
+        cursor.execute('SELECT 1 FROM information_schema.views WHERE table_schema = current_schema() '
+                       'AND table_name = %s', [view])
+    elif connection.vendor == 'mysql':
+        cursor.execute('SELECT 1 FROM information_schema.views WHERE table_schema = DATABASE() '
+                       'AND table_name = %s', [view])
+    else:
+        raise NotImplementedError('Archiving expenses is not supported on {0}'.format(connection.vendor))
+    if cursor.fetchone():
+        return False
+
+    columns = ', '.join(qn(column) for column in _columns())
+    # UNION ALL rather than UNION, as an expense is never in both tables. The database
+    # applies the conditions of a query on the view to each table, using its indexes.
+    cursor.execute('CREATE VIEW {0} AS SELECT {1} FROM {2} UNION ALL SELECT {1} FROM {3}'.format(
+        qn(view), columns, qn(Expense._meta.db_table), qn(ArchivedExpense._meta.db_table)))
+    return True
+
+
+def has_id_sequence(connection):
+    """
+    Whether expense ids are never given out again, see create_id_sequence.
+    :param connection: The database connection
+    :return: False if the expense table has to be rebuilt first
+    """
+    if connection.vendor != 'sqlite':
+        return True
+    cursor = connection.cursor()
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = %s", [Expense._meta.db_table])
+    return 'AUTOINCREMENT' in cursor.fetchone()[0]
+
+
+def create_id_sequence(connection):
+    """
+    Make sure the id of a new expense is larger than any id given out before, even once
+    the expenses with the largest ids have been archived or deleted, so an archived
+    expense's id is never given to another expense. SQLite only does so for a table
+    declared with AUTOINCREMENT, which Django doesn't do, so the expense table is
+    rebuilt with it, along with its indexes and triggers. PostgreSQL's sequences never
+    go backwards, nor does MySQL's auto increment counter from 8.0 on.
+    :param connection: The database connection
+    :return: True if the expense table was rebuilt
+    """
+    if has_id_sequence(connection):
+        return False
+    qn = connection.ops.quote_name
+    table = Expense._meta.db_table
+    cursor = connection.cursor()
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = %s", [table])
+    create = cursor.fetchone()[0]
+    cursor.execute('SELECT COUNT(*) FROM {0}'.format(qn(table)))
+    logger.info('Rebuilding the %s table of %d expenses with AUTOINCREMENT ids', table, cursor.fetchone()[0])
+
+    rebuilt = table + '__rebuilt'
+    primary_key = '{0} integer NOT NULL PRIMARY KEY'.format(qn(Expense._meta.pk.column))
+    create = create.replace(qn(table), qn(rebuilt), 1).replace(primary_key, primary_key + ' AUTOINCREMENT', 1)
+    with transaction.atomic(using=connection.alias):
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type IN ('index', 'trigger') AND tbl_name = %s "
+                       "AND sql IS NOT NULL", [table])
+        recreate = [row[0] for row in cursor.fetchall()]
+        cursor.execute(create)
+        cursor.execute('INSERT INTO {0} SELECT * FROM {1}'.format(qn(rebuilt), qn(table)))
+        cursor.execute('DROP TABLE {0}'.format(qn(table)))
+        # Without legacy renaming, SQLite would check the views of the dropped table and fail
+        cursor.execute('PRAGMA legacy_alter_table = ON')
+        cursor.execute('ALTER TABLE {0} RENAME TO {1}'.format(qn(rebuilt), qn(table)))
+        cursor.execute('PRAGMA legacy_alter_table = OFF')
+        for sql in recreate:
+            cursor.execute(sql)
+        # Start after the largest id already given out, which may be an archived expense's
+        cursor.execute('DELETE FROM sqlite_sequence WHERE name = %s', [table])
+        cursor.execute('INSERT INTO sqlite_sequence (name, seq) SELECT %s, COALESCE(MAX(id), 0) FROM ('
+                       'SELECT MAX({0}) AS id FROM {1} UNION ALL SELECT MAX({0}) FROM {2})'.format(
+                           qn('id'), qn(table), qn(ArchivedExpense._meta.db_table)), [table])
+    return True
+
+
+def newest_archived(user):
+    """
+    The date of a user's newest archived expense.
+    :param user: The user who owns the expenses
+    :return: An aware datetime, or None if none of their expenses are archived
+    """
+    return ExpenseVersion.objects.filter(user=user).values_list('archived_until', flat=True).first()
+
+
+def expense_model(user, start=None, archived_until=NOT_READ):
+    """
+    The model to read a user's expenses from: the history if any of their archived
+    expenses are dated on or after start, or else only the recent expenses.
+    :param user: The user who owns the expenses
+    :param start: The aware datetime of the earliest expenses to read, or None for all of them
+    :param archived_until: The date of the user's newest archived expense (see newest_archived),
+        if it has already been read with their version
+    :return: ExpenseHistory or Expense
+    """
+    if archived_until is NOT_READ:
+        archived_until = newest_archived(user)
+    if archived_until is None or (start is not None and archived_until < start):
+        return Expense
+    return ExpenseHistory
+
+
+def archive_expenses(before, user=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Move the expenses dated before a time into the archive.
+    :param before: An aware datetime
+    :param user: Only archive the expenses of this user, or None for every user
+    :param batch_size: The number of expenses moved per transaction
+    :return: The number of expenses archived
+    """
+    expenses = Expense.objects.filter(date__lt=before)
+    if user is not None:
+        expenses = expenses.filter(user=user)
+    return _move_expenses(Expense, ArchivedExpense, expenses, batch_size)
+
+
+def restore_expenses(since=None, user=None, ids=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Move archived expenses back into the expense table.
+    :param since: Only restore the expenses dated on or after this aware datetime, or None for all of them
+    :param user: Only restore the expenses of this user, or None for every user
+    :param ids: Only restore the expenses with these ids, or None for any expense
+    :param batch_size: The number of expenses moved per transaction
+    :return: The number of expenses restored
+    """
+    archived = ArchivedExpense.objects.all()
+    if since is not None:
+        archived = archived.filter(date__gte=since)
+    if user is not None:
+        archived = archived.filter(user=user)
+    if ids is not None:
+        archived = archived.filter(id__in=ids)
+    return _move_expenses(ArchivedExpense, Expense, archived, batch_size)
+
+
+def _columns():
+    """
+    The columns of the expense table, which the archive and the history view share.
+    """
+    return [field.column for field in Expense._meta.concrete_fields]
+
+
+def _move_expenses(source, target, expenses, batch_size):
+    """
+    Copy expenses into another table and delete them from their own, a batch at a time.
+    Plain SQL is used, so none of the save and delete signals which keep the rollups,
+    versions and tombstones up to date are sent.
+    :param source: The model of the table the expenses are moved from
+    :param target: The model of the table the expenses are moved to
+    :param expenses: A queryset of the expenses to move
+    :param batch_size: The number of expenses moved per transaction
+    :return: The number of expenses moved
+    """
+    using = router.db_for_write(target)
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    columns = ', '.join(qn(column) for column in _columns())
+    moved, last = 0, 0
+    while True:
+        with transaction.atomic(using=using):
+            # Each batch starts after the last, rather than reading the moved rows again
+            rows = list(expenses.using(using).filter(id__gt=last).order_by('id').values_list('id', 'user_id')[
+                :batch_size])
+            if not rows:
+                return moved
+            ids = [pk for pk, _ in rows]
+            last = ids[-1]
+            placeholders = ', '.join(['%s'] * len(ids))
+            cursor = connection.cursor()
+            cursor.execute('INSERT INTO {0} ({1}) SELECT {1} FROM {2} WHERE {3} IN ({4})'.format(
+                qn(target._meta.db_table), columns, qn(source._meta.db_table), qn('id'), placeholders), ids)
+            cursor.execute('DELETE FROM {0} WHERE {1} IN ({2})'.format(
+                qn(source._meta.db_table), qn('id'), placeholders), ids)
+            _update_archived_until(set(user_id for _, user_id in rows), using)
+        moved += len(ids)
+
+
+def _update_archived_until(user_ids, using):
+    """
+    Record the date of the newest archived expense of each user whose expenses were moved.
+    The versions are left as they are, as moving expenses doesn't change them.
+    :param user_ids: The primary keys of the users
+    :param using: The alias of the database
+    """
+    for user_id in user_ids:
+        # One seek of the (user, date) index, where a grouped MAX would read all of the user's archive
+        newest = ArchivedExpense.objects.using(using).filter(user=user_id).order_by('-date').values_list(
+            'date', flat=True).first()
+        versions = ExpenseVersion.objects.using(using).filter(user=user_id)
+        if not versions.update(archived_until=newest) and newest is not None:
+            # Expenses saved without their signals (e.g. by bulk_create) may have no version yet
+            ExpenseVersion.objects.using(using).get_or_create(
+                user_id=user_id, defaults={'modified': timezone.now(), 'archived_until': newest})
+            versions.update(archived_until=newest)
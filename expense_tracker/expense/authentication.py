@@ -0,0 +1,68 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals, print_function, division
+import hashlib
+from django.conf import settings
+from django.core.cache import get_cache
+from django.utils.crypto import constant_time_compare
+from tastypie.authentication import ApiKeyAuthentication
+
+_cache = None
+
+
+def api_key_cache():
+    """
+    The cache holding recently authenticated API keys, as configured by settings.API_KEY_CACHE.
+    """
+    global _cache
+    if _cache is None:
+        _cache = get_cache(getattr(settings, 'API_KEY_CACHE', 'default'))
+    return _cache
+
+
+def _cache_key(username):
+    return 'apikey:{0}'.format(hashlib.sha1(username.encode('utf-8')).hexdigest())
+
+
+def _digest(api_key):
+    # Only a digest of the key is cached, so the keys themselves never leave the database
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+
+
+def forget_api_key(username):
+    """
+    Remove a user's API key from the cache, so their next request is checked against the database.
+    :param username: The username of the user
+    :return: None
+    """
+    api_key_cache().delete(_cache_key(username))
+
+
+class CachedApiKeyAuthentication(ApiKeyAuthentication):
+    """
+    API key authentication which remembers valid username and key pairs, so that
+    repeat requests don't need to look up the User and ApiKey in the database.
+    Entries expire after the cache's TIMEOUT and the cache's own limits (e.g.
+    MAX_ENTRIES) bound its size. They are also removed by signals in
+    expense.models when a key is created, changed or deleted, or a user is
+    changed (e.g. deactivated) or deleted.
+    """
+
+    def is_authenticated(self, request, **kwargs):
+        try:
+            username, api_key = self.extract_credentials(request)
+        except ValueError:
+            return self._unauthorized()
+
+        if not username or not api_key:
+            return self._unauthorized()
+
+        cache_key = _cache_key(username)
+        cached = api_key_cache().get(cache_key)
+        if cached and constant_time_compare(cached['api_key'], _digest(api_key)):
+            request.user = cached['user']
+            return True
+
+        authenticated = super(CachedApiKeyAuthentication, self).is_authenticated(request, **kwargs)
+        if authenticated is True:
+            api_key_cache().set(cache_key, {'api_key': _digest(api_key), 'user': request.user})
+        return authenticated
@@ -0,0 +1,135 @@
+# coding=utf-8
+"""
+Benchmarks for the expense API. Each benchmark module provides a ``run`` function
+which seeds or reuses its data and returns a list of result dictionaries. Run them with:
+
+    $ python manage.py bench
+    $ python manage.py bench expense_list weekly_totals --sizes=1000,100000,1000000
+"""
+from __future__ import absolute_import, unicode_literals, print_function, division
+import json
+import math
+import time
+from contextlib import contextmanager
+from django.core.urlresolvers import resolve
+from django.db import connection
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from tastypie.models import ApiKey
+from expense.factories import UserFactory, create_expenses_bulk
+
+# The numbers of expenses of the seeded users
+SIZES = (1000, 100000, 1000000)
+
+# Users seeded with a number of expenses, shared by the benchmarks of one run
+_seeded_users = {}
+
+
+@contextmanager
+def benchmark_database():
+    """
+    Create a throwaway test database for the duration of the benchmark, so that
+    seeded data never touches the real database.
+    """
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        _seeded_users.clear()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def time_call(func, repeat=5):
+    """
+    Call func repeatedly and record how long each call took.
+    :param func: A callable taking no arguments
+    :param repeat: The number of times to call func
+    :return: A list of timings in milliseconds
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        timings.append((time.time() - start) * 1000)
+    return timings
+
+
+def percentile(values, percent):
+    """
+    The nearest rank percentile of a list of numbers.
+    """
+    ordered = sorted(values)
+    return ordered[max(int(math.ceil(percent / 100 * len(ordered))) - 1, 0)]
+
+
+def median(values):
+    """
+    The median of a list of numbers.
+    """
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2
+
+
+def measure(func, repeat=5, number=1):
+    """
+    Time func and count the queries it makes. It is called once untimed first, to
+    warm up any caches and count the queries.
+    :param func: A callable taking no arguments
+    :param repeat: The number of timed calls
+    :param number: The number of operations each call of func makes, the results are per operation
+    :return: A dictionary of the median, 90th and 99th percentile, min and max times in
+             milliseconds, and the number of queries
+    """
+    with CaptureQueriesContext(connection) as queries:
+        func()
+    timings = [timing / number for timing in time_call(func, repeat)]
+    return {
+        'median_ms': median(timings),
+        'p90_ms': percentile(timings, 90),
+        'p99_ms': percentile(timings, 99),
+        'min_ms': min(timings),
+        'max_ms': max(timings),
+        'queries': len(queries) / number,
+    }
+
+
+def api_request(user, path, data=None, method='get'):
+    """
+    Build a request for the API, authenticated as the given user. Data is sent
+    in the query string of a GET, or as JSON in the body of other methods.
+    """
+    # Resolve the path as a real request would, which loads the URLconf and so gives
+    # the resources their api_name, which their resource_uri are reversed with
+    resolve(path)
+    api_key = ApiKey.objects.get(user=user)
+    authorization = 'ApiKey {0}:{1}'.format(user.username, api_key.key)
+    if method == 'get':
+        request = RequestFactory().get(path, data or {}, HTTP_AUTHORIZATION=authorization)
+    else:
+        request = getattr(RequestFactory(), method)(path, json.dumps(data or {}), content_type='application/json',
+                                                    HTTP_AUTHORIZATION=authorization)
+    request.user = user
+    return request
+
+
+def create_user():
+    """
+    Create a user to own the benchmark expenses. An API key is created by the post_save signal.
+    """
+    return UserFactory()
+
+
+def seeded_user(size):
+    """
+    A user with size expenses. Each size is only seeded once per benchmark run,
+    as seeding the largest sizes takes minutes.
+    """
+    if size not in _seeded_users:
+        user = create_user()
+        create_expenses_bulk(user, size)
+        _seeded_users[size] = user
+    return _seeded_users[size]
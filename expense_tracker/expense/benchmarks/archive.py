@@ -0,0 +1,82 @@
+# coding=utf-8
+"""
+Time reads of a user's recent expenses with all of their expenses in the expense
+table, and again once the expenses before the last year have been archived, which
+leaves the expense table a third of the size. Reads reaching back into the archive,
+which read the history of both tables, and the archiving itself are timed too. The
+user's expenses are restored afterwards, so the other benchmarks are unaffected.
+"""
+from __future__ import absolute_import, unicode_literals, print_function, division
+import datetime
+import time
+from expense.aggregation import local_midnight
+from expense.archive import archive_expenses, restore_expenses
+from expense.benchmarks import SIZES, api_request, measure, seeded_user
+from expense.caching import response_cache
+from expense.resources import ExpenseResource, SpendingResource, TotalResource
+
+# The seeded expenses span 2012 to 2014, and 2014 is kept in the expense table
+ARCHIVE_BEFORE = datetime.date(2014, 1, 1)
+# The reads of the last few weeks, as a list page and its totals, and the weeks of the last quarter
+RECENT_READS = (
+    ('expense_list', '/api/v1/expense/', {'limit': 20, 'order_by': '-date', 'date__range': '2014-12-10,2014-12-31'}),
+    ('totals', '/api/v1/total/', {'bucket': 'week', 'start_date__range': '2014-10-01,2014-12-31'}),
+    ('spending', '/api/v1/spending/', {'start_date__range': '2014-10-01,2014-12-31'}),
+)
+# The same reads a year earlier, which reach back into the archive
+ARCHIVE_READS = (
+    ('expense_list', '/api/v1/expense/', {'limit': 20, 'order_by': '-date', 'date__range': '2013-12-10,2013-12-31'}),
+    ('totals', '/api/v1/total/', {'bucket': 'week', 'start_date__range': '2013-10-01,2013-12-31'}),
+    ('spending', '/api/v1/spending/', {'start_date__range': '2013-10-01,2013-12-31'}),
+)
+
+
+def time_reads(user, reads, archived, repeat):
+    """
+    Time each read through the API, with the response cache cleared before each call.
+    """
+    views = {
+        'expense_list': ExpenseResource().wrap_view('dispatch_list'),
+        'totals': TotalResource().wrap_view('dispatch_list'),
+        'spending': SpendingResource().wrap_view('dispatch_list'),
+    }
+    results = []
+    for name, path, data in reads:
+        view = views[name]
+
+        def read():
+            response_cache().clear()
+            # A new request each time, as the list keeps what it has read on the request
+            assert view(api_request(user, path, data)).status_code == 200
+        result = {'benchmark': 'archive', 'expenses': user.expense_set.count() + user.archivedexpense_set.count(),
+                  'read': name, 'archived': archived}
+        result.update(data)
+        result.update(measure(read, repeat))
+        results.append(result)
+    return results
+
+
+def run(sizes=SIZES, repeat=5):
+    """
+    :param sizes: The numbers of expenses of the users to time
+    :param repeat: The number of timed calls per measurement
+    :return: A list of result dictionaries
+    """
+    results = []
+    for size in sizes:
+        user = seeded_user(size)
+        results.extend(time_reads(user, RECENT_READS + ARCHIVE_READS, False, repeat))
+
+        start = time.time()
+        archived = archive_expenses(local_midnight(ARCHIVE_BEFORE), user)
+        results.append({'benchmark': 'archive', 'expenses': size, 'operation': 'archive', 'archived_expenses': archived,
+                        'ms': (time.time() - start) * 1000})
+        try:
+            results.extend(time_reads(user, RECENT_READS, True, repeat))
+            results.extend(time_reads(user, ARCHIVE_READS, True, repeat))
+        finally:
+            start = time.time()
+            restore_expenses(user=user)
+            results.append({'benchmark': 'archive', 'expenses': size, 'operation': 'restore',
+                            'ms': (time.time() - start) * 1000})
+    return results
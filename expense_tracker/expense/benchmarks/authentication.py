@@ -0,0 +1,34 @@
+# coding=utf-8
+"""
+Compare the cost of authenticating a request with Tastypie's ApiKeyAuthentication,
+which looks up the User and ApiKey every time, against CachedApiKeyAuthentication.
+"""
+from __future__ import absolute_import, unicode_literals, print_function, division
+from tastypie.authentication import ApiKeyAuthentication
+from expense.authentication import CachedApiKeyAuthentication, api_key_cache
+from expense.benchmarks import api_request, create_user, measure
+
+CALLS = 1000
+
+
+def run(calls=CALLS, repeat=5):
+    """
+    :param calls: The number of requests authenticated per timing
+    :param repeat: The number of timed calls per measurement
+    :return: A list of result dictionaries, timed per request
+    """
+    user = create_user()
+    request = api_request(user, '/api/v1/expense/')
+    api_key_cache().clear()
+
+    results = []
+    for name, authentication in (('uncached', ApiKeyAuthentication()), ('cached', CachedApiKeyAuthentication())):
+        def authenticate():
+            for _ in range(calls):
+                assert authentication.is_authenticated(request) is True
+        # Warm up, so the cached authentication starts with the key cached
+        authentication.is_authenticated(request)
+        result = {'benchmark': 'authentication', 'mode': name}
+        result.update(measure(authenticate, repeat, number=calls))
+        results.append(result)
+    return results
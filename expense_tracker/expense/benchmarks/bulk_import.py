@@ -0,0 +1,45 @@
+# coding=utf-8
+"""
+Measure how many rows a second the bulk import validates and saves, from CSV
+through to the weekly rollup.
+"""
+from __future__ import absolute_import, unicode_literals, print_function, division
+import datetime
+from expense.benchmarks import create_user, measure
+from expense.importer import import_expenses, read_csv
+
+ROWS = 50000
+
+
+def csv_lines(rows):
+    """
+    A CSV file of expenses spread over three years, one line at a time.
+    """
+    start = datetime.datetime(2012, 1, 1)
+    yield b'date,description,amount,comment\n'
+    for number in range(rows):
+        date = start + datetime.timedelta(minutes=31 * number % (3 * 365 * 24 * 60))
+        line = '{0}Z,Expense {1},{2}.{3:02d},Imported\n'.format(date.isoformat(), number, number % 500, number % 100)
+        yield line.encode('utf-8')
+
+
+def run(rows=ROWS, batch_sizes=(100, 1000, 5000), repeat=5):
+    """
+    :param rows: The number of rows imported per timing
+    :param batch_sizes: The batch sizes to compare
+    :param repeat: The number of timed calls per measurement
+    :return: A list of result dictionaries
+    """
+    lines = list(csv_lines(rows))
+
+    results = []
+    for batch_size in batch_sizes:
+        def bulk_import():
+            # A fresh user each time, as deleting the expenses would update the rollup row by row
+            report = import_expenses(create_user(), read_csv(lines), batch_size)
+            assert report['created'] == rows
+        result = {'benchmark': 'bulk_import', 'batch_size': batch_size, 'rows': rows}
+        result.update(measure(bulk_import, repeat))
+        result['rows_per_second'] = rows * 1000 / result['median_ms']
+        results.append(result)
+    return results
@@ -0,0 +1,49 @@
+# coding=utf-8
+"""
+Time the dashboard against the two requests it replaces, the expense list and the
+weekly totals, for the first page and for a month's range. The weekly total
+response cache is cleared before each call, so both sides build their weeks.
+"""
+from __future__ import absolute_import, unicode_literals, print_function, division
+from expense.benchmarks import SIZES, api_request, measure, seeded_user
+from expense.caching import response_cache
+from expense.resources import DashboardResource, ExpenseResource, WeeklyTotalResource
+
+LIMIT = 20
+# The seeded expenses run from the start of 2012 to the end of 2014
+RANGES = (
+    ('first_page', {}),
+    ('range_month', {'date__range': '2013-06-01,2013-06-30'}),
+)
+
+
+def run(sizes=SIZES, limit=LIMIT, repeat=5):
+    """
+    :param sizes: The numbers of expenses of the users to time
+    :param limit: The number of expenses per page
+    :param repeat: The number of timed calls per measurement
+    :return: A list of result dictionaries
+    """
+    dashboard_view = DashboardResource().wrap_view('dispatch_list')
+    expense_view = ExpenseResource().wrap_view('dispatch_list')
+    weekly_view = WeeklyTotalResource().wrap_view('dispatch_list')
+    results = []
+    for size in sizes:
+        user = seeded_user(size)
+        for name, params in RANGES:
+            params = dict({'limit': limit}, **params)
+
+            def dashboard():
+                response_cache().clear()
+                assert dashboard_view(api_request(user, '/api/v1/dashboard/', params)).status_code == 200
+
+            def separate():
+                response_cache().clear()
+                assert expense_view(api_request(user, '/api/v1/expense/', params)).status_code == 200
+                assert weekly_view(api_request(user, '/api/v1/weeklytotal/', {'limit': 0})).status_code == 200
+
+            for mode, func in (('dashboard', dashboard), ('separate', separate)):
+                result = {'benchmark': 'dashboard', 'expenses': size, 'range': name, 'mode': mode}
+                result.update(measure(func, repeat))
+                results.append(result)
+    return results
@@ -0,0 +1,45 @@
+# coding=utf-8
+"""
+Time whole expense list requests, from authentication through to the serialized
+JSON, for the first page and for date ranges of a month and a year, and compare
+the lean list path with Tastypie's full dehydrate for a page of 1000 expenses,
+with every field and with only the date, description and amount.
+"""
+from __future__ import absolute_import, unicode_literals, print_function, division
+from expense.benchmarks import SIZES, api_request, measure, seeded_user
+from expense.resources import ExpenseResource
+
+LIMIT = 20
+# The seeded expenses run from the start of 2012 to the end of 2014
+RANGES = (
+    ('first_page', {}),
+    ('range_month', {'date__range': '2013-06-01,2013-06-30'}),
+    ('range_year', {'date__range': '2013-01-01,2013-12-31'}),
+    ('page_1000', {'limit': 1000}),
+    ('page_1000_sparse', {'limit': 1000, 'fields': 'date,description,amount'}),
+)
+
+
+def run(sizes=SIZES, limit=LIMIT, repeat=5):
+    """
+    :param sizes: The numbers of expenses of the users to time
+    :param limit: The number of expenses per page
+    :param repeat: The number of timed calls per measurement
+    :return: A list of result dictionaries
+    """
+    resource = ExpenseResource()
+    view = resource.wrap_view('dispatch_list')
+    results = []
+    for size in sizes:
+        user = seeded_user(size)
+        for name, params in RANGES:
+            request = api_request(user, '/api/v1/expense/', dict({'limit': limit}, **params))
+
+            def get_list():
+                assert view(request).status_code == 200
+            for lean in (True, False):
+                resource.lean_list = lean
+                result = {'benchmark': 'expense_list', 'expenses': size, 'mode': name, 'lean': lean}
+                result.update(measure(get_list, repeat))
+                results.append(result)
+    return results
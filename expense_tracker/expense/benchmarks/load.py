@@ -0,0 +1,215 @@
+# coding=utf-8
+"""
+A concurrent load test of the expense API. Worker processes, standing in for the
+processes of a WSGI server, send a mix of expense list GETs and create POSTs straight
+to the WSGI application for a fixed time. On SQLite the database is a throwaway file,
+so that the workers contend for its locks as they would in production.
+
+Unlike the other benchmarks it needs a database shared between processes, so it is
+run by its own command:
+
+    $ python manage.py load_test
+    $ python manage.py load_test --workers=8 --duration=30 --write-ratio=0.5
+"""
+from __future__ import absolute_import, unicode_literals, print_function, division
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+from contextlib import contextmanager
+from io import BytesIO
+from django.core.servers.basehttp import get_internal_wsgi_application
+from django.db import connection, connections
+from tastypie.models import ApiKey
+from expense.benchmarks import create_user, median, percentile
+from expense.factories import create_expenses_bulk
+
+# The host name the requests are sent to, which must be allowed by settings.ALLOWED_HOSTS
+LOAD_TEST_HOST = 'testserver'
+# The page of the expense list read by each GET
+LIST_QUERY = 'limit=20&order_by=-date'
+
+
+@contextmanager
+def load_test_database():
+    """
+    Create a throwaway test database for the duration of the load test. SQLite test
+    databases are normally kept in memory, where other processes can't reach them,
+    so on SQLite it is created in a temporary file instead.
+    """
+    settings_dict = connection.settings_dict
+    old_name, old_test_name = settings_dict['NAME'], settings_dict.get('TEST_NAME')
+    directory = None
+    if connection.vendor == 'sqlite':
+        directory = tempfile.mkdtemp()
+        settings_dict['TEST_NAME'] = os.path.join(directory, 'load_test.sqlite3')
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        settings_dict['TEST_NAME'] = old_test_name
+        if directory is not None:
+            # Along with the write-ahead log and shared memory files
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def wsgi_environ(method, path, authorization, query_string='', body=b''):
+    """
+    Build the WSGI environment of an API request, as a WSGI server would.
+    """
+    environ = {
+        'REQUEST_METHOD': method,
+        'PATH_INFO': path,
+        'QUERY_STRING': query_string,
+        'SCRIPT_NAME': '',
+        'SERVER_NAME': LOAD_TEST_HOST,
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_ACCEPT': 'application/json',
+        'HTTP_AUTHORIZATION': authorization,
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(body)),
+    }
+    # The environment holds native strings
+    environ = dict((str(key), str(value)) for key, value in environ.items())
+    environ.update({
+        str('wsgi.input'): BytesIO(body),
+        str('wsgi.errors'): sys.stderr,
+        str('wsgi.url_scheme'): str('http'),
+        str('wsgi.version'): (1, 0),
+        str('wsgi.multithread'): False,
+        str('wsgi.multiprocess'): True,
+        str('wsgi.run_once'): False,
+    })
+    return environ
+
+
+def call_application(application, environ):
+    """
+    Call the WSGI application and read the whole response.
+    :return: The status code of the response
+    """
+    statuses = []
+
+    def start_response(status, headers, exc_info=None):
+        statuses.append(status)
+
+    response = application(environ, start_response)
+    try:
+        for _ in response:
+            pass
+    finally:
+        if hasattr(response, 'close'):
+            response.close()
+    return int(statuses[0].split(' ', 1)[0])
+
+
+def load_worker(args):
+    """
+    Send requests to the WSGI application until the duration is up, as one worker process.
+    :param args: A tuple of the worker's number, the usernames and API keys of the users to
+                 send requests as, the duration in seconds, the fraction of requests which
+                 are writes, and the random seed
+    :return: A tuple of the start and end times, and a list of the kind ('get' or 'post'),
+             status code and time in milliseconds of each request
+    """
+    number, credentials, duration, write_ratio, seed = args
+    rand = random.Random(seed + number)
+    application = get_internal_wsgi_application()
+    records = []
+
+    start = time.time()
+    deadline = start + duration
+    while time.time() < deadline:
+        username, api_key = rand.choice(credentials)
+        authorization = 'ApiKey {0}:{1}'.format(username, api_key)
+        if rand.random() < write_ratio:
+            kind = 'post'
+            body = json.dumps({
+                'description': 'Load test expense',
+                'amount': '{0}.{1:02d}'.format(rand.randint(1, 500), rand.randint(0, 99)),
+                'date': '2014-{0:02d}-{1:02d}T12:00:00'.format(rand.randint(1, 12), rand.randint(1, 28)),
+            }).encode('utf-8')
+            environ = wsgi_environ('POST', '/api/v1/expense/', authorization, body=body)
+        else:
+            kind = 'get'
+            environ = wsgi_environ('GET', '/api/v1/expense/', authorization, query_string=LIST_QUERY)
+        request_start = time.time()
+        status = call_application(application, environ)
+        records.append((kind, status, (time.time() - request_start) * 1000))
+    return start, time.time(), records
+
+
+def summarise(records, elapsed):
+    """
+    Summarise the requests of one kind, or all of them.
+    :param records: A list of the kind, status code and time in milliseconds of each request
+    :param elapsed: The number of seconds the requests were sent over
+    :return: A dictionary of the number of requests and errors (any response other than
+             2xx), the error rate, the throughput per second, the response time percentiles
+             in milliseconds, and the number of responses with each status code
+    """
+    timings = [timing for _, _, timing in records]
+    errors = sum(1 for _, status, _ in records if not 200 <= status < 300)
+    return {
+        'requests': len(records),
+        'errors': errors,
+        'error_rate': errors / len(records) if records else 0,
+        'throughput_rps': len(records) / elapsed if elapsed else 0,
+        'median_ms': median(timings) if timings else None,
+        'p90_ms': percentile(timings, 90) if timings else None,
+        'p99_ms': percentile(timings, 99) if timings else None,
+        'max_ms': max(timings) if timings else None,
+        'statuses': dict((str(status), count) for status, count in Counter(
+            status for _, status, _ in records).items()),
+    }
+
+
+def run_load_test(workers=4, duration=10, write_ratio=0.5, users=4, expenses=1000, seed=0):
+    """
+    Seed users in a throwaway database, then load the API from several worker processes.
+    :param workers: The number of worker processes
+    :param duration: The number of seconds each worker sends requests for
+    :param write_ratio: The fraction of requests which create an expense, the rest list expenses
+    :param users: The number of users the requests are shared between
+    :param expenses: The number of expenses each user is seeded with
+    :param seed: The random seed of the workers' requests
+    :return: A tuple of a dictionary describing the database, and the summary of the GETs,
+             POSTs and all requests
+    """
+    with load_test_database():
+        credentials = []
+        for _ in range(users):
+            user = create_user()
+            create_expenses_bulk(user, expenses)
+            credentials.append((user.username, ApiKey.objects.get(user=user).key))
+
+        database = {'vendor': connection.vendor}
+        if connection.vendor == 'sqlite':
+            cursor = connection.cursor()
+            cursor.execute('PRAGMA journal_mode')
+            database['journal_mode'] = cursor.fetchone()[0]
+
+        # Each worker opens its own connections, as a forked connection can't be shared
+        for conn in connections.all():
+            conn.close()
+        pool = multiprocessing.Pool(workers)
+        try:
+            results = pool.map(load_worker, [(number, credentials, duration, write_ratio, seed)
+                                             for number in range(workers)])
+        finally:
+            pool.close()
+            pool.join()
+
+    elapsed = max(end for _, end, _ in results) - min(start for start, _, _ in results)
+    records = [record for _, _, worker_records in results for record in worker_records]
+    summaries = dict((kind, summarise([record for record in records if record[0] == kind], elapsed))
+                     for kind in ('get', 'post'))
+    summaries['all'] = summarise(records, elapsed)
+    return database, summaries
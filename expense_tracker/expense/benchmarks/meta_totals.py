@@ -0,0 +1,42 @@
+# coding=utf-8
+"""
+Time the expense list meta totals (total_amount, average etc.) for users with a
+growing number of expenses, for growing page sizes and over date ranges. As the
+totals are read from the date rollup, or else a single database aggregate, their
+cost should not depend on the page size, and only long ranges read the rollup.
+"""
+from __future__ import absolute_import, unicode_literals, print_function, division
+from expense.benchmarks import SIZES, api_request, measure, seeded_user
+from expense.resources import ExpenseResource
+
+PAGE_SIZES = (20, 100, 1000)
+# The seeded expenses span 2012 to 2014. A year and a half, a month and a fortnight.
+RANGES = ('2012-03-15,2013-09-20', '2013-06-01,2013-07-01', '2013-06-01,2013-06-15')
+
+
+def run(sizes=SIZES, page_sizes=PAGE_SIZES, ranges=RANGES, repeat=5):
+    """
+    :param sizes: The numbers of expenses of the users to time
+    :param page_sizes: The list page sizes (limit) to request
+    :param ranges: The date__range filters to request, with the first page size
+    :param repeat: The number of timed calls per measurement
+    :return: A list of result dictionaries
+    """
+    resource = ExpenseResource()
+    results = []
+    for size in sizes:
+        user = seeded_user(size)
+        params = [{'limit': page_size} for page_size in page_sizes]
+        params.extend({'limit': page_sizes[0], 'date__range': date_range} for date_range in ranges)
+        for data in params:
+            request = api_request(user, '/api/v1/expense/', data)
+
+            def get_list_totals():
+                # The aggregate is kept on the request, so drop it to run the queries every time
+                request.__dict__.pop('_expense_list_aggregate', None)
+                resource.get_list_totals(request)
+            result = {'benchmark': 'meta_totals', 'expenses': size}
+            result.update(data)
+            result.update(measure(get_list_totals, repeat))
+            results.append(result)
+    return results
@@ -0,0 +1,47 @@
+# coding=utf-8
+"""
+Compare offset and keyset (cursor) pagination of the expense list at increasing
+page depths. Offset pages get slower the deeper they are, as the database has to
+step over every earlier row, while cursor pages should cost the same at any depth.
+"""
+from __future__ import absolute_import, unicode_literals, print_function, division
+from expense.benchmarks import SIZES, api_request, measure, seeded_user
+from expense.paginators import KeysetPaginator
+from expense.resources import ExpenseResource
+
+PAGES = (1, 100, 1000)
+LIMIT = 20
+
+
+def run(sizes=SIZES, pages=PAGES, limit=LIMIT, repeat=5):
+    """
+    :param sizes: The numbers of expenses of the users to time
+    :param pages: The page numbers to time, pages beyond the user's expenses are skipped
+    :param limit: The number of expenses per page
+    :param repeat: The number of timed calls per measurement
+    :return: A list of result dictionaries
+    """
+    resource = ExpenseResource()
+    results = []
+    for size in sizes:
+        user = seeded_user(size)
+        objects = resource.obj_get_list(bundle=resource.build_bundle(request=api_request(user, '/api/v1/expense/')))
+        ordered = objects.order_by('date', 'id')
+
+        for page in pages:
+            offset = (page - 1) * limit
+            if offset >= size:
+                continue
+            # The cursor for a page is built from the last expense of the page before it
+            cursor = KeysetPaginator.encode_cursor(ordered[offset - 1]) if offset else ''
+            modes = (
+                ('offset', {'limit': limit, 'offset': offset}),
+                ('cursor', {'limit': limit, 'cursor': cursor}),
+                ('cursor_without_count', {'limit': limit, 'cursor': cursor, 'count': 'false'}),
+            )
+            for mode, params in modes:
+                paginator = KeysetPaginator(params, ordered, resource_uri='/api/v1/expense/', limit=limit)
+                result = {'benchmark': 'pagination', 'expenses': size, 'mode': mode, 'page': page}
+                result.update(measure(lambda: list(paginator.page()['objects']), repeat))
+                results.append(result)
+    return results
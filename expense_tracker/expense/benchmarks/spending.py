@@ -0,0 +1,28 @@
+# coding=utf-8
+"""
+Time the spending analytics of users with a growing number of expenses, over every
+week and over a quarter, without the response cache.
+"""
+from __future__ import absolute_import, unicode_literals, print_function, division
+import datetime
+from expense import analytics
+from expense.analytics import spending_analytics
+from expense.benchmarks import SIZES, measure, seeded_user
+
+
+def run(sizes=SIZES, repeat=5):
+    """
+    :param sizes: The numbers of expenses of the users to time
+    :param repeat: The number of timed calls per measurement
+    :return: A list of result dictionaries
+    """
+    results = []
+    for size in sizes:
+        user = seeded_user(size)
+        for weeks, first, last in (('all', None, None),
+                                   ('quarter', datetime.date(2013, 1, 1), datetime.date(2013, 3, 31))):
+            result = {'benchmark': 'spending', 'expenses': size, 'weeks': weeks,
+                      'numpy': analytics.numpy is not None}
+            result.update(measure(lambda: spending_analytics(user, first, last), repeat))
+            results.append(result)
+    return results
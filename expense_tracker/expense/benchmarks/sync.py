@@ -0,0 +1,43 @@
+# coding=utf-8
+"""
+Time syncing a user's expenses: the first page of a full sync, and syncs since a
+token with no changes and with ten changed expenses. The syncs since a token read
+only the changed rows, so their cost should not grow with the number of expenses.
+"""
+from __future__ import absolute_import, unicode_literals, print_function, division
+from expense.benchmarks import SIZES, api_request, measure, seeded_user
+from expense.models import Expense, ExpenseVersion
+from expense.resources import ExpenseResource
+from expense.sync import encode_sync_token
+
+CHANGES = 10
+
+
+def current_token(user):
+    return encode_sync_token(ExpenseVersion.objects.filter(user=user).values_list('version', flat=True).first() or 0)
+
+
+def run(sizes=SIZES, repeat=5):
+    """
+    :param sizes: The numbers of expenses of the users to time
+    :param repeat: The number of timed calls per measurement
+    :return: A list of result dictionaries
+    """
+    view = ExpenseResource().wrap_view('sync')
+    results = []
+    for size in sizes:
+        user = seeded_user(size)
+        before = current_token(user)
+        for expense in Expense.objects.filter(user=user).order_by('-id')[:CHANGES]:
+            expense.save()
+        after = current_token(user)
+
+        for name, since in (('first_page', ''), ('unchanged', after), ('changes', before)):
+            request = api_request(user, '/api/v1/expense/sync/', {'since': since})
+
+            def sync():
+                assert view(request).status_code == 200
+            result = {'benchmark': 'sync', 'expenses': size, 'mode': name}
+            result.update(measure(sync, repeat))
+            results.append(result)
+    return results
@@ -0,0 +1,32 @@
+# coding=utf-8
+"""
+Time the bucketed totals API for each bucket over all of a user's expenses, with
+the response cache cleared before each call so the totals are aggregated every time.
+"""
+from __future__ import absolute_import, unicode_literals, print_function, division
+from expense.aggregation import BUCKETS
+from expense.benchmarks import SIZES, api_request, measure, seeded_user
+from expense.caching import response_cache
+from expense.resources import TotalResource
+
+
+def run(sizes=SIZES, repeat=5):
+    """
+    :param sizes: The numbers of expenses of the users to time
+    :param repeat: The number of timed calls per measurement
+    :return: A list of result dictionaries
+    """
+    view = TotalResource().wrap_view('dispatch_list')
+    results = []
+    for size in sizes:
+        user = seeded_user(size)
+        for bucket in BUCKETS:
+            request = api_request(user, '/api/v1/total/', {'bucket': bucket, 'limit': 0})
+
+            def get_totals():
+                response_cache().clear()
+                assert view(request).status_code == 200
+            result = {'benchmark': 'totals', 'expenses': size, 'bucket': bucket}
+            result.update(measure(get_totals, repeat))
+            results.append(result)
+    return results
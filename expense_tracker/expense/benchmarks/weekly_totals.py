@@ -0,0 +1,45 @@
+# coding=utf-8
+"""
+Compare the ways of building a user's weekly totals: in Python from every expense
+(_build_weekly_totals), with one aggregate query (weekly_totals), and the weekly
+total API reading the rollup, with and without the response cache.
+"""
+from __future__ import absolute_import, unicode_literals, print_function, division
+from expense.aggregation import weekly_totals
+from expense.benchmarks import SIZES, api_request, measure, seeded_user
+from expense.caching import response_cache
+from expense.models import Expense
+from expense.resources import WeeklyTotalResource, _build_weekly_totals
+
+
+def run(sizes=SIZES, repeat=5):
+    """
+    :param sizes: The numbers of expenses of the users to time
+    :param repeat: The number of timed calls per measurement
+    :return: A list of result dictionaries
+    """
+    view = WeeklyTotalResource().wrap_view('dispatch_list')
+    results = []
+    for size in sizes:
+        user = seeded_user(size)
+        expenses = Expense.objects.filter(user=user)
+        request = api_request(user, '/api/v1/weeklytotal/')
+
+        def get_uncached():
+            response_cache().clear()
+            assert view(request).status_code == 200
+
+        def get_cached():
+            assert view(request).status_code == 200
+
+        modes = (
+            ('python', lambda: _build_weekly_totals(expenses)),
+            ('database', lambda: weekly_totals(expenses)),
+            ('api_uncached', get_uncached),
+            ('api_cached', get_cached),
+        )
+        for name, func in modes:
+            result = {'benchmark': 'weekly_totals', 'expenses': size, 'mode': name}
+            result.update(measure(func, repeat))
+            results.append(result)
+    return results
@@ -0,0 +1,42 @@
+# coding=utf-8
+"""
+Time creating and deleting single expenses through the API, including the
+signals which keep the weekly rollup and expense version up to date.
+"""
+from __future__ import absolute_import, unicode_literals, print_function, division
+from expense.benchmarks import SIZES, api_request, measure, seeded_user
+from expense.resources import ExpenseResource
+
+
+def run(sizes=SIZES, repeat=5):
+    """
+    :param sizes: The numbers of expenses of the users to time
+    :param repeat: The number of timed calls per measurement
+    :return: A list of result dictionaries
+    """
+    resource = ExpenseResource()
+    list_view = resource.wrap_view('dispatch_list')
+    detail_view = resource.wrap_view('dispatch_detail')
+    data = {'description': 'Benchmark expense', 'amount': '12.34', 'date': '2013-06-15T12:00:00'}
+
+    results = []
+    for size in sizes:
+        user = seeded_user(size)
+        created = []
+
+        def create():
+            response = list_view(api_request(user, '/api/v1/expense/', data, method='post'))
+            assert response.status_code == 201
+            created.append(int(response['Location'].rstrip('/').rsplit('/', 1)[-1]))
+
+        def delete():
+            pk = created.pop()
+            response = detail_view(api_request(user, '/api/v1/expense/{0}/'.format(pk), method='delete'), pk=pk)
+            assert response.status_code == 204
+
+        # Every expense created is deleted again, so the user is left as it was
+        for name, func in (('create', create), ('delete', delete)):
+            result = {'benchmark': 'writes', 'expenses': size, 'mode': name}
+            result.update(measure(func, repeat))
+            results.append(result)
+    return results
@@ -0,0 +1,53 @@
+# coding=utf-8
+"""
+The cache of serialized API responses, and counters of how often it is hit.
+"""
+from __future__ import absolute_import, unicode_literals, print_function, division
+from django.conf import settings
+from django.core.cache import get_cache
+
+HITS_KEY = 'responses:hits'
+MISSES_KEY = 'responses:misses'
+
+_cache = None
+
+
+def response_cache():
+    """
+    The cache holding serialized API responses, as configured by settings.RESPONSE_CACHE.
+    """
+    global _cache
+    if _cache is None:
+        _cache = get_cache(getattr(settings, 'RESPONSE_CACHE', 'default'))
+    return _cache
+
+
+def count_lookup(hit):
+    """
+    Count a hit or miss of the response cache. The counters are kept in the cache
+    itself, so they are shared by every process using a shared backend.
+    :param hit: True if the response was found in the cache
+    :return: None
+    """
+    key = HITS_KEY if hit else MISSES_KEY
+    response_cache().add(key, 0, timeout=None)
+    try:
+        response_cache().incr(key)
+    except ValueError:
+        # The counter was evicted between the add and the incr
+        pass
+
+
+def cache_stats():
+    """
+    :return: A dictionary of the number of hits and misses of the response cache
+    """
+    counts = response_cache().get_many([HITS_KEY, MISSES_KEY])
+    return {'hits': counts.get(HITS_KEY, 0), 'misses': counts.get(MISSES_KEY, 0)}
+
+
+def reset_cache_stats():
+    """
+    Set the hit and miss counters back to zero.
+    """
+    response_cache().delete_many([HITS_KEY, MISSES_KEY])
@@ -0,0 +1,83 @@
+# coding=utf-8
+"""
+Make SQLite hold up under several worker processes writing at once. Each new
+connection is set up with settings.SQLITE_PRAGMAS (write-ahead logging, so readers
+aren't blocked by a writer, and a busy timeout, so writers queue for the lock
+rather than fail), and write transactions which still find the database locked
+are retried with backoff by retry_locked_writes.
+"""
+from __future__ import absolute_import, unicode_literals, print_function, division
+import random
+import re
+import time
+from functools import wraps
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import OperationalError, transaction
+from django.utils import six
+
+# The pragmas set on new SQLite connections when settings.SQLITE_PRAGMAS isn't set
+DEFAULT_SQLITE_PRAGMAS = ()
+# The number of times a locked write transaction is tried, and the delay in seconds
+# before the first retry (doubled for each retry after it), when not set in settings
+DEFAULT_WRITE_ATTEMPTS = 1
+DEFAULT_WRITE_RETRY_DELAY = 0.05
+
+PRAGMA_NAME = re.compile(r'^\w+$')
+PRAGMA_VALUE = re.compile(r'^-?\w+$')
+
+
+def sqlite_pragmas():
+    """
+    The pragmas to set on new SQLite connections, from settings.SQLITE_PRAGMAS.
+    :return: A list of name and value tuples, in the order they are set
+    """
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', DEFAULT_SQLITE_PRAGMAS)
+    if isinstance(pragmas, dict):
+        pragmas = sorted(pragmas.items())
+    for name, value in pragmas:
+        # Pragmas can't take parameters, so only plain names and numbers are allowed
+        if not PRAGMA_NAME.match(name) or not PRAGMA_VALUE.match(six.text_type(value)):
+            raise ImproperlyConfigured('Invalid SQLite pragma {0} = {1!r}'.format(name, value))
+    return list(pragmas)
+
+
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    """
+    Set the pragmas from settings.SQLITE_PRAGMAS on new SQLite connections.
+    """
+    if connection.vendor == 'sqlite':
+        for name, value in sqlite_pragmas():
+            connection.connection.execute('PRAGMA {0} = {1}'.format(name, value)).fetchall()
+
+
+def is_lock_error(error):
+    """
+    Whether a database error is SQLite giving up waiting for another connection's lock.
+    """
+    return isinstance(error, OperationalError) and 'locked' in six.text_type(error)
+
+
+def retry_locked_writes(func):
+    """
+    Decorate a function which writes in its own transaction, so that it is tried again
+    if the database is locked, up to settings.DATABASE_WRITE_ATTEMPTS times in all. Each
+    retry waits twice as long as the last, from settings.DATABASE_WRITE_RETRY_DELAY,
+    with jitter so that the writers which collided don't collide again.
+
+    A locked write inside an outer transaction can't be retried on its own, as the
+    whole transaction has to roll back, so the error is raised straight away.
+    """
+    @wraps(func)
+    def inner(*args, **kwargs):
+        attempts = getattr(settings, 'DATABASE_WRITE_ATTEMPTS', DEFAULT_WRITE_ATTEMPTS)
+        delay = getattr(settings, 'DATABASE_WRITE_RETRY_DELAY', DEFAULT_WRITE_RETRY_DELAY)
+        for attempt in range(1, attempts + 1):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as error:
+                if attempt == attempts or not is_lock_error(error) or transaction.get_connection().in_atomic_block:
+                    raise
+            time.sleep(random.uniform(delay / 2, delay))
+            delay *= 2
+    return inner
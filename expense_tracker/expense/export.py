@@ -0,0 +1,74 @@
+# coding=utf-8
+"""
+Write a user's expenses out as CSV or newline delimited JSON, one chunk of rows at
+a time, so that exports of any size can be streamed with a flat memory footprint.
+"""
+from __future__ import absolute_import, unicode_literals, print_function, division
+import csv
+import json
+from django.utils import six, timezone
+from expense.paginators import after_keyset
+
+EXPORT_FIELDS = ('id', 'date', 'description', 'amount', 'comment')
+
+
+def iter_expense_rows(expenses, chunk_size=1000):
+    """
+    Read the expenses in date order, chunk_size rows per query. Each chunk starts
+    after the last row of the previous one rather than at an offset, so every query
+    is a short range scan of the (user, date) index.
+    :param expenses: A queryset of expense objects
+    :param chunk_size: The number of rows fetched per query
+    :return: A generator of dictionaries, with the date in the local time zone
+    """
+    expenses = expenses.order_by('date', 'id').values_list(*EXPORT_FIELDS)
+    chunk = list(expenses[:chunk_size])
+    while chunk:
+        for row in chunk:
+            row = dict(zip(EXPORT_FIELDS, row))
+            row['date'] = timezone.localtime(row['date']).isoformat()
+            row['amount'] = six.text_type(row['amount'])
+            yield row
+        last_id, last_date = chunk[-1][0], chunk[-1][1]
+        chunk = list(after_keyset(expenses, last_date, last_id)[:chunk_size])
+
+
+class _Echo(object):
+    """
+    A file-like object which hands back whatever is written to it, so the csv
+    module can format one row at a time.
+    """
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    """
+    Format the rows as CSV, starting with a header line.
+    """
+    writer = csv.writer(_Echo())
+
+    def encode(values):
+        # The Python 2 csv module only handles byte strings
+        if six.PY2:
+            return [six.text_type(value).encode('utf-8') for value in values]
+        return values
+
+    yield writer.writerow(encode(EXPORT_FIELDS))
+    for row in rows:
+        yield writer.writerow(encode([row[field] for field in EXPORT_FIELDS]))
+
+
+def ndjson_lines(rows):
+    """
+    Format the rows as newline delimited JSON, one object per line.
+    """
+    for row in rows:
+        yield json.dumps(row, sort_keys=True) + '\n'
+
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', csv_lines),
+    'ndjson': ('application/x-ndjson; charset=utf-8', ndjson_lines),
+}
@@ -1,5 +1,11 @@
+import datetime
+import random
+from decimal import Decimal
 import factory
 from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.utils import six, timezone
+from expense.models import Expense
 
 
 class UserFactory(factory.django.DjangoModelFactory):
@@ -7,3 +13,50 @@ class UserFactory(factory.django.DjangoModelFactory):
     username = factory.Sequence(lambda n: "test%03d" % n)
     password = factory.PostGenerationMethodCall('set_password', 'password')
     email = factory.LazyAttribute(lambda u: "{0}@test.com".format(u.username))
+
+
+class ExpenseFactory(factory.django.DjangoModelFactory):
+    FACTORY_FOR = Expense
+    user = factory.SubFactory(UserFactory)
+    date = factory.Sequence(lambda n: timezone.now() - datetime.timedelta(hours=n))
+    description = factory.Sequence(lambda n: "Expense %d" % n)
+    amount = factory.Sequence(lambda n: Decimal(n % 1000) + Decimal('0.99'))
+    comment = factory.Sequence(lambda n: "Comment for expense %d" % n)
+
+
+def create_expenses_bulk(user, count, start=None, days=3 * 365, batch_size=1000, seed=0):
+    """
+    Quickly create a large number of expenses for a user. The factories save one
+    row per INSERT, which is far too slow for seeding benchmark data, so this
+    builds the rows in memory and writes them with bulk_create, then rebuilds the
+    user's rollups (which bulk_create bypasses) once at the end.
+    :param user: The user who will own the expenses
+    :param count: The number of expenses to create
+    :param start: The datetime of the earliest expense, defaults to the start of 2012 so the
+                  same seed always gives the same expenses
+    :param days: The number of days over which the expenses are spread
+    :param batch_size: The number of rows inserted per query
+    :param seed: Seed for the random amounts and dates, so runs are repeatable
+    :return: None
+    """
+    rand = random.Random(seed)
+    if start is None:
+        start = datetime.datetime(2012, 1, 1, tzinfo=timezone.utc)
+    seconds = days * 24 * 60 * 60
+
+    batch = []
+    for n in range(count):
+        batch.append(Expense(
+            user=user,
+            date=start + datetime.timedelta(seconds=rand.randint(0, seconds)),
+            description="Expense %d" % n,
+            amount=Decimal(rand.randint(1, 50000)).scaleb(-2),
+            comment="Comment for expense %d" % n,
+        ))
+        if len(batch) == batch_size:
+            Expense.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        Expense.objects.bulk_create(batch)
+    call_command('weekly_rollup', username=user.username, stdout=six.StringIO())
+    call_command('date_rollup', username=user.username, stdout=six.StringIO())
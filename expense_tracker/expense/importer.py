@@ -0,0 +1,162 @@
+# coding=utf-8
+"""
+Import expenses in bulk from CSV or JSON. Rows are validated one at a time as they
+are read and written with bulk_create, so an import costs a handful of INSERTs
+rather than one request and transaction per expense.
+"""
+from __future__ import absolute_import, unicode_literals, print_function, division
+import csv
+import datetime
+import re
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+from django.db import transaction
+from django.utils import six, timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from pytz.exceptions import InvalidTimeError
+from expense.models import (Expense, adjust_date_rollup, adjust_weekly_rollup, bump_expense_version,
+                            date_rollup_buckets, expense_cents, expense_local_date, expense_year_week)
+
+# An amount with at most two decimal places, whose cents are worked out without the
+# (slow, on Python 2) decimal arithmetic. The amount is still saved as a Decimal, which
+# Django's DecimalField converts and formats itself, so the decimal module isn't avoided.
+_PLAIN_AMOUNT = re.compile(r'^(-?)(\d{1,6})(?:\.(\d{1,2}))?$')
+
+
+def read_csv(lines):
+    """
+    Read expenses from CSV with a header line naming the columns. Columns other
+    than date, description, amount and comment (e.g. the id of an export) are ignored.
+    :param lines: An iterable of lines, such as an open file or a request
+    :return: A generator of dictionaries
+    """
+    if six.PY2:
+        # The Python 2 csv module only handles byte strings
+        for row in csv.DictReader(lines):
+            yield dict((key.decode('utf-8'), value.decode('utf-8') if value is not None else None)
+                       for key, value in row.items() if key is not None)
+    else:
+        for row in csv.DictReader(line.decode('utf-8') if isinstance(line, bytes) else line for line in lines):
+            yield row
+
+
+def clean_row(row):
+    """
+    Validate one row of an import and convert it to Expense field values.
+    :param row: A dictionary of strings (or numbers from JSON)
+    :return: A tuple of the field values (plus the amount in cents) and a dictionary of errors,
+             one of which is None
+    """
+    if not isinstance(row, dict):
+        return None, {'__all__': 'Each expense must be an object'}
+
+    errors = {}
+    values = {}
+
+    date = row.get('date')
+    if isinstance(date, six.string_types):
+        date = date.strip()
+        try:
+            parsed = parse_datetime(date)
+            if parsed is None and parse_date(date) is not None:
+                # A date on its own is taken to be midnight
+                parsed = parse_datetime(date + 'T00:00:00')
+        except ValueError:
+            parsed = None
+        date = parsed
+    elif not isinstance(date, datetime.datetime):
+        date = None
+    if date is not None and timezone.is_naive(date):
+        try:
+            date = timezone.make_aware(date, timezone.get_default_timezone())
+        except InvalidTimeError:
+            # The time is skipped or repeated when daylight saving starts or ends
+            errors['date'] = 'The time does not exist or is ambiguous in the local time zone, give a UTC offset'
+            date = False
+    if date is None:
+        errors['date'] = 'A date or date and time is required, e.g. 2014-07-01T12:00:00'
+    elif date:
+        values['date'] = date
+
+    description = six.text_type(row.get('description') or '')
+    if not description.strip():
+        errors['description'] = 'A description is required'
+    elif len(description) > Expense._meta.get_field('description').max_length:
+        errors['description'] = 'The description is too long'
+    values['description'] = description
+
+    amount = six.text_type(row.get('amount') or 0).strip()
+    plain = _PLAIN_AMOUNT.match(amount)
+    if plain:
+        sign, units, fraction = plain.groups()
+        cents = int(units) * 100 + int((fraction or '').ljust(2, '0'))
+        values['cents'] = -cents if sign else cents
+        values['amount'] = Decimal(amount)
+    else:
+        try:
+            amount = Decimal(amount)
+            if not amount.is_finite():
+                raise InvalidOperation
+            # The database stores the amount rounded to its decimal places, so check the rounded value fits
+            values['cents'] = expense_cents(amount)
+            values['amount'] = Decimal(values['cents']).scaleb(-2)
+        except (InvalidOperation, ValueError, ArithmeticError):
+            errors['amount'] = 'The amount must be a number with at most 6 digits before the decimal point'
+
+    values['comment'] = six.text_type(row.get('comment') or '')
+
+    if errors:
+        return None, errors
+    return values, None
+
+
+def import_expenses(user, rows, batch_size=1000):
+    """
+    Validate and save expenses for a user, in one transaction. Valid rows are saved
+    even if other rows are invalid; the invalid rows are listed in the report.
+    :param user: The user who will own the expenses
+    :param rows: An iterable of dictionaries, e.g. from read_csv or a JSON array
+    :param batch_size: The number of expenses saved per INSERT
+    :return: A report dictionary with the number created and the errors of each invalid row
+    """
+    created = 0
+    errors = []
+    # Expenses saved with bulk_create skip the save signals, so the rollups and version are updated here
+    weeks = defaultdict(lambda: [0, 0])
+    dates = defaultdict(lambda: [0, 0])
+    revision = None
+
+    with transaction.atomic():
+        batch = []
+        for number, row in enumerate(rows, 1):
+            values, row_errors = clean_row(row)
+            if row_errors:
+                errors.append({'row': number, 'errors': row_errors})
+                continue
+            if revision is None:
+                # Every expense of the import is stamped with the same version
+                revision = bump_expense_version(user.pk)
+
+            week = weeks[expense_year_week(values['date'])]
+            week[0] += 1
+            week[1] += values['cents']
+            for bucket in date_rollup_buckets(expense_local_date(values['date'])):
+                dates[bucket][0] += 1
+                dates[bucket][1] += values['cents']
+            del values['cents']
+            batch.append(Expense(user=user, revision=revision, **values))
+
+            if len(batch) >= batch_size:
+                Expense.objects.bulk_create(batch)
+                created += len(batch)
+                batch = []
+        if batch:
+            Expense.objects.bulk_create(batch)
+            created += len(batch)
+
+        for (year, week_number), (count, cents) in weeks.items():
+            adjust_weekly_rollup(user.pk, year, week_number, count, cents)
+        for (bucket, start_date), (count, cents) in dates.items():
+            adjust_date_rollup(user.pk, bucket, start_date, count, cents)
+
+    return {'created': created, 'errors': errors}
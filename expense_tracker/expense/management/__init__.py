@@ -0,0 +1,49 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals, print_function, division
+from django.db import connections
+from django.db.models.signals import post_syncdb
+from expense import models as expense_models
+
+
+def create_expense_id_sequence(sender, db, verbosity=1, **kwargs):
+    """
+    Make sure expense ids are never given out again (see expense.archive.create_id_sequence)
+    before the search index adds its triggers to the expense table. That rebuilds the
+    expense table, so an existing one is left to the archive_expenses command.
+    """
+    from expense.archive import create_id_sequence, has_id_sequence
+    connection = connections[db]
+    if has_id_sequence(connection):
+        return
+    if expense_models.Expense.objects.using(db).exists():
+        if verbosity >= 1:
+            print('The expense table has to be rebuilt before expenses are archived, '
+                  'run "manage.py archive_expenses --id-sequence" to do so')
+    elif create_id_sequence(connection) and verbosity >= 1:
+        print('Creating the expense id sequence')
+
+
+def create_expense_search_index(sender, db, verbosity=1, **kwargs):
+    """
+    Create the full-text search index of the expenses (see expense.search) once syncdb
+    has created the expense table. Imported here as syncdb loads every app's management
+    module before it runs.
+    """
+    from expense.search import create_search_index
+    if create_search_index(connections[db]) and verbosity >= 1:
+        print('Creating the expense search index')
+
+
+def create_expense_history_view(sender, db, verbosity=1, **kwargs):
+    """
+    Create the view of the recent and archived expenses (see expense.archive) once
+    syncdb has created both tables.
+    """
+    from expense.archive import create_history_view
+    if create_history_view(connections[db]) and verbosity >= 1:
+        print('Creating the expense history view')
+
+
+post_syncdb.connect(create_expense_id_sequence, sender=expense_models)
+post_syncdb.connect(create_expense_search_index, sender=expense_models)
+post_syncdb.connect(create_expense_history_view, sender=expense_models)
@@ -0,0 +1,68 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals, print_function, division
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+
+class Command(BaseCommand):
+    help = ('Move the expenses from before the start of the oldest year kept (see settings.ARCHIVE_KEEP_YEARS) '
+            'into the archive, or with --restore, move archived expenses back. The API reads archived '
+            'expenses as before, and their totals are unchanged.')
+    option_list = BaseCommand.option_list + (
+        make_option('--before', action='store', dest='before', default=None,
+                    help='Archive the expenses before this date (YYYY-MM-DD) instead, or with --restore, '
+                         'restore the expenses on or after it.'),
+        make_option('--user', action='store', dest='username', default=None,
+                    help='Only archive or restore the expenses of this user.'),
+        make_option('--restore', action='store_true', dest='restore', default=False,
+                    help='Move archived expenses back into the expense table, all of them unless --before is given.'),
+        make_option('--id-sequence', action='store_true', dest='id_sequence', default=False,
+                    help='Only make sure expense ids are never given out again, which rebuilds the expense '
+                         'table on SQLite. Archiving does so first too.'),
+        make_option('--batch-size', action='store', dest='batch_size', type='int', default=500,
+                    help='The number of expenses moved per transaction.'),
+    )
+
+    def handle(self, *args, **options):
+        # Imported here as the models need the app cache to be fully loaded.
+        from django.contrib.auth.models import User
+        from expense.aggregation import local_midnight
+        from django.db import connections, router
+        from expense.archive import archive_cutoff, archive_expenses, create_id_sequence, restore_expenses
+        from expense.models import Expense
+
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('The batch size must be at least 1')
+        user = None
+        if options['username']:
+            try:
+                user = User.objects.get(username=options['username'])
+            except User.DoesNotExist:
+                raise CommandError('There is no user "{0}"'.format(options['username']))
+        before = None
+        if options['before']:
+            try:
+                before = parse_date(options['before'])
+            except ValueError:
+                before = None
+            if before is None:
+                raise CommandError("'{0}' is not a date, use YYYY-MM-DD".format(options['before']))
+
+        if options['restore']:
+            restored = restore_expenses(local_midnight(before) if before else None, user, batch_size=batch_size)
+            self.stdout.write('Restored {0} expenses'.format(restored))
+            return
+
+        # The ids of archived expenses mustn't be given to new ones
+        if create_id_sequence(connections[router.db_for_write(Expense)]):
+            self.stdout.write('Rebuilt the expense table so that expense ids are never given out again')
+        elif options['id_sequence']:
+            self.stdout.write('Expense ids are already never given out again')
+        if options['id_sequence']:
+            return
+
+        before = before or archive_cutoff()
+        archived = archive_expenses(local_midnight(before), user, batch_size)
+        self.stdout.write('Archived {0} expenses from before {1}'.format(archived, before))
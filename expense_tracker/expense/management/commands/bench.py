@@ -0,0 +1,81 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals, print_function, division
+import inspect
+import json
+import platform
+import subprocess
+from optparse import make_option
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils.importlib import import_module
+
+BENCHMARKS = ('expense_list', 'meta_totals', 'pagination', 'weekly_totals', 'writes', 'authentication',
+              'bulk_import', 'sync', 'dashboard', 'totals', 'spending', 'archive')
+
+
+def git_revision():
+    """
+    The commit being benchmarked, or None outside a git checkout.
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.STDOUT).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    args = '[benchmark ...]'
+    help = ('Run the expense benchmarks against a throwaway test database and print the results as JSON. '
+            'Available benchmarks: {0}'.format(', '.join(BENCHMARKS)))
+    option_list = BaseCommand.option_list + (
+        make_option('--repeat', action='store', dest='repeat', type='int', default=5,
+                    help='The number of timed calls per measurement.'),
+        make_option('--sizes', action='store', dest='sizes', default=None,
+                    help='Comma separated numbers of expenses to seed users with, e.g. 1000,100000. '
+                         'Defaults to 1000, 100000 and 1000000.'),
+    )
+
+    def handle(self, *args, **options):
+        names = args or BENCHMARKS
+        for name in names:
+            if name not in BENCHMARKS:
+                raise CommandError('Unknown benchmark "{0}"'.format(name))
+        if options['repeat'] < 1:
+            raise CommandError('The repeat must be at least 1')
+
+        # Debug mode keeps a copy of every query, which skews both the timings and memory use.
+        settings.DEBUG = False
+        # Imported here as the benchmarks need the app cache to be fully loaded.
+        from expense.benchmarks import SIZES, benchmark_database
+
+        sizes = SIZES
+        if options['sizes']:
+            try:
+                sizes = tuple(int(size) for size in options['sizes'].split(','))
+            except ValueError:
+                raise CommandError('The sizes must be a comma separated list of numbers')
+
+        results = []
+        with benchmark_database():
+            for name in names:
+                benchmark = import_module('expense.benchmarks.{0}'.format(name))
+                kwargs = {'repeat': options['repeat']}
+                # Benchmarks which don't depend on the number of expenses have no sizes
+                if 'sizes' in inspect.getargspec(benchmark.run).args:
+                    kwargs['sizes'] = sizes
+                results.extend(benchmark.run(**kwargs))
+
+        self.stdout.write(json.dumps({
+            'meta': {
+                'revision': git_revision(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'repeat': options['repeat'],
+                'sizes': sizes,
+            },
+            'results': results,
+        }, indent=2, sort_keys=True))
@@ -0,0 +1,23 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals, print_function, division
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from expense.caching import cache_stats, reset_cache_stats
+
+
+class Command(BaseCommand):
+    help = ('Print the number of hits and misses of the response cache, and the hit ratio. With a '
+            'per-process cache (e.g. locmem) only this process is counted, so use a shared cache.')
+    option_list = BaseCommand.option_list + (
+        make_option('--reset', action='store_true', dest='reset', default=False,
+                    help='Set the counters back to zero after printing them.'),
+    )
+
+    def handle(self, *args, **options):
+        stats = cache_stats()
+        lookups = stats['hits'] + stats['misses']
+        ratio = stats['hits'] * 100 / lookups if lookups else 0
+        self.stdout.write('Hits: {0}, misses: {1}, hit ratio: {2:.1f}%'.format(stats['hits'], stats['misses'], ratio))
+        if options['reset']:
+            reset_cache_stats()
+            self.stdout.write('The counters have been reset')
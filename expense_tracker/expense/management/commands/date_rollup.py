@@ -0,0 +1,63 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals, print_function, division
+from collections import defaultdict
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the daily, monthly and yearly rollup of every user from their expenses, or with --verify, '
+            'report any days, months or years where the rollup has drifted from the expenses.')
+    option_list = BaseCommand.option_list + (
+        make_option('--verify', action='store_true', dest='verify', default=False,
+                    help='Compare the rollup with the expenses without changing anything.'),
+        make_option('--user', action='store', dest='username', default=None,
+                    help='Only rebuild or verify the rollup of this user.'),
+    )
+
+    def handle(self, *args, **options):
+        # Imported here as the models need the app cache to be fully loaded.
+        from expense.aggregation import bucket_aggregates
+        from expense.models import DateRollup, ExpenseHistory, bump_expense_version, date_rollup_buckets
+
+        # The rollups count the archived expenses too
+        expenses = ExpenseHistory.objects.all()
+        rollups = DateRollup.objects.all()
+        if options['username']:
+            expenses = expenses.filter(user__username=options['username'])
+            rollups = rollups.filter(user__username=options['username'])
+
+        expected = defaultdict(lambda: [0, 0])
+        # The rollup is kept in the default time zone, see expense.models.expense_local_date
+        with timezone.override(timezone.get_default_timezone()):
+            # One query for the days of every user, as the weekly rollup reads its weeks
+            for day in bucket_aggregates(expenses, 'day', 'user'):
+                for bucket, start_date in date_rollup_buckets(day['start_date']):
+                    expected[(day['user'], bucket, start_date)][0] += day['count']
+                    expected[(day['user'], bucket, start_date)][1] += int(day['total'] * 100)
+        expected = dict((key, tuple(value)) for key, value in expected.items())
+
+        if options['verify']:
+            actual = dict(((rollup.user_id, rollup.bucket, rollup.start_date), (rollup.count, rollup.total_cents))
+                          for rollup in rollups)
+            drifted = sorted(key for key in set(expected) | set(actual) if expected.get(key) != actual.get(key))
+            for user_id, bucket, start_date in drifted:
+                self.stdout.write('User {0} {1} starting {2}: expected {3}, found {4}'.format(
+                    user_id, bucket, start_date, expected.get((user_id, bucket, start_date)),
+                    actual.get((user_id, bucket, start_date))))
+            if drifted:
+                raise CommandError('{0} days, months or years differ from the expenses'.format(len(drifted)))
+            self.stdout.write('The date rollup matches the expenses')
+            return
+
+        with transaction.atomic():
+            # The list totals of these users may change, so cached copies must be refetched
+            for user_id in set(rollups.values_list('user_id', flat=True).distinct()) | set(key[0] for key in expected):
+                bump_expense_version(user_id)
+            rollups.delete()
+            DateRollup.objects.bulk_create([
+                DateRollup(user_id=user_id, bucket=bucket, start_date=start_date, count=count, total_cents=cents)
+                for (user_id, bucket, start_date), (count, cents) in expected.items()])
+        self.stdout.write('Rebuilt {0} days, months and years'.format(len(expected)))
@@ -0,0 +1,58 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals, print_function, division
+import io
+import json
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    args = '<file>'
+    help = ('Import expenses for a user from a CSV file with a header line, or a JSON file holding an array '
+            'of expenses. Invalid rows are skipped and reported.')
+    option_list = BaseCommand.option_list + (
+        make_option('--user', action='store', dest='username', default=None,
+                    help='The username of the user who will own the expenses. Required.'),
+        make_option('--format', action='store', dest='format', default=None,
+                    help='csv or json. Defaults to the extension of the file.'),
+        make_option('--batch-size', action='store', dest='batch_size', type='int', default=1000,
+                    help='The number of expenses saved per INSERT.'),
+    )
+
+    def handle(self, *args, **options):
+        # Imported here as the models need the app cache to be fully loaded.
+        from django.contrib.auth.models import User
+        from expense.importer import import_expenses, read_csv
+
+        if len(args) != 1:
+            raise CommandError('Give the path of one file to import')
+        path = args[0]
+        if not options['username']:
+            raise CommandError('The --user option is required')
+        if options['batch_size'] < 1:
+            raise CommandError('The batch size must be at least 1')
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError('There is no user "{0}"'.format(options['username']))
+
+        import_format = options['format'] or path.rsplit('.', 1)[-1].lower()
+        if import_format not in ('csv', 'json'):
+            raise CommandError('Unknown format "{0}", use --format=csv or --format=json'.format(import_format))
+
+        with io.open(path, 'rb') as import_file:
+            if import_format == 'csv':
+                report = import_expenses(user, read_csv(import_file), options['batch_size'])
+            else:
+                rows = json.loads(import_file.read().decode('utf-8'))
+                if isinstance(rows, dict):
+                    rows = rows.get('objects')
+                if not isinstance(rows, list):
+                    raise CommandError('Expected a JSON array of expenses')
+                report = import_expenses(user, rows, options['batch_size'])
+
+        for error in report['errors']:
+            self.stdout.write('Row {0}: {1}'.format(error['row'], '; '.join(
+                '{0}: {1}'.format(field, message) for field, message in sorted(error['errors'].items()))))
+        self.stdout.write('Imported {0} expenses, {1} rows had errors'.format(report['created'],
+                                                                             len(report['errors'])))
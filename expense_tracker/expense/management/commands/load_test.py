@@ -0,0 +1,65 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals, print_function, division
+import json
+import platform
+from optparse import make_option
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from expense.management.commands.bench import git_revision
+
+
+class Command(BaseCommand):
+    help = ('Load the expense API with concurrent GETs and POSTs from several worker processes, against a '
+            'throwaway database, and print the throughput, error rates and response times as JSON.')
+    option_list = BaseCommand.option_list + (
+        make_option('--workers', action='store', dest='workers', type='int', default=4,
+                    help='The number of worker processes sending requests.'),
+        make_option('--duration', action='store', dest='duration', type='float', default=10,
+                    help='The number of seconds each worker sends requests for.'),
+        make_option('--write-ratio', action='store', dest='write_ratio', type='float', default=0.5,
+                    help='The fraction of requests which create an expense, from 0 to 1. The rest list expenses.'),
+        make_option('--users', action='store', dest='users', type='int', default=4,
+                    help='The number of users the requests are shared between.'),
+        make_option('--expenses', action='store', dest='expenses', type='int', default=1000,
+                    help='The number of expenses each user is seeded with.'),
+        make_option('--stock', action='store_true', dest='stock', default=False,
+                    help='Leave out the SQLite pragmas and write retries, to compare against.'),
+    )
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1 or options['users'] < 1:
+            raise CommandError('There must be at least one worker and one user')
+        if options['duration'] <= 0:
+            raise CommandError('The duration must be more than 0')
+        if not 0 <= options['write_ratio'] <= 1:
+            raise CommandError('The write ratio must be from 0 to 1')
+
+        # Debug mode keeps a copy of every query, which skews both the timings and memory use.
+        settings.DEBUG = False
+        if options['stock']:
+            settings.SQLITE_PRAGMAS = ()
+            settings.DATABASE_WRITE_ATTEMPTS = 1
+        # Imported here as the load test needs the app cache to be fully loaded.
+        from expense.benchmarks.load import LOAD_TEST_HOST, run_load_test
+        settings.ALLOWED_HOSTS = list(settings.ALLOWED_HOSTS) + [LOAD_TEST_HOST]
+
+        database, results = run_load_test(options['workers'], options['duration'], options['write_ratio'],
+                                          options['users'], options['expenses'])
+
+        self.stdout.write(json.dumps({
+            'meta': {
+                'revision': git_revision(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': database,
+                'sqlite_pragmas': dict(getattr(settings, 'SQLITE_PRAGMAS', ())),
+                'write_attempts': getattr(settings, 'DATABASE_WRITE_ATTEMPTS', 1),
+                'workers': options['workers'],
+                'duration': options['duration'],
+                'write_ratio': options['write_ratio'],
+                'users': options['users'],
+                'expenses': options['expenses'],
+            },
+            'results': results,
+        }, indent=2, sort_keys=True))
@@ -0,0 +1,58 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals, print_function, division
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the weekly rollup of every user from their expenses, or with --verify, report any '
+            'weeks where the rollup has drifted from the expenses.')
+    option_list = BaseCommand.option_list + (
+        make_option('--verify', action='store_true', dest='verify', default=False,
+                    help='Compare the rollup with the expenses without changing anything.'),
+        make_option('--user', action='store', dest='username', default=None,
+                    help='Only rebuild or verify the rollup of this user.'),
+    )
+
+    def handle(self, *args, **options):
+        # Imported here as the models need the app cache to be fully loaded.
+        from expense.aggregation import weekly_aggregates
+        from expense.models import ExpenseHistory, WeeklyRollup, WeeklyTotal, bump_expense_version
+
+        # The rollups count the archived expenses too
+        expenses = ExpenseHistory.objects.all()
+        rollups = WeeklyRollup.objects.all()
+        if options['username']:
+            expenses = expenses.filter(user__username=options['username'])
+            rollups = rollups.filter(user__username=options['username'])
+
+        expected = {}
+        for row in weekly_aggregates(expenses, 'user'):
+            expected[(row['user'], row['year_week'] // 100, row['year_week'] % 100)] = (row['count'],
+                                                                                        int(row['total'] * 100))
+
+        if options['verify']:
+            actual = dict(((rollup.user_id, rollup.year, rollup.week_number), (rollup.count, rollup.total_cents))
+                          for rollup in rollups)
+            drifted = sorted(key for key in set(expected) | set(actual) if expected.get(key) != actual.get(key))
+            for user_id, year, week_number in drifted:
+                self.stdout.write('User {0} week {1}-{2:02d}: expected {3}, found {4}'.format(
+                    user_id, year, week_number, expected.get((user_id, year, week_number)),
+                    actual.get((user_id, year, week_number))))
+            if drifted:
+                raise CommandError('{0} weeks differ from the expenses'.format(len(drifted)))
+            self.stdout.write('The weekly rollup matches the expenses')
+            return
+
+        with transaction.atomic():
+            # The weekly totals of these users may change, so cached copies must be refetched
+            for user_id in set(rollups.values_list('user_id', flat=True).distinct()) | set(key[0] for key in expected):
+                bump_expense_version(user_id)
+            rollups.delete()
+            WeeklyRollup.objects.bulk_create([
+                WeeklyRollup(user_id=user_id, year=year, week_number=week_number,
+                             start_date=WeeklyTotal.iso_to_gregorian(year, week_number, 1),
+                             count=count, total_cents=cents)
+                for (user_id, year, week_number), (count, cents) in expected.items()])
+        self.stdout.write('Rebuilt {0} weeks'.format(len(expected)))
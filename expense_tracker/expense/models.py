@@ -4,11 +4,19 @@ import hashlib
 import time
 import datetime
 from decimal import Decimal
-from django.db import models
+import pytz
+from django.db import models, transaction, IntegrityError
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.backends.signals import connection_created
+from django.db.backends.util import format_number, typecast_timestamp
+from django.db.models import F
+from django.db.models.signals import post_init, pre_save, post_save, post_delete
 from django.conf import settings
+from django.utils import timezone
 from tastypie.models import ApiKey
+from expense.authentication import forget_api_key
+from expense.database import apply_sqlite_pragmas
+from expense.routers import stick_to_primary
 
 
 def make_api_key():
@@ -37,9 +45,75 @@ def create_api_key(sender, instance, created, **kwargs):
 post_save.connect(create_api_key, sender=User)
 
 
-class Expense(models.Model):
+def remember_stored_username(sender, instance, **kwargs):
     """
-    This model stores details about an expense.
+    Keep the username a user was loaded (or last saved) with, as a save may rename them.
+    """
+    instance._stored_username = instance.__dict__.get('username')
+
+
+def forget_user_api_key(sender, instance, **kwargs):
+    """
+    Drop the cached API key of a user whose account has changed (e.g. been
+    deactivated or renamed) or been deleted, so the change applies to their next
+    request. A renamed user's key is dropped under both usernames.
+    """
+    forget_api_key(instance.username)
+    stored = getattr(instance, '_stored_username', None)
+    if stored and stored != instance.username:
+        forget_api_key(stored)
+    instance._stored_username = instance.username
+
+
+def forget_changed_api_key(sender, instance, **kwargs):
+    """
+    Drop the cached API key of a user whose key has been issued, regenerated or deleted.
+    """
+    forget_api_key(instance.user.username)
+
+
+post_init.connect(remember_stored_username, sender=User)
+post_save.connect(forget_user_api_key, sender=User)
+post_delete.connect(forget_user_api_key, sender=User)
+post_save.connect(forget_changed_api_key, sender=ApiKey)
+post_delete.connect(forget_changed_api_key, sender=ApiKey)
+
+
+def _sqlite_iso_year_week(dt, tzname):
+    """
+    SQLite has no ISO week function, so this is registered on each connection in the
+    same way as Django's own django_datetime_extract function.
+    :param dt: The datetime as stored by SQLite
+    :param tzname: The name of the time zone to convert the datetime to
+    :return: The ISO year and week as a single integer, e.g. 201452
+    """
+    if dt is None:
+        return None
+    try:
+        dt = typecast_timestamp(dt)
+    except (ValueError, TypeError):
+        return None
+    if tzname is not None:
+        dt = timezone.localtime(dt, pytz.timezone(tzname))
+    year, week_number = dt.isocalendar()[:2]
+    return year * 100 + week_number
+
+
+def register_sqlite_functions(sender, connection, **kwargs):
+    """
+    Add the custom SQL functions used by expense queries to new SQLite connections.
+    """
+    if connection.vendor == 'sqlite':
+        connection.connection.create_function('expense_iso_year_week', 2, _sqlite_iso_year_week)
+
+
+connection_created.connect(register_sqlite_functions)
+connection_created.connect(apply_sqlite_pragmas)
+
+
+class AbstractExpense(models.Model):
+    """
+    The fields of an expense, shared by the recent and the archived expenses.
     """
     user = models.ForeignKey(User)
     date = models.DateTimeField(db_index=True)
@@ -47,41 +121,239 @@ class Expense(models.Model):
     amount = models.DecimalField(default=0, decimal_places=2, max_digits=8, blank=True,
                                  help_text="The dollar amount of this expense")
     comment = models.TextField()
+    # The owner's ExpenseVersion when the expense was last saved, see expense.sync
+    revision = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def __unicode__(self):
+        return self.description
+
+
+class Expense(AbstractExpense):
+    """
+    This model stores details about an expense. Old expenses are moved out to
+    ArchivedExpense, see expense.archive.
+    """
+
+    class Meta:
+        # Almost every query reads one user's expenses in date order or within a date range,
+        # syncing reads the expenses changed since a revision, and the spending analytics
+        # count the expenses of each amount
+        index_together = [('user', 'date'), ('user', 'revision'), ('user', 'amount')]
+
+    def save(self, *args, **kwargs):
+        # Save inside a transaction so that the weekly rollup, which is updated by
+        # the save signals, can never disagree with the expense.
+        with transaction.atomic(using=kwargs.get('using')):
+            super(Expense, self).save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            super(Expense, self).delete(*args, **kwargs)
+
+
+class ArchivedExpense(AbstractExpense):
+    """
+    This model stores the expenses moved out of the expense table by the archive
+    command, unchanged and with the same ids. They are still counted in the rollups,
+    and are only ever moved back (see expense.archive), never saved on their own.
+    """
+    id = models.IntegerField(primary_key=True)
+
+    class Meta:
+        # The same indexes as the expense table, for reading the archive through the history
+        index_together = [('user', 'date'), ('user', 'revision'), ('user', 'amount')]
+
+
+class ExpenseHistory(models.Model):
+    """
+    This model reads every expense, recent and archived, from a view of the two
+    tables (see expense.archive.create_history_view). It is read only.
+    """
+    id = models.IntegerField(primary_key=True)
+    # Not from AbstractExpense, as the view can't be deleted from along with the user;
+    # their expenses are deleted from the tables instead
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING)
+    date = models.DateTimeField()
+    description = models.CharField(max_length=255)
+    amount = models.DecimalField(default=0, decimal_places=2, max_digits=8)
+    comment = models.TextField()
+    revision = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        managed = False
+        db_table = 'expense_expense_history'
 
     def __unicode__(self):
         return self.description
 
 
-class WeeklyTotal(object):
+class WeeklyRollup(models.Model):
+    """
+    This model stores the running count and total of a user's expenses for each
+    ISO week. It is kept up to date as expenses are saved and deleted, so weekly
+    totals can be read without aggregating the expenses.
+    """
+    user = models.ForeignKey(User)
+    year = models.PositiveIntegerField()
+    week_number = models.PositiveSmallIntegerField()
+    # The Monday of the week, used to filter and order the weeks
+    start_date = models.DateField()
+    count = models.PositiveIntegerField(default=0)
+    # Stored in cents, as SQLite would otherwise accumulate floating point errors in the running total
+    total_cents = models.BigIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'year', 'week_number')
+        index_together = [('user', 'start_date')]
+
+    @property
+    def total(self):
+        return Decimal(self.total_cents).scaleb(-2)
+
+    @property
+    def average(self):
+        # Daily Average is always divided by 7 because there are 7 days in a week
+        return self.total / Decimal('7.00')
+
+    def __unicode__(self):
+        return 'Week Number: {0}'.format(self.week_number)
+
+
+class DateRollup(models.Model):
+    """
+    This model stores the running count and total of a user's expenses for each
+    day, month and year in the default time zone. Any range of whole days can be
+    split into a few years, months and days (see expense.aggregation.rollup_spans),
+    so its totals can be read from a handful of rows rather than every expense.
+    """
+    BUCKETS = ('day', 'month', 'year')
+
+    user = models.ForeignKey(User)
+    bucket = models.CharField(max_length=5, choices=[(bucket, bucket) for bucket in BUCKETS])
+    # The first day of the day, month or year
+    start_date = models.DateField()
+    count = models.PositiveIntegerField(default=0)
+    # Stored in cents, as in WeeklyRollup
+    total_cents = models.BigIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'bucket', 'start_date')
+
+    @property
+    def total(self):
+        return Decimal(self.total_cents).scaleb(-2)
+
+    def __unicode__(self):
+        return '{0} starting {1}'.format(self.bucket.capitalize(), self.start_date)
+
+
+class ExpenseVersion(models.Model):
+    """
+    This model stores a counter for each user which is bumped whenever any of
+    their expenses change. Responses built from the expenses can be tagged with
+    it, and a client holding the current tag can be told nothing has changed
+    without reading the expenses.
+    """
+    user = models.OneToOneField(User, primary_key=True)
+    version = models.PositiveIntegerField(default=0)
+    modified = models.DateTimeField()
+    # The date of the user's newest archived expense, or None if none are archived, see expense.archive
+    archived_until = models.DateTimeField(null=True, blank=True)
+
+    def __unicode__(self):
+        return 'Version: {0}'.format(self.version)
+
+
+class ExpenseTombstone(models.Model):
+    """
+    This model records that an expense was deleted (or given to another user), so
+    that clients keeping a copy of the user's expenses can be told to remove it.
+    """
+    user = models.ForeignKey(User)
+    # Not a foreign key, as the expense no longer exists (or belongs to someone else)
+    expense_id = models.PositiveIntegerField()
+    # The user's ExpenseVersion after the deletion
+    revision = models.PositiveIntegerField()
+
+    class Meta:
+        index_together = [('user', 'revision')]
+
+    def __unicode__(self):
+        return 'Deleted expense: {0}'.format(self.expense_id)
+
+
+class BucketTotal(object):
+    """
+    This model stores the total expense data of a day, week, month, quarter or year.
+    """
+
+    def __init__(self, bucket, start_date, count=0, total=Decimal('0'), minimum=None, maximum=None):
+        """
+        Initialise the bucket total.
+        :param bucket: The length of the period: day, week, month, quarter or year
+        :param start_date: The first day of the period
+        :param count: The number of expenses in the period
+        :param total: The total amount for all expenses in the period
+        :param minimum: The smallest amount of an expense in the period
+        :param maximum: The largest amount of an expense in the period
+        :return: None
+        """
+        self.bucket = bucket
+        self.start_date = start_date
+        self.count = count
+        self.total = total
+        self.minimum = minimum
+        self.maximum = maximum
+        # Per expense, unlike the daily average of WeeklyTotal
+        self.average_expense = self.total / count if count else Decimal('0')
+
+    def __unicode__(self):
+        return '{0} starting {1}'.format(self.bucket.capitalize(), self.start_date)
+
+
+class WeeklyTotal(BucketTotal):
     """
     This model stores weekly expense total data.
     """
 
-    def __init__(self, year, week_number, expenses):
+    def __init__(self, year, week_number, count=0, total=Decimal('0')):
         """
         Initialise the weekly total.
         :param year: The year for which this is a weekly total
         :param week_number: The number of the week in the year, for which this is the total
-        :param expenses: The list of expenses for this week
+        :param count: The number of expenses this week
+        :param total: The total amount for all expenses this week
         :return: None
         """
+        # The week starts on its Monday
+        super(WeeklyTotal, self).__init__('week', self.iso_to_gregorian(year, week_number, 1), count, total)
         self.year = year
         self.week_number = week_number
-        # Fetch the date for the start of this week
-        self.start_date = self.iso_to_gregorian(year, week_number, 1)
-        self.total = 0
-        self.average = 0
-        self.count = len(expenses)
-
-        for expense in expenses:
-            self.total += expense.amount
 
         # Daily Average is always divided by 7 because there are 7 days in a week
         self.average = self.total / Decimal('7.00')
 
+    @classmethod
+    def from_expenses(cls, year, week_number, expenses):
+        """
+        Build the weekly total by summing a list of expenses.
+        :param year: The year for which this is a weekly total
+        :param week_number: The number of the week in the year, for which this is the total
+        :param expenses: The list of expenses for this week
+        :return: WeeklyTotal
+        """
+        total = Decimal('0')
+        for expense in expenses:
+            total += expense.amount
+        return cls(year, week_number, len(expenses), total)
+
     # Inversing the ISO calendar data. Taken directly from this answer
     # http://stackoverflow.com/questions/304256/whats-the-best-way-to-find-the-inverse-of-datetime-isocalendar
-    def iso_to_gregorian(self, iso_year, iso_week, iso_day):
+    @classmethod
+    def iso_to_gregorian(cls, iso_year, iso_week, iso_day):
         """
         Gregorian calendar date for the given ISO year, week and day
         :param iso_year: The ISO year as returned by datetime.isocalendar() function
@@ -89,7 +361,7 @@ class WeeklyTotal(object):
         :param iso_day: The ISO day as returned by datetime.isocalendar() function
         :return: gregorian date
         """
-        year_start = self._iso_year_start(iso_year)
+        year_start = cls._iso_year_start(iso_year)
         return year_start + datetime.timedelta(days=iso_day - 1, weeks=iso_week - 1)
 
     @staticmethod
@@ -105,3 +377,265 @@ class WeeklyTotal(object):
 
     def __unicode__(self):
         return 'Week Number: {0}'.format(self.week_number)
+
+
+class WeeklySpending(BucketTotal):
+    """
+    This model stores a week's spending with its rolling averages and the change from the week before.
+    """
+
+    def __init__(self, start_date, count=0, total=Decimal('0'), rolling_average_4=None, rolling_average_12=None,
+                 change=None, change_percent=None):
+        """
+        Initialise the weekly spending.
+        :param start_date: The Monday of the week
+        :param count: The number of expenses this week
+        :param total: The total amount for all expenses this week
+        :param rolling_average_4: The average weekly total of the 4 weeks up to this one, or None before then
+        :param rolling_average_12: The average weekly total of the 12 weeks up to this one, or None before then
+        :param change: The difference between this week's total and last week's, or None for the first week
+        :param change_percent: The change as a percentage of last week's total, or None if it was 0
+        :return: None
+        """
+        super(WeeklySpending, self).__init__('week', start_date, count, total)
+        self.rolling_average_4 = rolling_average_4
+        self.rolling_average_12 = rolling_average_12
+        self.change = change
+        self.change_percent = change_percent
+
+
+def expense_year_week(date):
+    """
+    The ISO year and week of an expense date, in the local time zone.
+    :param date: The expense date. Naive datetimes are taken to be in the default time zone
+    :return: A tuple of year and week number
+    """
+    if timezone.is_naive(date):
+        date = timezone.make_aware(date, timezone.get_default_timezone())
+    return timezone.localtime(date).isocalendar()[:2]
+
+
+def expense_local_date(date):
+    """
+    The day of an expense date in the default time zone, which the date rollup is kept in
+    as it is the time zone Django reads dates in filters (such as date__range) in.
+    :param date: The expense date. Naive datetimes are taken to be in the default time zone
+    :return: A date
+    """
+    default_timezone = timezone.get_default_timezone()
+    if timezone.is_naive(date):
+        date = timezone.make_aware(date, default_timezone)
+    return timezone.localtime(date, default_timezone).date()
+
+
+def date_rollup_buckets(date):
+    """
+    The rows of the date rollup an expense on the given day is counted in.
+    :param date: The day of the expense in the default time zone, see expense_local_date
+    :return: A list of (bucket, start_date) for the day, its month and its year
+    """
+    return [('day', date), ('month', date.replace(day=1)), ('year', date.replace(month=1, day=1))]
+
+
+def expense_cents(amount):
+    """
+    The amount of an expense in cents, exactly as the database will store it.
+    """
+    field = Expense._meta.get_field('amount')
+    return int(Decimal(format_number(field.to_python(amount), field.max_digits, field.decimal_places)) * 100)
+
+
+def adjust_weekly_rollup(user_id, year, week_number, count, cents):
+    """
+    Add to (or subtract from) the count and total of a user's weekly rollup.
+    :param user_id: The primary key of the user who owns the expenses
+    :param year: The ISO year
+    :param week_number: The ISO week number
+    :param count: The change in the number of expenses
+    :param cents: The change in the total amount, in cents
+    :return: None
+    """
+    _adjust_rollup(WeeklyRollup, count, cents, {'start_date': WeeklyTotal.iso_to_gregorian(year, week_number, 1)},
+                   user_id=user_id, year=year, week_number=week_number)
+
+
+def adjust_date_rollup(user_id, bucket, start_date, count, cents):
+    """
+    Add to (or subtract from) the count and total of a day, month or year of a user's date rollup.
+    :param user_id: The primary key of the user who owns the expenses
+    :param bucket: One of DateRollup.BUCKETS
+    :param start_date: The first day of the bucket
+    :param count: The change in the number of expenses
+    :param cents: The change in the total amount, in cents
+    :return: None
+    """
+    _adjust_rollup(DateRollup, count, cents, {}, user_id=user_id, bucket=bucket, start_date=start_date)
+
+
+def _adjust_rollup(model, count, cents, defaults, **lookup):
+    """
+    Add to the count and total_cents of a rollup row, creating it if it doesn't exist
+    and deleting it once it no longer counts any expenses.
+    :param model: WeeklyRollup or DateRollup
+    :param count: The change in the number of expenses
+    :param cents: The change in the total amount, in cents
+    :param defaults: Any further fields to create the row with
+    :param lookup: The fields which identify the row
+    :return: None
+    """
+    rollup = model.objects.filter(**lookup)
+    if rollup.update(count=F('count') + count, total_cents=F('total_cents') + cents):
+        if count < 0:
+            # Drop rows which no longer have any expenses
+            rollup.filter(count__lte=0).delete()
+        return
+
+    try:
+        with transaction.atomic():
+            model.objects.create(count=count, total_cents=cents, **dict(defaults, **lookup))
+    except IntegrityError:
+        # Another request created the row first, so add to that one instead
+        rollup.update(count=F('count') + count, total_cents=F('total_cents') + cents)
+
+
+def bump_expense_version(user_id):
+    """
+    Record that a user's expenses have changed.
+    :param user_id: The primary key of the user who owns the expenses
+    :return: The new version
+    """
+    # Every change passes through here, so the user's next reads see it, see expense.routers
+    stick_to_primary(user_id)
+    now = timezone.now()
+    versions = ExpenseVersion.objects.filter(user_id=user_id)
+    if versions.update(version=F('version') + 1, modified=now):
+        # The update locks the row, so no other transaction can change it before this one ends
+        return versions.values_list('version', flat=True)[0]
+
+    try:
+        with transaction.atomic():
+            ExpenseVersion.objects.create(user_id=user_id, version=1, modified=now)
+        return 1
+    except IntegrityError:
+        # Another request created the version first, so bump that one instead
+        versions.update(version=F('version') + 1, modified=now)
+        return versions.values_list('version', flat=True)[0]
+
+
+def add_expense_tombstone(user_id, expense_id):
+    """
+    Record that an expense no longer belongs to a user, bumping their version.
+    :param user_id: The primary key of the user who owned the expense
+    :param expense_id: The primary key of the expense
+    :return: None
+    """
+    ExpenseTombstone.objects.create(user_id=user_id, expense_id=expense_id, revision=bump_expense_version(user_id))
+
+
+def remember_previous_expense(sender, instance, raw, **kwargs):
+    """
+    Record the stored user, date and amount of an expense that is about to be
+    updated, so that it can be taken out of its old week and day.
+    """
+    instance._rollup_previous = None
+    if instance.pk is not None:
+        instance._rollup_previous = Expense.objects.filter(pk=instance.pk).values_list(
+            'user_id', 'date', 'amount').first()
+
+
+def add_expense_to_rollup(sender, instance, created, raw, **kwargs):
+    """
+    Add a saved expense to its week, removing it from its previous week if it has moved.
+    """
+    year, week_number = expense_year_week(instance.date)
+    cents = expense_cents(instance.amount)
+
+    previous = getattr(instance, '_rollup_previous', None)
+    if previous:
+        previous_user_id, previous_date, previous_amount = previous
+        previous_year, previous_week_number = expense_year_week(previous_date)
+        previous_cents = expense_cents(previous_amount)
+        if (previous_user_id, previous_year, previous_week_number) == (instance.user_id, year, week_number):
+            # Still in the same week, so only the amount can have changed
+            if cents != previous_cents:
+                adjust_weekly_rollup(instance.user_id, year, week_number, 0, cents - previous_cents)
+            return
+        adjust_weekly_rollup(previous_user_id, previous_year, previous_week_number, -1, -previous_cents)
+
+    adjust_weekly_rollup(instance.user_id, year, week_number, 1, cents)
+
+
+def remove_expense_from_rollup(sender, instance, **kwargs):
+    """
+    Take a deleted expense out of its week.
+    """
+    year, week_number = expense_year_week(instance.date)
+    adjust_weekly_rollup(instance.user_id, year, week_number, -1, -expense_cents(instance.amount))
+
+
+def add_expense_to_date_rollup(sender, instance, created, raw, **kwargs):
+    """
+    Add a saved expense to its day, month and year, removing it from the previous ones if it has moved.
+    """
+    date = expense_local_date(instance.date)
+    cents = expense_cents(instance.amount)
+
+    previous = getattr(instance, '_rollup_previous', None)
+    if previous:
+        previous_user_id, previous_date, previous_amount = previous
+        previous_date = expense_local_date(previous_date)
+        previous_cents = expense_cents(previous_amount)
+        if (previous_user_id, previous_date) == (instance.user_id, date):
+            # Still on the same day, so only the amount can have changed
+            if cents != previous_cents:
+                for bucket, start_date in date_rollup_buckets(date):
+                    adjust_date_rollup(instance.user_id, bucket, start_date, 0, cents - previous_cents)
+            return
+        for bucket, start_date in date_rollup_buckets(previous_date):
+            adjust_date_rollup(previous_user_id, bucket, start_date, -1, -previous_cents)
+
+    for bucket, start_date in date_rollup_buckets(date):
+        adjust_date_rollup(instance.user_id, bucket, start_date, 1, cents)
+
+
+def remove_expense_from_date_rollup(sender, instance, **kwargs):
+    """
+    Take a deleted expense out of its day, month and year.
+    """
+    cents = expense_cents(instance.amount)
+    for bucket, start_date in date_rollup_buckets(expense_local_date(instance.date)):
+        adjust_date_rollup(instance.user_id, bucket, start_date, -1, -cents)
+
+
+def stamp_expense_revision(sender, instance, **kwargs):
+    """
+    Bump the version of the user who owns an expense about to be saved, and stamp the expense with it.
+    """
+    instance.revision = bump_expense_version(instance.user_id)
+
+
+def bury_moved_expense(sender, instance, **kwargs):
+    """
+    Add a tombstone for the previous owner of a saved expense, if it has moved to another user.
+    """
+    previous = getattr(instance, '_rollup_previous', None)
+    if previous and previous[0] != instance.user_id:
+        add_expense_tombstone(previous[0], instance.pk)
+
+
+def bury_deleted_expense(sender, instance, **kwargs):
+    """
+    Add a tombstone for a deleted expense.
+    """
+    add_expense_tombstone(instance.user_id, instance.pk)
+
+
+# Keep the rollups, expense versions and tombstones up to date as expenses change
+pre_save.connect(remember_previous_expense, sender=Expense)
+pre_save.connect(stamp_expense_revision, sender=Expense)
+post_save.connect(add_expense_to_rollup, sender=Expense)
+post_delete.connect(remove_expense_from_rollup, sender=Expense)
+post_save.connect(add_expense_to_date_rollup, sender=Expense)
+post_delete.connect(remove_expense_from_date_rollup, sender=Expense)
+post_save.connect(bury_moved_expense, sender=Expense)
+post_delete.connect(bury_deleted_expense, sender=Expense)
@@ -0,0 +1,142 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals, print_function, division
+import base64
+import binascii
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from tastypie.exceptions import BadRequest
+from tastypie.paginator import Paginator
+
+try:
+    from urllib.parse import urlencode
+except ImportError:
+    from urllib import urlencode
+
+
+def after_keyset(objects, date, pk, descending=False):
+    """
+    Filter the objects down to those which come after the given position when
+    ordered by (date, id).
+    :param objects: A queryset of objects with date and id fields
+    :param date: The date of the last object seen
+    :param pk: The id of the last object seen
+    :param descending: True if the objects are ordered newest first
+    :return: The filtered queryset
+    """
+    # The separate bound on date lets the database range scan the index on date
+    if descending:
+        return objects.filter(Q(date__lte=date), Q(date__lt=date) | Q(id__lt=pk))
+    return objects.filter(Q(date__gte=date), Q(date__gt=date) | Q(id__gt=pk))
+
+
+class KeysetPaginator(Paginator):
+    """
+    A paginator which pages through the objects ordered by (date, id), starting
+    each page after the last row of the previous page rather than at an offset.
+    The database can then jump straight to the page using the index on date, so
+    a page deep into the list costs no more than the first.
+
+    Keyset pagination is opt-in. Requests with a ``cursor`` parameter (empty for
+    the first page) are paged by keyset, and the ``next`` link in the meta carries
+    the opaque cursor for the following page. Adding ``count=false`` skips the
+    total_count query. Requests without a cursor are paged by limit and offset as usual.
+
+    A count which is already known (e.g. from an aggregate of the same objects) can
+    be given, to save the count query.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.count = kwargs.pop('count', None)
+        super(KeysetPaginator, self).__init__(*args, **kwargs)
+
+    def get_count(self):
+        if self.count is not None:
+            return self.count
+        return super(KeysetPaginator, self).get_count()
+
+    def page(self):
+        if 'cursor' not in self.request_data:
+            return super(KeysetPaginator, self).page()
+
+        limit = self.get_limit()
+        descending = self.is_descending()
+        objects = self.objects.order_by(*(('-date', '-id') if descending else ('date', 'id')))
+
+        position = self.decode_cursor(self.request_data['cursor'])
+        if position:
+            objects = after_keyset(objects, position[0], position[1], descending)
+
+        if limit:
+            # Fetch one extra row to find out whether there is a next page
+            objects = list(objects[:limit + 1])
+            has_next = len(objects) > limit
+            objects = objects[:limit]
+        else:
+            objects = list(objects)
+            has_next = False
+
+        meta = {
+            'limit': limit,
+            'previous': None,
+            'next': self._generate_cursor_uri(self.encode_cursor(objects[-1])) if has_next else None,
+        }
+        if self.request_data.get('count', 'true').lower() not in ('false', '0'):
+            meta['total_count'] = self.get_count()
+
+        return {
+            self.collection_name: objects,
+            'meta': meta,
+        }
+
+    def is_descending(self):
+        """
+        Whether the objects have been sorted with the newest first (order_by=-date).
+        """
+        ordering = getattr(getattr(self.objects, 'query', None), 'order_by', None)
+        return bool(ordering) and ordering[0] == '-date'
+
+    @staticmethod
+    def encode_cursor(obj):
+        """
+        Build the opaque cursor which starts the next page after the given object,
+        or the given row of a values() queryset.
+        """
+        if isinstance(obj, dict):
+            position = '{0}|{1}'.format(obj['date'].isoformat(), obj['id'])
+        else:
+            position = '{0}|{1}'.format(obj.date.isoformat(), obj.pk)
+        return base64.urlsafe_b64encode(position.encode('utf-8')).decode('ascii')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """
+        Read the date and id from a cursor.
+        :param cursor: The cursor from the request, or an empty string for the first page
+        :return: A tuple of the date and id, or None for the first page
+        """
+        if not cursor:
+            return None
+        try:
+            date, pk = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+            date = parse_datetime(date)
+            pk = int(pk)
+        except (TypeError, ValueError, UnicodeError, binascii.Error):
+            date = None
+        if date is None:
+            raise BadRequest("Invalid cursor '{0}' provided.".format(cursor))
+        return date, pk
+
+    def _generate_cursor_uri(self, cursor):
+        if self.resource_uri is None:
+            return None
+        request_params = self.request_data.copy()
+        for param in ('cursor', 'offset'):
+            if param in request_params:
+                del request_params[param]
+        request_params['cursor'] = cursor
+        try:
+            # QueryDict has a urlencode method that can handle multiple values for the same key
+            encoded_params = request_params.urlencode()
+        except AttributeError:
+            encoded_params = urlencode(request_params)
+        return '{0}?{1}'.format(self.resource_uri, encoded_params)
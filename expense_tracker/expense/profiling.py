@@ -0,0 +1,95 @@
+# coding=utf-8
+"""
+Time the stages of an API request. A profile is only started for sampled requests
+(see expense_tracker.middleware.ProfilingMiddleware); otherwise the resources skip
+straight to their work after one thread local lookup.
+"""
+from __future__ import absolute_import, unicode_literals, print_function, division
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+# The resource methods timed by profile_resource, and the stage each is recorded as
+PROFILED_METHODS = (
+    ('full_dehydrate', 'dehydrate'),
+    ('dehydrate_list_rows', 'dehydrate'),
+    ('alter_list_data_to_serialize', 'alter_list'),
+    ('serialize', 'serialize'),
+    ('serialize_list', 'serialize'),
+)
+
+_local = threading.local()
+
+
+class RequestProfile(object):
+    """
+    The total time spent in, and number of calls of, each named stage of a request.
+    """
+
+    def __init__(self):
+        self.durations = defaultdict(float)
+        self.calls = defaultdict(int)
+
+    @contextmanager
+    def section(self, name):
+        """
+        Add the time spent inside the with block to the named stage, in milliseconds.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.durations[name] += (time.time() - start) * 1000
+            self.calls[name] += 1
+
+
+def start_profile():
+    """
+    Start profiling the current thread's request.
+    :return: The new RequestProfile
+    """
+    _local.profile = RequestProfile()
+    return _local.profile
+
+
+def stop_profile():
+    """
+    Stop profiling the current thread's request.
+    :return: The RequestProfile, or None if there was none
+    """
+    profile = current_profile()
+    _local.profile = None
+    return profile
+
+
+def current_profile():
+    """
+    :return: The RequestProfile of the current thread's request, or None if it isn't being profiled
+    """
+    return getattr(_local, 'profile', None)
+
+
+def _profiled(section, method):
+    @wraps(method)
+    def inner(*args, **kwargs):
+        profile = current_profile()
+        if profile is None:
+            return method(*args, **kwargs)
+        with profile.section(section):
+            return method(*args, **kwargs)
+    return inner
+
+
+def profile_resource(cls):
+    """
+    A class decorator which records the time a resource spends dehydrating
+    bundles, altering the list data and serializing, when the request is being
+    profiled. It wraps the methods as finally defined on the class, so it must
+    be applied to each concrete resource rather than a base class.
+    """
+    for method_name, section in PROFILED_METHODS:
+        if hasattr(cls, method_name):
+            setattr(cls, method_name, _profiled(section, getattr(cls, method_name)))
+    return cls
@@ -1,16 +1,43 @@
 # coding=utf-8
 from __future__ import absolute_import, unicode_literals, print_function, division
+import datetime
+import hashlib
+import json
+from functools import wraps
 from decimal import Decimal
 from collections import defaultdict, OrderedDict
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
 from django.conf.urls import url
+from django.db import transaction
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.fields import FieldDoesNotExist
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import six, timezone
+from django.utils.dateparse import parse_date
+from django.views.decorators.http import condition
 from tastypie import http, fields
 from tastypie.resources import ModelResource, Resource
-from tastypie.authentication import ApiKeyAuthentication
 from tastypie.authorization import Authorization
+from tastypie.bundle import Bundle
+from tastypie.exceptions import BadRequest, InvalidFilterError, InvalidSortError
 from tastypie.utils import trailing_slash
-from expense.models import Expense, WeeklyTotal
+from tastypie.utils.mime import build_content_type
+from expense.aggregation import (BUCKETS, bucket_start, bucket_totals, local_midnight, next_bucket_start, rollup_spans,
+                                 rollup_totals)
+from expense.analytics import spending_analytics
+from expense.archive import expense_model, newest_archived, restore_expenses
+from expense.authentication import CachedApiKeyAuthentication
+from expense.caching import count_lookup, response_cache
+from expense.database import retry_locked_writes
+from expense.export import EXPORT_FORMATS, iter_expense_rows
+from expense.importer import import_expenses, read_csv
+from expense.models import Expense, ExpenseHistory, ExpenseVersion, WeeklyRollup, WeeklyTotal
+from expense.paginators import KeysetPaginator
+from expense.profiling import profile_resource
+from expense.routers import replica_reads
+from expense.search import search_expenses
+from expense.sync import expense_changes
 
 
 class BaseModelResource(ModelResource):
@@ -113,15 +140,466 @@ class UserResource(BaseModelResource):
         return self.authenticate(request, **kwargs)
 
 
-class ExpenseResource(BaseModelResource):
+class ReplicaReadMixin(object):
+    """
+    With read_from_replica set, the GET requests of the resource (including its
+    extra views, e.g. the export) read from a read replica once the user has been
+    authenticated, unless the user has just changed their expenses. See expense.routers.
+    Streamed responses read the rest of their rows from the primary.
+    """
+    read_from_replica = False
+
+    def wrap_view(self, view):
+        wrapper = super(ReplicaReadMixin, self).wrap_view(view)
+        if not self.read_from_replica:
+            return wrapper
+
+        # Copies the csrf_exempt flag of Tastypie's wrapper
+        @wraps(wrapper)
+        def inner(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return wrapper(request, *args, **kwargs)
+            with replica_reads(request):
+                return wrapper(request, *args, **kwargs)
+        return inner
+
+
+class ConditionalListMixin(object):
+    """
+    Tag list responses with an ETag and Last-Modified time taken from the user's
+    ExpenseVersion, and answer a request which already has the current ETag (or
+    an If-Modified-Since no older than the last change) with 304 Not Modified.
+    A 304 costs one query for the version; no expenses are read or serialized.
+    The date of the user's newest archived expense is read with the version, see archived_until.
+
+    With cache_list_responses set, the serialized lists are also kept in the
+    response cache under their ETag. Any change to the user's expenses changes
+    the version and so the key, which invalidates all of that user's entries.
+    """
+    cache_list_responses = False
+
+    def get_list(self, request, **kwargs):
+        version, modified, request._archived_until = ExpenseVersion.objects.filter(user=request.user).values_list(
+            'version', 'modified', 'archived_until').first() or (0, None, None)
+        # The same version gives a different response for each query string and format
+        etag = hashlib.sha1('|'.join([
+            self._meta.resource_name, six.text_type(request.user.pk), six.text_type(version),
+            modified.isoformat() if modified else '', request.get_full_path(), request.META.get('HTTP_ACCEPT', ''),
+        ]).encode('utf-8')).hexdigest()
+
+        if self.cache_list_responses:
+            def get_list(request, **kwargs):
+                return self.get_cached_list(request, etag, **kwargs)
+        else:
+            get_list = self.build_list_response
+        return condition(etag_func=lambda request, **kwargs: etag,
+                         last_modified_func=lambda request, **kwargs: modified)(get_list)(request, **kwargs)
+
+    def archived_until(self, request):
+        """
+        The date of the user's newest archived expense, as read with the version by get_list.
+        :param request: Django request object
+        :return: An aware datetime, or None if none of the user's expenses are archived
+        """
+        if not hasattr(request, '_archived_until'):
+            request._archived_until = newest_archived(request.user)
+        return request._archived_until
+
+    def get_cached_list(self, request, key, **kwargs):
+        """
+        Return the serialized list from the response cache, or build it and cache it.
+        :param request: Django request object
+        :param key: The ETag of the list
+        :param kwargs:
+        :return: The response, with an X-Cache header of HIT or MISS
+        """
+        cache_key = 'list:{0}'.format(key)
+        cached = response_cache().get(cache_key)
+        count_lookup(cached is not None)
+        if cached is not None:
+            content, content_type = cached
+            response = HttpResponse(content, content_type=content_type)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        response = self.build_list_response(request, **kwargs)
+        if response.status_code == 200:
+            response_cache().set(cache_key, (response.content, response['Content-Type']))
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def build_list_response(self, request, **kwargs):
+        """
+        Build the list response, without any caching. A hook for resources with their own list path.
+        """
+        return super(ConditionalListMixin, self).get_list(request, **kwargs)
+
+
+@profile_resource
+class ExpenseResource(ReplicaReadMixin, ConditionalListMixin, BaseModelResource):
     """ Expose the Expense objects over REST, and provide a level of authorisation """
+    read_from_replica = True
+    # Build list responses from values() rows rather than bundles, see build_list_response
+    lean_list = True
+    # The number of rows read from the database at a time by the export
+    export_chunk_size = 1000
+    # The default number of rows saved per INSERT by the bulk import
+    import_batch_size = 1000
+    # The default number of saved expenses returned per sync
+    sync_limit = 1000
+
+    def prepend_urls(self):
+        return [
+            url(r"^(?P<resource_name>%s)/export%s$" % (self._meta.resource_name, trailing_slash()),
+                self.wrap_view('export'), name="api_expense_export"),
+            url(r"^(?P<resource_name>%s)/bulk%s$" % (self._meta.resource_name, trailing_slash()),
+                self.wrap_view('bulk_import'), name="api_expense_bulk_import"),
+            url(r"^(?P<resource_name>%s)/sync%s$" % (self._meta.resource_name, trailing_slash()),
+                self.wrap_view('sync'), name="api_expense_sync"),
+        ]
+
+    def bulk_import(self, request, **kwargs):
+        """
+        Create many expenses in one request. The body is either a JSON array of
+        expenses (or an object with the array in "objects"), or CSV with a header
+        line when the Content-Type is text/csv. Invalid rows are skipped and
+        reported by row number; the valid rows are all saved.
+        :param request: Django request object
+        :param kwargs:
+        :return: A report of the number of expenses created and the errors
+        """
+        self.method_check(request, allowed=['post'])
+        self.is_authenticated(request)
+        self.throttle_check(request)
+
+        try:
+            batch_size = int(request.GET.get('batch_size', self.import_batch_size))
+        except ValueError:
+            batch_size = 0
+        if batch_size < 1:
+            return self.create_response(request, {'success': False, 'reason': 'Invalid batch size', },
+                                        http.HttpBadRequest)
+
+        content_type = request.META.get('CONTENT_TYPE', 'application/json')
+        if content_type.startswith('text/csv'):
+            # Read the CSV from the request a line at a time
+            rows = read_csv(request)
+        else:
+            rows = self.deserialize(request, request.body, format=content_type)
+            if isinstance(rows, dict):
+                rows = rows.get('objects')
+            if not isinstance(rows, list):
+                return self.create_response(request, {'success': False, 'reason': 'Expected a list of expenses', },
+                                            http.HttpBadRequest)
+
+        # Rows streamed from a CSV body can only be read once, so only lists are retried
+        import_rows = retry_locked_writes(import_expenses) if isinstance(rows, list) else import_expenses
+        report = import_rows(request.user, rows, batch_size)
+        report['success'] = not report['errors']
+        self.log_throttled_access(request)
+        if report['errors'] and not report['created']:
+            return self.create_response(request, report, http.HttpBadRequest)
+        return self.create_response(request, report, http.HttpCreated)
+
+    def export(self, request, **kwargs):
+        """
+        Stream all of the user's expenses, or those in the date__range filter, as
+        CSV (format=csv, the default) or newline delimited JSON (format=ndjson).
+        :param request: Django request object
+        :param kwargs:
+        :return: StreamingHttpResponse
+        """
+        self.method_check(request, allowed=['get'])
+        self.is_authenticated(request)
+        self.throttle_check(request)
+
+        export_format = request.GET.get('format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return self.create_response(request, {'success': False, 'reason': 'Unknown export format', },
+                                        http.HttpBadRequest)
+        content_type, formatter = EXPORT_FORMATS[export_format]
+
+        expenses = self.obj_get_list(bundle=self.build_bundle(request=request))
+        response = StreamingHttpResponse(formatter(iter_expense_rows(expenses, self.export_chunk_size)),
+                                         content_type=content_type)
+        response['Content-Disposition'] = 'attachment; filename="expenses.{0}"'.format(export_format)
+        self.log_throttled_access(request)
+        return response
+
+    def sync(self, request, **kwargs):
+        """
+        Return the expenses saved and the ids of those deleted since the token of the
+        previous sync, which is given in the "since" parameter. The first sync (without
+        a token) returns every expense. Up to "limit" saved expenses are returned at a
+        time; while "more" is true, sync again straight away with the new token.
+        The fields parameter limits the fields of the saved expenses, as for the list.
+        :param request: Django request object
+        :param kwargs:
+        :return: The saved expenses, the deleted ids, the token for the next sync and whether there are more
+        """
+        self.method_check(request, allowed=['get'])
+        self.is_authenticated(request)
+        self.throttle_check(request)
+
+        try:
+            limit = int(request.GET.get('limit', self.sync_limit))
+        except ValueError:
+            limit = 0
+        if limit < 1:
+            return self.create_response(request, {'success': False, 'reason': 'Invalid limit', },
+                                        http.HttpBadRequest)
+        limit = min(limit, self._meta.max_limit or limit)
 
+        requested = self.requested_fields(request)
+        converters = self.lean_list and self.lean_list_converters()
+        # Whether to take the lean path, even if only the resource_uri is left of the fields
+        lean = bool(converters)
+        if lean and requested is not None:
+            converters = [converter for converter in converters if converter[0] in requested]
+        try:
+            changes = expense_changes(request.user, request.GET.get('since', ''), limit,
+                                      [attribute for _, attribute, _ in converters] if lean else None)
+        except ValueError:
+            return self.create_response(request, {'success': False, 'reason': 'Invalid sync token', },
+                                        http.HttpBadRequest)
+
+        self.log_throttled_access(request)
+        if lean:
+            changes['saved'] = self.dehydrate_list_rows(changes['saved'], converters)
+            return HttpResponse(content=self.serialize_list(request, changes),
+                                content_type=build_content_type(self.determine_format(request)))
+        changes['saved'] = self.trim_bundles(request, [
+            self.full_dehydrate(self.build_bundle(obj=obj, request=request), for_list=True)
+            for obj in changes['saved']])
+        return self.create_response(request, changes)
+
+    def build_list_response(self, request, **kwargs):
+        """
+        A fast path for the list, which gives the same response as Tastypie's get_list.
+        Rather than building a model instance and bundle per expense and dehydrating
+        each field, it reads values() rows, converts them as the fields and serializer
+        would, and adds the resource_uri from a template. Falls back to get_list if
+        lean_list is off or a field isn't a plain attribute of a simple type.
+        :param request: Django request object
+        :param kwargs:
+        :return: The list response
+        """
+        if not (self.lean_list and self.lean_list_converters()):
+            return super(ExpenseResource, self).build_list_response(request, **kwargs)
+
+        desired_format = self.determine_format(request)
+        return HttpResponse(content=self.serialize_list(request, self.get_list_data(request, **kwargs)),
+                            content_type=build_content_type(desired_format))
+
+    def get_list_data(self, request, **kwargs):
+        """
+        The page of expenses and the meta of a list request, ready to be serialized. The
+        expenses are dictionaries from the lean list path (see build_list_response) when
+        possible, or else dehydrated bundles. Only the columns of the requested fields (see
+        requested_fields) are selected, and the total_count comes from the meta totals
+        rather than a separate count.
+        :param request: Django request object
+        :param kwargs:
+        :return: A dictionary of the meta and expenses
+        """
+        converters = self.lean_list and self.lean_list_converters()
+        # Whether to take the lean path, even if only the resource_uri is left of the fields
+        lean = bool(converters)
+        base_bundle = self.build_bundle(request=request)
+        objects = self.obj_get_list(bundle=base_bundle, **self.remove_api_resource_names(kwargs))
+        sorted_objects = self.apply_sorting(objects, options=request.GET)
+        if lean:
+            requested = self.requested_fields(request)
+            if requested is not None:
+                converters = [converter for converter in converters if converter[0] in requested]
+            # The id and date are always read for the resource_uri and the paginator's cursor
+            columns = ['id', 'date']
+            columns.extend(attribute for _, attribute, _ in converters if attribute not in columns)
+            sorted_objects = sorted_objects.values(*columns)
+
+        paginator = self._meta.paginator_class(request.GET, sorted_objects, resource_uri=self.get_resource_uri(),
+                                               limit=self._meta.limit, max_limit=self._meta.max_limit,
+                                               collection_name=self._meta.collection_name,
+                                               count=self.aggregate_list(request)['count'])
+        to_be_serialized = paginator.page()
+        # The first days of the (local, ISO) weeks of the page's expenses, which the dashboard reads the totals of
+        dates = [timezone.localtime(row['date'] if lean else row.date).date()
+                 for row in to_be_serialized[self._meta.collection_name]]
+        request._expense_page_weeks = set(date - datetime.timedelta(days=date.weekday()) for date in dates)
+        if lean:
+            to_be_serialized[self._meta.collection_name] = self.dehydrate_list_rows(
+                to_be_serialized[self._meta.collection_name], converters)
+        else:
+            to_be_serialized[self._meta.collection_name] = [
+                self.full_dehydrate(self.build_bundle(obj=obj, request=request), for_list=True)
+                for obj in to_be_serialized[self._meta.collection_name]]
+        return self.alter_list_data_to_serialize(request, to_be_serialized)
+
+    def requested_fields(self, request):
+        """
+        The fields listed by the request's fields parameter, e.g. fields=date,description,amount,
+        which limits each expense in the list to those fields and its resource_uri.
+        :param request: Django request object
+        :return: A set of field names, or None if every field was requested
+        """
+        names = [name for value in request.GET.getlist('fields') for name in value.split(',') if name]
+        if not names:
+            return None
+        unknown = sorted(set(names) - set(self.fields))
+        if unknown:
+            raise BadRequest("'{0}' is not a field of the '{1}' resource.".format(
+                "', '".join(unknown), self._meta.resource_name))
+        return set(names) | {'resource_uri'}
+
+    def lean_list_converters(self):
+        """
+        The name, model attribute and conversion to a simple type of each field, or
+        None if any field needs the full dehydrate: one only in lists or details, with
+        its own dehydrate_<field>, or with a default for a value which may be None.
+        """
+        if six.get_unbound_function(type(self).dehydrate) is not six.get_unbound_function(Resource.dehydrate):
+            return None
+        serializer = self._meta.serializer
+        conversions = {
+            'string': six.text_type,
+            'integer': int,
+            'decimal': six.text_type,
+            'datetime': serializer.format_datetime,
+        }
+        converters = []
+        for name, field in self.fields.items():
+            if name == 'resource_uri':
+                continue
+            if (field.dehydrated_type not in conversions or not isinstance(field.attribute, six.string_types) or
+                    field.use_in != 'all' or hasattr(self, 'dehydrate_{0}'.format(name))):
+                return None
+            try:
+                column = self._meta.object_class._meta.get_field(field.attribute)
+            except FieldDoesNotExist:
+                return None
+            # Tastypie gives most model fields a default, which is only used in place of None
+            if field.has_default() and (field.null or column.null):
+                return None
+            converters.append((name, field.attribute, conversions[field.dehydrated_type]))
+        return converters
+
+    def dehydrate_list_rows(self, rows, converters):
+        """
+        Convert values() rows to the dictionaries full_dehydrate and the serializer would produce.
+        """
+        # Reverse the detail URL once, and fill in each row's primary key
+        placeholder = '__pk__'
+        uri_start, uri_end = self.get_resource_uri(Expense(pk=placeholder)).split(placeholder)
+        # The keys are added in sorted order, see serialize_list
+        fields = sorted(converters + [('resource_uri', None, None)])
+
+        dehydrated = []
+        for row in rows:
+            data = OrderedDict()
+            for name, attribute, convert in fields:
+                if name == 'resource_uri':
+                    data[name] = '{0}{1}{2}'.format(uri_start, row['id'], uri_end)
+                else:
+                    value = row[attribute]
+                    data[name] = convert(value) if value is not None else None
+            dehydrated.append(data)
+        return dehydrated
+
+    def serialize_list(self, request, data):
+        """
+        Serialize the list data as JSON, formatted exactly as the Tastypie serializer would.
+        The rows are already simple types, so only the meta (if any) goes through to_simple.
+        The serializer sorts the keys, which on Python 2 rules out the json module's
+        C encoder, so instead every dictionary is built with its keys in sorted order.
+        """
+        if 'meta' in data:
+            data['meta'] = OrderedDict(sorted(self._meta.serializer.to_simple(data['meta'], {}).items()))
+        return json.dumps(OrderedDict(sorted(data.items())), ensure_ascii=False)
+
+    @retry_locked_writes
     def obj_create(self, bundle, **kwargs):
         """
         Any "create" methods must use the session user always.
         """
         return super(ExpenseResource, self).obj_create(bundle, user=bundle.request.user)
 
+    @retry_locked_writes
+    def obj_update(self, bundle, skip_errors=False, **kwargs):
+        """
+        Updates are tried again if the database is locked, as are creates and deletes.
+        An archived expense of the user is moved back into the expense table to be
+        updated, in the same transaction, so it stays archived if the update fails.
+        """
+        with transaction.atomic():
+            self.restore_archived(bundle, kwargs)
+            return super(ExpenseResource, self).obj_update(bundle, skip_errors=skip_errors, **kwargs)
+
+    @retry_locked_writes
+    def obj_delete(self, bundle, **kwargs):
+        with transaction.atomic():
+            self.restore_archived(bundle, kwargs)
+            return super(ExpenseResource, self).obj_delete(bundle, **kwargs)
+
+    def restore_archived(self, bundle, kwargs):
+        """
+        Move the archived expense being changed back into the expense table, if it is the user's.
+        :param bundle: The bundle of the request
+        :param kwargs: The lookup of the expense
+        """
+        if 'pk' in kwargs:
+            restore_expenses(user=bundle.request.user, ids=[kwargs['pk']])
+
+    def get_object_list(self, request):
+        """
+        The expenses a request reads from. Reads whose date__range starts on or before
+        the user's newest archived expense (or which have no date__range) read the
+        history of the recent and archived expenses, searches included, and the rest only
+        read the expense table, see expense.archive. Changes are only made to the expense table.
+        :param request: Django request object
+        :return: A queryset of Expense or ExpenseHistory objects
+        """
+        if request is None or request.method not in ('GET', 'HEAD'):
+            return super(ExpenseResource, self).get_object_list(request)
+        # The list, its totals and the export all read the same expenses
+        if not hasattr(request, '_expense_model'):
+            request._expense_model = expense_model(request.user, self.list_range_start(request),
+                                                   self.archived_until(request))
+        return request._expense_model.objects.all()
+
+    def list_range_start(self, request):
+        """
+        The start of the request's date__range filter, read as Django reads it.
+        :param request: Django request object
+        :return: An aware datetime, or None if there is no date__range of whole days
+        """
+        try:
+            start = parse_date(self.build_filters(request.GET)['date__range'][0])
+        except (KeyError, IndexError, TypeError, ValueError):
+            return None
+        if start is None:
+            return None
+        return timezone.make_aware(datetime.datetime.combine(start, datetime.time()), timezone.get_default_timezone())
+
+    def obj_get(self, bundle, **kwargs):
+        """
+        Expenses are read by id from the history, as the expense may be archived. Looking
+        up an id reads the primary key index of each table, so it is as quick as before.
+        """
+        if bundle.request is not None:
+            bundle.request._expense_model = ExpenseHistory
+        return super(ExpenseResource, self).obj_get(bundle, **kwargs)
+
+    def apply_filters(self, request, applicable_filters):
+        """
+        Apply the filters, and the search given by the q parameter if any (see
+        expense.search). Searched expenses are listed most relevant first, unless
+        ordered by the order_by parameter or paged by cursor, which order by date.
+        """
+        objects = super(ExpenseResource, self).apply_filters(request, applicable_filters)
+        if request is not None and request.GET.get('q'):
+            objects = search_expenses(objects, request.GET['q'])
+        return objects
+
     def authorized_read_list(self, object_list, bundle):
         """
         All "list" methods must filter by this user only.
@@ -130,23 +608,114 @@ class ExpenseResource(BaseModelResource):
 
     def alter_list_data_to_serialize(self, request, data):
         """
-        Add total amount and average to meta response.
+        Add total amount, average, and the date range covered to the meta response.
+        The figures are aggregated by the database over every expense matching the
+        request's filters, not just the expenses on the current page. Fields which
+        weren't requested are removed from the bundles of the full list path.
         """
-        total_amount = Decimal('0')
-        average = Decimal('0')
+        data['meta'].update(self.get_list_totals(request))
+        self.trim_bundles(request, data[self._meta.collection_name])
+        return data
+
+    def trim_bundles(self, request, bundles):
+        """
+        Remove the fields which weren't requested (see requested_fields) from dehydrated bundles.
+        :param request: Django request object
+        :param bundles: A list of bundles, or of dictionaries from the lean list path which are left as they are
+        :return: The list
+        """
+        requested = self.requested_fields(request)
+        if requested is not None:
+            for bundle in bundles:
+                if isinstance(bundle, Bundle):
+                    bundle.data = dict((name, value) for name, value in bundle.data.items() if name in requested)
+        return bundles
+
+    def aggregate_list(self, request):
+        """
+        Aggregate the filtered, authorised list of expenses. The count and total come
+        from the date rollup when the list covers whole months (see rollup_list_spans),
+        and the first and last dates from the ends of the date index, so the cost
+        doesn't grow with the number of expenses. Otherwise they are aggregated in a
+        single query. The result is kept on the request, as both the totals and the
+        page count use it.
+        :param request: Django request object
+        :return: A dictionary of the total_amount, count, first_date and last_date
+        """
+        if not hasattr(request, '_expense_list_aggregate'):
+            objects = self.obj_get_list(bundle=self.build_bundle(request=request)).order_by()
+            rollup = self.rollup_list_spans(request)
+            if rollup is None:
+                request._expense_list_aggregate = objects.aggregate(
+                    total_amount=Sum('amount'), count=Count('id'), first_date=Min('date'), last_date=Max('date'))
+                return request._expense_list_aggregate
 
-        # Sum the amount for all objects to get the total_amount
-        for obj in data['objects']:
-            total_amount += obj.obj.amount
+            spans, end = rollup
+            count, total_amount = rollup_totals(request.user, spans)
+            first_date, last_date = None, None
+            if count or end is not None:
+                first_date = objects.order_by('date').values_list('date', flat=True).first()
+                last_date = objects.order_by('-date').values_list('date', flat=True).first()
+            if end is not None and last_date == end:
+                # The range includes the midnight it ends at, which isn't part of the spans
+                boundary = objects.filter(date=end).aggregate(count=Count('id'), total_amount=Sum('amount'))
+                count += boundary['count']
+                total_amount += boundary['total_amount']
+            request._expense_list_aggregate = {'total_amount': total_amount, 'count': count,
+                                               'first_date': first_date, 'last_date': last_date}
+        return request._expense_list_aggregate
 
-        # Divide the total by the number of items to get average
-        count = len(data['objects'])
-        if count:
-            average = total_amount / count
+    def rollup_list_spans(self, request):
+        """
+        The spans of the date rollup (see expense.aggregation.rollup_spans) covering the
+        list, if it is only filtered by a date__range of whole days, or not at all, and
+        includes at least one whole month. Shorter lists are quicker to aggregate directly,
+        as are searches, which the rollup can't answer.
+        :param request: Django request object
+        :return: A tuple of the spans and the end of the range, or None
+        """
+        if request.GET.get('q'):
+            return None
+        filters = self.build_filters(request.GET)
+        if set(filters) - {'date__range'}:
+            return None
+        if not filters:
+            return rollup_spans(datetime.date(datetime.MINYEAR, 1, 1), datetime.date(datetime.MAXYEAR, 1, 1)), None
 
-        data['meta']['total_amount'] = total_amount
-        data['meta']['average'] = average
-        return data
+        try:
+            start, end = [parse_date(value) for value in filters['date__range']]
+        except (TypeError, ValueError):
+            return None
+        if start is None or end is None:
+            return None
+        spans = rollup_spans(start, end)
+        if all(bucket == 'day' for bucket, _, _ in spans):
+            return None
+        # Django reads the dates as midnight in the default time zone, as the rollup is kept
+        end = timezone.make_aware(datetime.datetime.combine(end, datetime.time()), timezone.get_default_timezone())
+        return spans, end
+
+    def get_list_totals(self, request):
+        """
+        The totals of the filtered, authorised list of expenses, from aggregate_list.
+        :param request: Django request object
+        :return: A dictionary of the totals to be added to the list meta
+        """
+        totals = self.aggregate_list(request)
+
+        total_amount = totals['total_amount'] or Decimal('0')
+        average = Decimal('0')
+        # Divide the total by the number of items to get average. The database AVG is
+        # avoided because some backends (SQLite) return it as a float.
+        if totals['count']:
+            average = total_amount / totals['count']
+
+        return {
+            'total_amount': total_amount,
+            'average': average,
+            'first_date': totals['first_date'],
+            'last_date': totals['last_date'],
+        }
 
     class Meta:
         list_allowed_methods = ['get', 'post']
@@ -154,18 +723,165 @@ class ExpenseResource(BaseModelResource):
         queryset = Expense.objects.all()
         resource_name = 'expense'
         authorization = Authorization()
-        authentication = ApiKeyAuthentication()
+        authentication = CachedApiKeyAuthentication()
         filtering = {'date': ['range']}
+        ordering = ['date']
+        paginator_class = KeysetPaginator
+        # Only used to sync, see the sync view
+        excludes = ['revision']
+
+
+class BaseTotalResource(ReplicaReadMixin, ConditionalListMixin, Resource):
+    """
+    The filtering and ordering by start_date shared by the resources which total
+    expenses over periods of time.
+    """
+    # The totals are read far more often than they change
+    cache_list_responses = True
+    read_from_replica = True
+
+    def build_filters(self, filters=None):
+        """
+        Convert the start_date filters in the query string to ORM filters.
+        :param filters: The request's GET dictionary
+        :return: A dictionary of ORM filters
+        """
+        if filters is None:
+            filters = {}
+
+        qs_filters = {}
+        for filter_expr, value in filters.items():
+            field_name, _, filter_type = filter_expr.partition('__')
+            if field_name not in self._meta.filtering:
+                continue
+            filter_type = filter_type or 'exact'
+            if filter_type not in self._meta.filtering[field_name]:
+                raise InvalidFilterError("'{0}' is not an allowed filter on the '{1}' field.".format(filter_type,
+                                                                                                  field_name))
+            if filter_type == 'range':
+                value = [self._parse_filter_date(bit) for bit in value.split(',')]
+                if len(value) != 2:
+                    raise InvalidFilterError("The range filter on '{0}' needs two dates.".format(field_name))
+            else:
+                value = self._parse_filter_date(value)
+            qs_filters[str('{0}__{1}'.format(field_name, filter_type))] = value
+
+        return qs_filters
+
+    @staticmethod
+    def _parse_filter_date(value):
+        """
+        Parse a date from the query string, ignoring any time part.
+        """
+        date = parse_date(value.split('T')[0].split(' ')[0]) if value else None
+        if date is None:
+            raise InvalidFilterError("'{0}' is not a valid date.".format(value))
+        return date
+
+    def apply_sorting(self, obj_list, options=None):
+        """
+        Order the totals by start_date, either ascending (the default) or descending.
+        :param obj_list: A queryset, or a list sorted by start_date
+        :param options: The request's GET dictionary
+        :return: The ordered queryset or list
+        """
+        order_by = (options or {}).get('order_by', 'start_date')
+        if order_by.lstrip('-') not in self._meta.ordering:
+            raise InvalidSortError("No matching '{0}' field for ordering on.".format(order_by))
+        if isinstance(obj_list, list):
+            return obj_list[::-1] if order_by.startswith('-') else obj_list
+        return obj_list.order_by(order_by)
 
 
-class WeeklyTotalResource(Resource):
-    """ Expose the WeeklyTotal objects over REST, and provide a level of authorisation """
+@profile_resource
+class TotalResource(BaseTotalResource):
+    """
+    Expose the totals of the user's expenses per day, week, month, quarter or year
+    (the bucket parameter, month by default) in the local time zone. Weeks are ISO
+    weeks, starting on Monday. The totals are aggregated by the database in one
+    query, and the start_date filters select whole buckets, e.g.
+    ?bucket=quarter&start_date__range=2013-01-01,2013-12-31 for the quarters of 2013.
+    """
+    start_date = fields.DateField(attribute='start_date')
+    count = fields.IntegerField(attribute='count', help_text="The number of expenses")
+    total = fields.DecimalField(attribute='total', help_text="The total amount for all expenses")
+    average_expense = fields.DecimalField(attribute='average_expense',
+                                          help_text="The average amount of an expense, the total divided by the count")
+    minimum = fields.DecimalField(attribute='minimum', help_text="The smallest amount of an expense")
+    maximum = fields.DecimalField(attribute='maximum', help_text="The largest amount of an expense")
+
+    def get_object_list(self, request, start=None):
+        """
+        The expenses of the logged in user, read from the history of their recent and archived
+        expenses only if any of the archived ones are on or after start, see expense.archive.
+        """
+        return expense_model(request.user, start, self.archived_until(request)).objects.filter(user=request.user)
+
+    def obj_get_list(self, bundle, **kwargs):
+        """
+        Total the expenses of the buckets which match the start_date filters.
+        :param bundle:
+        :param kwargs:
+        :return: A list of BucketTotal, sorted by start_date
+        """
+        bucket = bundle.request.GET.get('bucket', 'month')
+        if bucket not in BUCKETS:
+            raise BadRequest("'{0}' is not a bucket, use one of {1}.".format(bucket, ', '.join(BUCKETS)))
+
+        # Find the first and last day of the buckets to include
+        first, last = None, None
+        for filter_expr, value in self.build_filters(bundle.request.GET).items():
+            filter_type = filter_expr.split('__')[1]
+            if filter_type == 'range':
+                value, last_value = value
+                last = min(last or last_value, last_value)
+                filter_type = 'gte'
+            if filter_type in ('exact', 'gte', 'gt'):
+                # The first bucket which starts on or after the date (or after it, for gt)
+                start = bucket_start(value, bucket)
+                if start < value or (filter_type == 'gt' and start == value):
+                    start = next_bucket_start(value, bucket)
+                first = max(first or start, start)
+            if filter_type in ('exact', 'lte', 'lt'):
+                # The last day of the last bucket which starts on or before the date (or before it, for lt)
+                end = value - datetime.timedelta(days=1) if filter_type == 'lt' else value
+                last = min(last or end, end)
+        if last is not None:
+            last = next_bucket_start(last, bucket) - datetime.timedelta(days=1)
+
+        expenses = self.get_object_list(bundle.request, local_midnight(first) if first is not None else None)
+        if first is not None:
+            expenses = expenses.filter(date__gte=local_midnight(first))
+        if last is not None:
+            expenses = expenses.filter(date__lt=local_midnight(last + datetime.timedelta(days=1)))
+        if first is not None and last is not None and first > last:
+            return []
+        return bucket_totals(expenses, bucket)
+
+    class Meta:
+        list_allowed_methods = ['get', ]
+        detail_allowed_methods = []
+        resource_name = 'total'
+        authorization = Authorization()
+        authentication = CachedApiKeyAuthentication()
+        filtering = {'start_date': ['exact', 'range', 'gt', 'gte', 'lt', 'lte']}
+        ordering = ['start_date']
+
+
+@profile_resource
+class WeeklyTotalResource(BaseTotalResource):
+    """
+    Expose the WeeklyTotal objects over REST, and provide a level of authorisation.
+    The week bucket of TotalResource, read from the weekly rollup, with the ISO year
+    and week number and the average per day rather than per expense.
+    """
     year = fields.DateField(attribute='year')
     week_number = fields.IntegerField(attribute='week_number')
     start_date = fields.DateField(attribute='start_date')
     count = fields.IntegerField(attribute='count', help_text="The number of expenses this week")
     total = fields.DecimalField(attribute='total', help_text="The total amount for all expenses this week")
-    average = fields.DecimalField(attribute='average', help_text="The average amount for expenses this week")
+    average = fields.DecimalField(attribute='average',
+                                  help_text="The average amount spent per day this week, the total divided by 7")
 
     def get_object_list(self, request):
         """
@@ -173,42 +889,186 @@ class WeeklyTotalResource(Resource):
         :param request:
         :return:
         """
-        # Construct the weekly total data using all expenses belonging to the logged in user
-        expenses = Expense.objects.filter(user=request.user)
-        return _build_weekly_totals(expenses)
+        # Read the weekly totals of the logged in user from their rollup
+        return WeeklyRollup.objects.filter(user=request.user)
 
     def obj_get_list(self, bundle, **kwargs):
         """
-        Fetches the list of objects available on the resource.
+        Fetches the list of objects available on the resource. The weeks are filtered
+        in the database, so only the rows for the requested range are read.
         :param bundle:
         :param kwargs:
         :return:
         """
-        # Filtering disabled for brevity...
-        return self.get_object_list(bundle.request)
+        filters = self.build_filters(bundle.request.GET)
+        return self.get_object_list(bundle.request).filter(**filters)
 
     class Meta:
         list_allowed_methods = ['get', ]
         detail_allowed_methods = []
         resource_name = 'weeklytotal'
         authorization = Authorization()
-        authentication = ApiKeyAuthentication()
+        authentication = CachedApiKeyAuthentication()
+        filtering = {'start_date': ['exact', 'range', 'gt', 'gte', 'lt', 'lte']}
+        ordering = ['start_date']
+
+
+@profile_resource
+class SpendingResource(BaseTotalResource):
+    """
+    Expose the weekly spending of the user, with rolling 4 and 12 week averages and
+    the change from the week before, and a summary in the meta of the percentiles of
+    the expense amounts and weekly totals and the weekly trend (a least squares line
+    through the weekly totals, as its slope per week and its value in the first week).
+    Weeks are ISO weeks in the local time zone, and weeks without expenses are
+    listed with a total of 0. The start_date filters select the weeks listed and
+    summarised, but the rolling averages and changes still count earlier weeks.
+    """
+    start_date = fields.DateField(attribute='start_date')
+    count = fields.IntegerField(attribute='count', help_text="The number of expenses this week")
+    total = fields.DecimalField(attribute='total', help_text="The total amount for all expenses this week")
+    rolling_average_4 = fields.DecimalField(attribute='rolling_average_4', null=True,
+                                            help_text="The average weekly total of the last 4 weeks")
+    rolling_average_12 = fields.DecimalField(attribute='rolling_average_12', null=True,
+                                             help_text="The average weekly total of the last 12 weeks")
+    change = fields.DecimalField(attribute='change', null=True, help_text="The change in total from last week")
+    change_percent = fields.DecimalField(attribute='change_percent', null=True,
+                                         help_text="The change in total as a percentage of last week's")
+
+    def obj_get_list(self, bundle, **kwargs):
+        """
+        Build the weekly spending of the weeks which match the start_date filters, and
+        keep the summary on the request for alter_list_data_to_serialize.
+        :param bundle:
+        :param kwargs:
+        :return: A list of WeeklySpending, sorted by start_date
+        """
+        first, last = None, None
+        for filter_expr, value in self.build_filters(bundle.request.GET).items():
+            filter_type = filter_expr.split('__')[1]
+            if filter_type == 'range':
+                value, last_value = value
+                last = min(last or last_value, last_value)
+                filter_type = 'gte'
+            if filter_type in ('exact', 'gte', 'gt'):
+                start = value + datetime.timedelta(days=1) if filter_type == 'gt' else value
+                first = max(first or start, start)
+            if filter_type in ('exact', 'lte', 'lt'):
+                end = value - datetime.timedelta(days=1) if filter_type == 'lt' else value
+                last = min(last or end, end)
+
+        weeks, bundle.request._spending_summary = spending_analytics(bundle.request.user, first, last,
+                                                                     self.archived_until(bundle.request))
+        return weeks
+
+    def alter_list_data_to_serialize(self, request, data):
+        """
+        Add the summary statistics to the meta.
+        """
+        data['meta'].update(getattr(request, '_spending_summary', {}))
+        return data
+
+    class Meta:
+        list_allowed_methods = ['get', ]
+        detail_allowed_methods = []
+        resource_name = 'spending'
+        authorization = Authorization()
+        authentication = CachedApiKeyAuthentication()
+        filtering = {'start_date': ['exact', 'range', 'gt', 'gte', 'lt', 'lte']}
+        ordering = ['start_date']
+
+
+@profile_resource
+class DashboardResource(ReplicaReadMixin, ConditionalListMixin, Resource):
+    """
+    Everything the expense list page needs in one response: the page of expenses and
+    its meta, exactly as from the expense list (with the same parameters), and the
+    weekly totals of the weeks of the expenses on the page, so there are never more
+    weeks than expenses, however the page is ordered or searched.
+    The request is authenticated and its version looked up once, and the totals
+    aggregate also gives the page's total_count.
+    """
+
+    read_from_replica = True
+
+    def __init__(self, api_name=None):
+        super(DashboardResource, self).__init__(api_name=api_name)
+        self.expenses = ExpenseResource(api_name=api_name)
+        self.weekly_totals = WeeklyTotalResource(api_name=api_name)
+
+    def build_list_response(self, request, **kwargs):
+        """
+        Build the dashboard from the expense list data and the weekly totals.
+        :param request: Django request object
+        :param kwargs:
+        :return: The dashboard response
+        """
+        serializer = self._meta.serializer
+        self.check_date_range(request)
+        data = self.expenses.get_list_data(request)
+        data['weekly_totals'] = [OrderedDict(sorted(serializer.to_simple(week, {}).items()))
+                                 for week in self.get_weekly_totals(request)]
+        collection_name = self.expenses._meta.collection_name
+        # The expenses are bundles if the expense list can't take its lean path
+        data[collection_name] = [OrderedDict(sorted(serializer.to_simple(row, {}).items()))
+                                 if isinstance(row, Bundle) else row for row in data[collection_name]]
+        return HttpResponse(content=self.expenses.serialize_list(request, data),
+                            content_type=build_content_type(self.expenses.determine_format(request)))
+
+    def check_date_range(self, request):
+        """
+        Check the date__range filter has two dates, as the expense list doesn't.
+        :param request: Django request object
+        """
+        date_range = request.GET.getlist('date__range')
+        if len(date_range) == 1:
+            date_range = date_range[0].split(',')
+        if date_range:
+            if len(date_range) != 2:
+                raise InvalidFilterError("The range filter on 'date' needs two dates.")
+            for value in date_range:
+                self.weekly_totals._parse_filter_date(value)
+
+    def get_weekly_totals(self, request):
+        """
+        The dehydrated weekly totals of the weeks of the expenses on the page, in date order.
+        The page is read first (see ExpenseResource.get_list_data), which keeps the weeks of
+        its expenses on the request.
+        :param request: Django request object
+        :return: A list of bundles
+        """
+        if not request._expense_page_weeks:
+            return []
+        weeks = self.weekly_totals.get_object_list(request).filter(
+            start_date__in=sorted(request._expense_page_weeks)).order_by('start_date')
+        return [self.weekly_totals.full_dehydrate(self.weekly_totals.build_bundle(obj=week, request=request),
+                                                  for_list=True)
+                for week in weeks]
+
+    class Meta:
+        list_allowed_methods = ['get', ]
+        detail_allowed_methods = []
+        resource_name = 'dashboard'
+        authorization = Authorization()
+        authentication = CachedApiKeyAuthentication()
 
 
 def _build_weekly_totals(expenses):
     """
-    Build a list of WeeklyTotal using an unordered list of expense objects.
+    Build a list of WeeklyTotal using an unordered list of expense objects. This is the
+    pure Python equivalent of expense.aggregation.weekly_totals, used for lists of
+    expenses which are not a queryset.
     :param expenses: A list or queryset of expense objects
     :return: a sorted list of WeeklyTotal, sorted by week
     """
-    weekly_totals = []
+    totals = []
 
     weeks = _organise_expenses_into_weeks(expenses)
     for week_number in weeks.keys():
         # Construct a new WeeklyTotal object and add it to the list
-        weekly_totals.append(WeeklyTotal(week_number[0], week_number[1], weeks[week_number]))
+        totals.append(WeeklyTotal.from_expenses(week_number[0], week_number[1], weeks[week_number]))
 
-    return weekly_totals
+    return totals
 
 
 def _organise_expenses_into_weeks(expenses):
@@ -221,8 +1081,8 @@ def _organise_expenses_into_weeks(expenses):
     """
     weeks = defaultdict(list)
     for expense in expenses:
-        # Determine which year and week the expense belongs to.
-        expense_year_week = expense.date.date().isocalendar()[:2]
+        # Determine which year and week the expense belongs to, in the local time zone.
+        expense_year_week = timezone.localtime(expense.date).isocalendar()[:2]
         weeks[expense_year_week].append(expense)
     # Order the expenses chronologically
     return OrderedDict(sorted(weeks.items(), key=lambda t: t[0]))
@@ -0,0 +1,121 @@
+# coding=utf-8
+"""
+Send the reads of API read requests to read replicas of the default (primary)
+database. Resources opt in with read_from_replica (see expense.resources), and while
+one handles a GET its queries are routed to a replica from settings.READ_REPLICAS,
+picked once per request. Everything else reads from the primary: other requests,
+lookups of users and API keys (so authentication always sees the latest keys), and
+reads inside a write transaction. Writes always go to the primary.
+
+Replicas lag behind the primary, so a user who has just changed their expenses would
+not see the change. After any change, the user's reads stay on the primary for
+settings.REPLICA_STICKY_SECONDS. The marker is kept in the default cache, which
+must be shared by every process (e.g. memcached) for it to follow the user between
+processes.
+"""
+from __future__ import absolute_import, unicode_literals, print_function, division
+import random
+import threading
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# The apps whose models are always read from the primary
+PRIMARY_APPS = ('auth', 'tastypie', 'sessions')
+# The number of seconds a user's reads stay on the primary after they change their
+# expenses, when not set in settings
+DEFAULT_STICKY_SECONDS = 10
+
+_local = threading.local()
+
+
+def read_replicas():
+    """
+    The aliases of the read replicas, from settings.READ_REPLICAS.
+    """
+    return tuple(getattr(settings, 'READ_REPLICAS', ()))
+
+
+def _sticky_key(user_id):
+    return 'replica-sticky:{0}'.format(user_id)
+
+
+def stick_to_primary(user_id):
+    """
+    Keep a user's reads on the primary for a while, so they see their own changes
+    before the replicas do.
+    :param user_id: The primary key of the user
+    :return: None
+    """
+    if read_replicas():
+        cache.set(_sticky_key(user_id), True, getattr(settings, 'REPLICA_STICKY_SECONDS', DEFAULT_STICKY_SECONDS))
+
+
+def is_stuck_to_primary(user_id):
+    """
+    Whether a user changed their expenses too recently to read from a replica.
+    """
+    return bool(cache.get(_sticky_key(user_id)))
+
+
+@contextmanager
+def replica_reads(request):
+    """
+    Route the reads made in the with block to a replica, once the request's user has
+    been authenticated.
+    :param request: Django request object
+    """
+    previous = getattr(_local, 'request', None)
+    _local.request = request
+    try:
+        yield
+    finally:
+        _local.request = previous
+
+
+def current_replica():
+    """
+    The replica the current request reads from, picked on its first read after it
+    was authenticated.
+    :return: The alias of the replica, or None to read from the primary
+    """
+    request = getattr(_local, 'request', None)
+    if request is None:
+        return None
+    if not hasattr(request, '_read_replica'):
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_authenticated():
+            # Not authenticated yet, so ask again on the next read
+            return None
+        replicas = read_replicas()
+        request._read_replica = random.choice(replicas) if replicas and not is_stuck_to_primary(user.pk) else None
+    return request._read_replica
+
+
+class ReplicaRouter(object):
+    """
+    The database router which sends the reads of API read requests to a replica, see above.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in PRIMARY_APPS or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return current_replica()
+
+    def db_for_write(self, model, **hints):
+        # Even objects read from a replica
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same data as the primary
+        databases = (DEFAULT_DB_ALIAS,) + read_replicas()
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_syncdb(self, db, model):
+        # The replicas get their tables from the primary
+        if db in read_replicas():
+            return False
+        return None
@@ -0,0 +1,187 @@
+# coding=utf-8
+"""
+Full-text search over the description and comment of expenses, backed by an index
+the database keeps up to date itself: an FTS5 table kept in step by triggers on
+SQLite, a GIN index on PostgreSQL and a FULLTEXT index on MySQL. Every word of a
+search must match the start of a word of the expense, e.g. "car rep" finds
+"Car repairs". Matches are ranked by relevance, most relevant first.
+
+The index is created by syncdb (see expense.management), and as the triggers and
+indexes belong to the database, expenses saved with bulk_create or update() are
+indexed too. The archive (see expense.archive) has an index of its own, and searches
+of the history use both, so expenses are found whether they are archived or not. The
+relevance of each match is ranked against the other expenses of its own table.
+"""
+from __future__ import absolute_import, unicode_literals, print_function, division
+import re
+from django.db import connections
+from expense.models import ArchivedExpense, Expense, ExpenseHistory
+
+# The FTS5 tables on SQLite, and the names of the indexes elsewhere, of the expense table and the archive
+SEARCH_INDEX = 'expense_expense_search'
+ARCHIVE_SEARCH_INDEX = 'expense_archivedexpense_search'
+
+# The documents searched on PostgreSQL, which must match the indexed expression exactly
+POSTGRESQL_DOCUMENT = "to_tsvector('simple', {0} || ' ' || {1})"
+
+
+def search_terms(q):
+    """
+    Split a search into words, dropping any punctuation (and with it any search syntax).
+    :param q: The search as typed
+    :return: A list of words
+    """
+    return re.findall(r'\w+', q, re.UNICODE)
+
+
+def create_search_index(connection):
+    """
+    Create the search indexes of the expense table and the archive, if they don't exist yet.
+    :param connection: The database connection
+    :return: True if either index was created
+    """
+    created = False
+    for model, name in ((Expense, SEARCH_INDEX), (ArchivedExpense, ARCHIVE_SEARCH_INDEX)):
+        created = _create_table_index(connection, model, name) or created
+    return created
+
+
+def _create_table_index(connection, model, name):
+    """
+    Create the search index of a table of expenses, if it doesn't exist yet.
+    :param connection: The database connection
+    :param model: The model of the table, Expense or ArchivedExpense
+    :param name: The name of the index
+    :return: True if the index was created
+    """
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    cursor = connection.cursor()
+
+    if connection.vendor == 'sqlite':
+        if name in connection.introspection.table_names(cursor):
+            return False
+        index = qn(name)
+        # An external content table, which stores only the index and reads the text from the expense table
+        cursor.execute("CREATE VIRTUAL TABLE {0} USING fts5(description, comment, content={1}, "
+                       "content_rowid='id')".format(index, table))
+        cursor.execute('CREATE TRIGGER {0} AFTER INSERT ON {1} BEGIN '
+                       'INSERT INTO {2} (rowid, description, comment) VALUES (new.id, new.description, new.comment); '
+                       'END'.format(qn(name + '_insert'), table, index))
+        cursor.execute("CREATE TRIGGER {0} AFTER DELETE ON {1} BEGIN "
+                       "INSERT INTO {2} ({2}, rowid, description, comment) "
+                       "VALUES ('delete', old.id, old.description, old.comment); "
+                       "END".format(qn(name + '_delete'), table, index))
+        cursor.execute("CREATE TRIGGER {0} AFTER UPDATE OF description, comment ON {1} BEGIN "
+                       "INSERT INTO {2} ({2}, rowid, description, comment) "
+                       "VALUES ('delete', old.id, old.description, old.comment); "
+                       "INSERT INTO {2} (rowid, description, comment) VALUES (new.id, new.description, new.comment); "
+                       "END".format(qn(name + '_update'), table, index))
+        # Index any expenses which already exist
+        cursor.execute("INSERT INTO {0} ({0}) VALUES ('rebuild')".format(index))
+        return True
+
+    if connection.vendor == 'postgresql':
+        cursor.execute('SELECT 1 FROM pg_indexes WHERE indexname = %s', [name])
+        if cursor.fetchone():
+            return False
+        cursor.execute('CREATE INDEX {0} ON {1} USING gin ({2})'.format(
+            qn(name), table, POSTGRESQL_DOCUMENT.format(qn('description'), qn('comment'))))
+        return True
+
+    if connection.vendor == 'mysql':
+        cursor.execute('SELECT 1 FROM information_schema.statistics WHERE table_schema = DATABASE() '
+                       'AND table_name = %s AND index_name = %s', [model._meta.db_table, name])
+        if cursor.fetchone():
+            return False
+        cursor.execute('CREATE FULLTEXT INDEX {0} ON {1} ({2}, {3})'.format(
+            qn(name), table, qn('description'), qn('comment')))
+        return True
+
+    raise NotImplementedError('Expense search is not supported on {0}'.format(connection.vendor))
+
+
+def search_expenses(expenses, q):
+    """
+    Filter expenses down to those which match a search, ordered by relevance and then
+    id. The search_rank of each expense is selected, and is lower for a better match.
+    :param expenses: A queryset of expenses, or of the history of the expenses and the archive
+    :param q: The search as typed
+    :return: The queryset
+    """
+    terms = search_terms(q)
+    if not terms:
+        return expenses.none()
+
+    connection = connections[expenses.db]
+    qn = connection.ops.quote_name
+    history = expenses.model is ExpenseHistory
+    table = qn(expenses.model._meta.db_table)
+    description, comment = ['{0}.{1}'.format(table, qn(name)) for name in ('description', 'comment')]
+
+    if connection.vendor == 'sqlite':
+        match = ' '.join('"{0}"*'.format(term) for term in terms)
+        if history:
+            return _search_tables(expenses, table, match, [(
+                'SELECT rowid FROM {0} WHERE {0} MATCH %s'.format(qn(name)),
+                'SELECT rank FROM {0} WHERE {0} MATCH %s AND rowid = {{0}}'.format(qn(name)),
+            ) for name in (SEARCH_INDEX, ARCHIVE_SEARCH_INDEX)])
+        # The index is joined on the expense id, so the database finds the matches in the
+        # index and then looks each expense up by id. FTS5 ranks the best matches lowest.
+        index = qn(SEARCH_INDEX)
+        return expenses.extra(
+            tables=[SEARCH_INDEX],
+            where=['{0}.rowid = {1}.id'.format(index, table), '{0} MATCH %s'.format(index)], params=[match],
+            select={'search_rank': '{0}.rank'.format(index)}, order_by=['search_rank', 'id'])
+
+    if connection.vendor == 'postgresql':
+        # A condition on the history is applied to each of its tables, which use their own index
+        document = POSTGRESQL_DOCUMENT.format(description, comment)
+        query = ' & '.join("'{0}':*".format(term) for term in terms)
+        return expenses.extra(
+            where=["{0} @@ to_tsquery('simple', %s)".format(document)], params=[query],
+            select={'search_rank': "-ts_rank({0}, to_tsquery('simple', %s))".format(document)},
+            select_params=[query], order_by=['search_rank', 'id'])
+
+    if connection.vendor == 'mysql':
+        query = ' '.join('+{0}*'.format(term) for term in terms)
+        if history:
+            return _search_tables(expenses, table, query, [(
+                'SELECT {0} FROM {1} WHERE {2}'.format(qn('id'), qn(model._meta.db_table),
+                                                       _mysql_match(qn, qn(model._meta.db_table))),
+                'SELECT -{2} FROM {1} WHERE {0} = {{0}}'.format(qn('id'), qn(model._meta.db_table),
+                                                               _mysql_match(qn, qn(model._meta.db_table))),
+            ) for model in (Expense, ArchivedExpense)])
+        match = _mysql_match(qn, table)
+        return expenses.extra(where=[match], params=[query], select={'search_rank': '-' + match},
+                              select_params=[query], order_by=['search_rank', 'id'])
+
+    raise NotImplementedError('Expense search is not supported on {0}'.format(connection.vendor))
+
+
+def _search_tables(expenses, table, query, searches):
+    """
+    Search the history one table at a time, for databases which can't use the search
+    indexes through the view: the expenses are looked up by the ids matched in the index
+    of each table, and the rank of each is read back from the index of its own table.
+    :param expenses: A queryset of the history
+    :param table: The quoted name of the history view
+    :param query: The search, as the database's full-text queries take it
+    :param searches: For the expense table and the archive, the SQL selecting the ids of
+        the matches, and the SQL selecting the rank of the match with the id {0}
+    :return: The queryset
+    """
+    column = '{0}.id'.format(table)
+    return expenses.extra(
+        where=['{0} IN ({1})'.format(column, ' UNION ALL '.join(ids for ids, _ in searches))],
+        params=[query] * len(searches),
+        select={'search_rank': 'COALESCE({0})'.format(', '.join(
+            '({0})'.format(rank.format(column)) for _, rank in searches))},
+        select_params=[query] * len(searches), order_by=['search_rank', 'id'])
+
+
+def _mysql_match(qn, table):
+    """
+    The MySQL condition matching the expenses of a table against a search, and their relevance.
+    """
+    return 'MATCH ({0}.{1}, {0}.{2}) AGAINST (%s IN BOOLEAN MODE)'.format(table, qn('description'), qn('comment'))
@@ -0,0 +1,90 @@
+# coding=utf-8
+"""
+Find the expenses a user has saved or deleted since a sync token, so that a client
+keeping its own copy of the expenses only fetches what has changed. Every change
+bumps the user's ExpenseVersion: saved expenses are stamped with the new version
+as their revision, and deletions leave an ExpenseTombstone with it. Both are
+indexed by (user, revision), so a sync reads only the changed rows. Archived
+expenses keep their revisions, so they are read through the history too.
+"""
+from __future__ import absolute_import, unicode_literals, print_function, division
+from django.db.models import Q
+from expense.models import ExpenseHistory, ExpenseTombstone, ExpenseVersion
+
+
+def encode_sync_token(revision, pk=None):
+    """
+    Build the token for the changes after the given revision, or after the given
+    expense of that revision when the changes are split across several pages.
+    """
+    if pk is None:
+        return '{0}'.format(revision)
+    return '{0}.{1}'.format(revision, pk)
+
+
+def decode_sync_token(token):
+    """
+    Read the revision and expense id from a sync token.
+    :param token: The token from the previous sync, or an empty string for the first
+    :return: A tuple of the revision and expense id (which may be None), or None for the first sync
+    :raise ValueError: If the token is invalid
+    """
+    if not token:
+        return None
+    revision, _, pk = token.partition('.')
+    revision, pk = int(revision), int(pk) if pk else None
+    if revision < 0 or (pk is not None and pk < 0):
+        raise ValueError(token)
+    return revision, pk
+
+
+def expense_changes(user, token, limit, fields=None):
+    """
+    The expenses saved and deleted since a sync token, oldest change first. Without a
+    token every expense is returned and nothing is deleted. Applying the deletions
+    before the saved expenses brings a copy up to date, and applying the same
+    changes more than once does no harm.
+    :param user: The user who owns the expenses
+    :param token: The token returned by the previous sync, or an empty string
+    :param limit: The greatest number of saved expenses to return
+    :param fields: The fields to read with values(), or None for ExpenseHistory objects
+    :return: A dictionary of the saved expenses, the ids of the deleted expenses, the token for the
+             next sync and whether there are more changes to fetch with it straight away
+    :raise ValueError: If the token is invalid
+    """
+    since = decode_sync_token(token)
+    # Read before the changes, so a change made during the sync is at worst sent again next time
+    version = ExpenseVersion.objects.filter(user=user).values_list('version', flat=True).first() or 0
+
+    expenses = ExpenseHistory.objects.filter(user=user)
+    tombstones = ExpenseTombstone.objects.filter(user=user)
+    if since:
+        revision, pk = since
+        if pk is None:
+            expenses = expenses.filter(revision__gt=revision)
+        else:
+            expenses = expenses.filter(Q(revision__gt=revision) | Q(revision=revision, id__gt=pk))
+        tombstones = tombstones.filter(revision__gt=revision)
+    expenses = expenses.order_by('revision', 'id')
+    if fields is not None:
+        expenses = expenses.values(*set(fields) | {'id', 'revision'})
+
+    # Fetch one extra expense to find out whether there is another page
+    saved = list(expenses[:limit + 1])
+    more = len(saved) > limit
+    saved = saved[:limit]
+    if more:
+        last = saved[-1]
+        last_revision, last_pk = (last['revision'], last['id']) if fields is not None else (last.revision, last.pk)
+        # The rest of the deletions come with the following pages
+        tombstones = tombstones.filter(revision__lte=last_revision)
+        token = encode_sync_token(last_revision, last_pk)
+    else:
+        token = encode_sync_token(version)
+
+    return {
+        'saved': saved,
+        'deleted': list(tombstones.order_by('revision').values_list('expense_id', flat=True)) if since else [],
+        'token': token,
+        'more': more,
+    }
@@ -0,0 +1,27 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals, print_function, division
+from contextlib import contextmanager
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetMixin(object):
+    """
+    Test case assertions which pin the most SQL queries a block of code may run,
+    e.g. one API request. Run the same request against a few rows and against many
+    with the same budget, so that a query per row (an N+1) fails the test.
+    """
+
+    @contextmanager
+    def assertQueryBudget(self, budget, using=DEFAULT_DB_ALIAS):
+        """
+        Fail if the with block runs more than budget queries, listing every query it ran.
+        :param budget: The most queries allowed
+        :param using: The alias of the database to count
+        """
+        with CaptureQueriesContext(connections[using]) as context:
+            yield context
+        if len(context) > budget:
+            self.fail('{0} queries executed, the budget is {1}:\n{2}'.format(
+                len(context), budget, '\n'.join('{0}. {1}'.format(number, query['sql'])
+                                                for number, query in enumerate(context.captured_queries, 1))))
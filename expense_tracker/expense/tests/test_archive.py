@@ -0,0 +1,193 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals, print_function, division
+import datetime
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import six
+from tastypie.test import ResourceTestCase
+from expense.aggregation import local_midnight
+from expense.archive import archive_cutoff, archive_expenses, newest_archived, restore_expenses
+from expense.caching import response_cache
+from expense.models import ArchivedExpense, DateRollup, Expense, ExpenseHistory, ExpenseVersion
+
+# The expenses of 2013 in the fixtures: 4, 11 and 15
+ARCHIVED_IDS = [4, 11, 15]
+
+
+class ArchiveTest(ResourceTestCase):
+    fixtures = ['user.json', 'expenses.json']
+
+    def setUp(self):
+        super(ArchiveTest, self).setUp()
+        self.user = User.objects.get(username='devinb')
+        self.before = local_midnight(datetime.date(2014, 1, 1))
+
+    def get_credentials(self):
+        return self.create_apikey(username=self.user.username, api_key=self.user.api_key.key)
+
+    def get(self, path, **params):
+        # The cached totals would hide whether the expenses were read again
+        response_cache().clear()
+        resp = self.api_client.get(path, format='json', data=params, authentication=self.get_credentials())
+        self.assertEqual(resp.status_code, 200)
+        if resp.streaming:
+            return b''.join(resp.streaming_content)
+        return resp.get('ETag'), self.deserialize(resp)
+
+    def responses(self):
+        """
+        The responses to reads of every kind, including some which reach into 2013. Lists
+        without an order_by are in no particular order, which archiving may change.
+        """
+        return [
+            self.get('/api/v1/expense/', limit=0, order_by='date'),
+            self.get('/api/v1/expense/', limit=2, order_by='-date', date__range='2013-01-01,2014-06-30'),
+            self.get('/api/v1/expense/', limit=2, cursor='', date__range='2013-01-01,2014-06-30'),
+            self.get('/api/v1/expense/', order_by='date', date__range='2013-11-01,2013-11-30'),
+            self.get('/api/v1/expense/', date__range='2014-07-01,2014-07-31'),
+            self.get('/api/v1/expense/', q='expense', order_by='date'),
+            self.get('/api/v1/expense/', q='expense', order_by='-date', date__range='2013-11-01,2014-06-30'),
+            self.get('/api/v1/expense/', q='boring', date__range='2013-01-01,2014-06-30'),
+            self.get('/api/v1/expense/4/'),
+            self.get('/api/v1/expense/sync/'),
+            self.get('/api/v1/expense/export/'),
+            self.get('/api/v1/total/', bucket='month'),
+            self.get('/api/v1/total/', bucket='week', start_date__range='2013-11-01,2014-01-31'),
+            self.get('/api/v1/weeklytotal/'),
+            self.get('/api/v1/spending/'),
+            self.get('/api/v1/spending/', start_date__gte='2013-11-25'),
+            self.get('/api/v1/dashboard/', order_by='-date', date__range='2013-11-01,2014-01-31'),
+        ]
+
+    def test_archive(self):
+        self.assertEqual(archive_expenses(self.before), len(ARCHIVED_IDS))
+        self.assertEqual(sorted(ArchivedExpense.objects.values_list('id', flat=True)), ARCHIVED_IDS)
+        self.assertFalse(Expense.objects.filter(id__in=ARCHIVED_IDS).exists())
+        self.assertEqual(ExpenseHistory.objects.count(), 17)
+        # Archiving again finds nothing to move
+        self.assertEqual(archive_expenses(self.before), 0)
+
+        self.assertEqual(restore_expenses(), len(ARCHIVED_IDS))
+        self.assertEqual(Expense.objects.count(), 17)
+        self.assertFalse(ArchivedExpense.objects.exists())
+
+    def test_archive_user(self):
+        self.assertEqual(archive_expenses(self.before, User.objects.get(username='carlr')), 0)
+        self.assertEqual(archive_expenses(self.before, self.user), len(ARCHIVED_IDS))
+
+    def test_newest_archived(self):
+        version = ExpenseVersion.objects.get(user=self.user)
+        self.assertIsNone(newest_archived(self.user))
+        archive_expenses(self.before)
+        self.assertEqual(newest_archived(self.user), ArchivedExpense.objects.get(pk=4).date)
+        restore_expenses(since=local_midnight(datetime.date(2013, 11, 1)))
+        self.assertEqual(newest_archived(self.user), ArchivedExpense.objects.get().date)
+        restore_expenses()
+        self.assertIsNone(newest_archived(self.user))
+        # Moving expenses doesn't change what the user sees, so neither does their version
+        self.assertEqual(ExpenseVersion.objects.filter(user=self.user).values_list('version', 'modified').get(),
+                         (version.version, version.modified))
+
+    def test_ids_not_reused(self):
+        # Every expense is archived, and then the newest one left is deleted
+        self.assertEqual(archive_expenses(local_midnight(datetime.date(2020, 1, 1)), batch_size=5), 17)
+        expense = Expense.objects.create(user=self.user, date=self.before, description='New', amount=1, comment='')
+        self.assertEqual(expense.pk, 18)
+        expense.delete()
+        expense = Expense.objects.create(user=self.user, date=self.before, description='New', amount=1, comment='')
+        self.assertEqual(expense.pk, 19)
+
+        ids = list(ExpenseHistory.objects.values_list('id', flat=True))
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(restore_expenses(), 17)
+
+    def test_transparent(self):
+        before = self.responses()
+        archive_expenses(self.before)
+        # Nothing the user can see changes, including the ETags
+        self.assertEqual(self.responses(), before)
+        restore_expenses()
+        self.assertEqual(self.responses(), before)
+
+    def test_search_archived(self):
+        archive_expenses(self.before)
+        # Expense 15 is archived and expense 8 isn't
+        data = self.get('/api/v1/expense/', q='boring', date__range='2013-01-01,2014-07-31')[1]
+        self.assertEqual(sorted(int(expense['id']) for expense in data['objects']), [8, 15])
+        self.assertEqual(data['meta']['total_count'], 2)
+
+    def test_recent_reads_expense_table(self):
+        archive_expenses(self.before)
+        with CaptureQueriesContext(connection) as context:
+            self.get('/api/v1/expense/', date__range='2014-07-01,2014-07-31')
+            self.get('/api/v1/total/', bucket='week', start_date__gte='2014-06-01')
+        self.assertFalse([query['sql'] for query in context.captured_queries
+                          if ExpenseHistory._meta.db_table in query['sql']])
+        with CaptureQueriesContext(connection) as context:
+            self.get('/api/v1/expense/', date__range='2013-07-01,2014-07-31')
+        self.assertTrue([query['sql'] for query in context.captured_queries
+                         if ExpenseHistory._meta.db_table in query['sql']])
+
+    def test_change_archived(self):
+        archive_expenses(self.before)
+        resp = self.api_client.put('/api/v1/expense/4/', format='json', authentication=self.get_credentials(),
+                                   data={'description': 'Changed', 'amount': '1.50', 'date': '2013-11-25T16:16:00'})
+        self.assertHttpAccepted(resp)
+        # It is moved back to be changed
+        self.assertEqual(Expense.objects.get(pk=4).description, 'Changed')
+        self.assertFalse(ArchivedExpense.objects.filter(pk=4).exists())
+
+        count = DateRollup.objects.get(user=self.user, bucket='year', start_date=datetime.date(2013, 1, 1)).count
+        self.assertHttpAccepted(self.api_client.delete('/api/v1/expense/11/', format='json',
+                                                       authentication=self.get_credentials()))
+        self.assertFalse(ExpenseHistory.objects.filter(pk=11).exists())
+        self.assertEqual(DateRollup.objects.get(user=self.user, bucket='year',
+                                                start_date=datetime.date(2013, 1, 1)).count, count - 1)
+
+    def test_change_archived_of_other_user(self):
+        archive_expenses(self.before)
+        other = User.objects.get(username='carlr')
+        credentials = self.create_apikey(username=other.username, api_key=other.api_key.key)
+        self.assertHttpNotFound(self.api_client.delete('/api/v1/expense/4/', format='json',
+                                                       authentication=credentials))
+        self.api_client.put('/api/v1/expense/11/', format='json', authentication=credentials,
+                            data={'description': 'Changed', 'amount': '1.50', 'date': '2013-11-25T16:16:00'})
+        # Neither is moved out of the archive, nor changed
+        self.assertEqual(sorted(ArchivedExpense.objects.values_list('id', flat=True)), ARCHIVED_IDS)
+        self.assertEqual(ArchivedExpense.objects.get(pk=11).description, 'expense 1')
+
+    def test_rollups_still_match(self):
+        archive_expenses(self.before)
+        out = six.StringIO()
+        call_command('date_rollup', verify=True, stdout=out)
+        call_command('weekly_rollup', verify=True, stdout=out)
+        self.assertEqual(out.getvalue(),
+                         'The date rollup matches the expenses\nThe weekly rollup matches the expenses\n')
+
+    def test_command(self):
+        out = six.StringIO()
+        call_command('archive_expenses', before='2014-01-01', stdout=out)
+        self.assertEqual(out.getvalue(), 'Archived 3 expenses from before 2014-01-01\n')
+        self.assertEqual(ArchivedExpense.objects.count(), 3)
+
+        out = six.StringIO()
+        call_command('archive_expenses', before='2013-06-01', restore=True, username='devinb', stdout=out)
+        self.assertEqual(out.getvalue(), 'Restored 2 expenses\n')
+        self.assertEqual(list(ArchivedExpense.objects.values_list('id', flat=True)), [15])
+
+        self.assertRaises(CommandError, call_command, 'archive_expenses', before='2014-13-01', stdout=out)
+        self.assertRaises(CommandError, call_command, 'archive_expenses', username='nobody', stdout=out)
+        self.assertRaises(CommandError, call_command, 'archive_expenses', batch_size=0, stdout=out)
+
+        # The test database's expense table was rebuilt by syncdb
+        out = six.StringIO()
+        call_command('archive_expenses', id_sequence=True, stdout=out)
+        self.assertEqual(out.getvalue(), 'Expense ids are already never given out again\n')
+
+    def test_cutoff(self):
+        self.assertEqual(archive_cutoff(datetime.date(2014, 8, 1)), datetime.date(2013, 1, 1))
+        with override_settings(ARCHIVE_KEEP_YEARS=1):
+            self.assertEqual(archive_cutoff(datetime.date(2014, 8, 1)), datetime.date(2014, 1, 1))
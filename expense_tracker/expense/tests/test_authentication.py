@@ -0,0 +1,63 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals, print_function, division
+from django.contrib.auth.models import User
+from tastypie.models import ApiKey
+from tastypie.test import ResourceTestCase
+from expense.authentication import api_key_cache
+
+
+class CachedApiKeyAuthenticationTest(ResourceTestCase):
+    fixtures = ['user.json', 'expenses.json']
+
+    def setUp(self):
+        super(CachedApiKeyAuthenticationTest, self).setUp()
+        api_key_cache().clear()
+        self.user = User.objects.get(username='devinb')
+        self.base_url = '/api/v1/weeklytotal/'
+
+    def get_credentials(self, api_key=None):
+        return self.create_apikey(username=self.user.username, api_key=api_key or self.user.api_key.key)
+
+    def get(self, api_key=None):
+        return self.api_client.get(self.base_url, format='json', authentication=self.get_credentials(api_key))
+
+    def test_cached(self):
+        self.assertHttpOK(self.get())
+        # Only the expense version remains once the key and the weekly totals are cached
+        with self.assertNumQueries(1):
+            self.assertHttpOK(self.get())
+
+    def test_wrong_key(self):
+        self.assertHttpOK(self.get())
+        self.assertHttpUnauthorized(self.get('notthekey'))
+
+    def test_key_regenerated(self):
+        old_key = self.user.api_key.key
+        self.assertHttpOK(self.get(old_key))
+        api_key = ApiKey.objects.get(user=self.user)
+        api_key.key = api_key.generate_key()
+        api_key.save()
+        self.assertHttpUnauthorized(self.get(old_key))
+        self.assertHttpOK(self.get(api_key.key))
+
+    def test_key_deleted(self):
+        api_key = self.user.api_key.key
+        self.assertHttpOK(self.get(api_key))
+        ApiKey.objects.filter(user=self.user).delete()
+        self.assertHttpUnauthorized(self.get(api_key))
+
+    def test_user_deactivated(self):
+        api_key = self.user.api_key.key
+        self.assertHttpOK(self.get(api_key))
+        self.user.is_active = False
+        self.user.save()
+        self.assertHttpUnauthorized(self.get(api_key))
+
+    def test_user_renamed(self):
+        api_key = self.user.api_key.key
+        self.assertHttpOK(self.get(api_key))
+        old_credentials = self.get_credentials(api_key)
+        self.user.username = 'devin'
+        self.user.save()
+        self.assertHttpUnauthorized(self.api_client.get(self.base_url, format='json', authentication=old_credentials))
+        self.assertHttpOK(self.get(api_key))
@@ -0,0 +1,105 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals, print_function, division
+import datetime
+from django.contrib.auth.models import User
+from django.utils import timezone
+from tastypie.test import ResourceTestCase
+from expense.caching import response_cache
+from expense.factories import create_expenses_bulk
+from expense.models import Expense
+from expense.tests.query_budget import QueryBudgetMixin
+from expense_tracker.urls import v1_api
+
+
+class DashboardResourceTest(QueryBudgetMixin, ResourceTestCase):
+    fixtures = ['user.json', 'expenses.json']
+
+    def setUp(self):
+        super(DashboardResourceTest, self).setUp()
+        response_cache().clear()
+        self.username = 'devinb'
+        self.user = User.objects.get(username=self.username)
+        self.base_url = '/api/v1/dashboard/'
+
+    def get_credentials(self):
+        return self.create_apikey(username=self.username, api_key=self.user.api_key.key)
+
+    def get(self, url, **params):
+        resp = self.api_client.get(url, format='json', data=params, authentication=self.get_credentials())
+        self.assertValidJSONResponse(resp)
+        return self.deserialize(resp)
+
+    def weeks(self, *start_dates):
+        """
+        The weekly totals of the weeks starting on the dates, as listed by the weekly totals.
+        """
+        return [week for week in self.get('/api/v1/weeklytotal/', limit=0)['objects']
+                if week['start_date'] in start_dates]
+
+    def test_get_list_unauthorized(self):
+        self.assertHttpUnauthorized(self.api_client.get(self.base_url, format='json'))
+
+    def test_get_list(self):
+        # The expenses and meta are the same as the expense list's, and the weeks the weekly totals'
+        # of the weeks of the page's expenses, dated 2013-05-12 (a Sunday), 2013-11-25 and 2014-01-13
+        dashboard = self.get(self.base_url, limit=5, order_by='date')
+        expenses = self.get('/api/v1/expense/', limit=5, order_by='date')
+        self.assertEqual(dashboard['objects'], expenses['objects'])
+        self.assertEqual(dashboard['meta'], expenses['meta'])
+        self.assertEqual(dashboard['weekly_totals'], self.weeks('2013-05-06', '2013-11-25', '2014-01-13'))
+
+        # Also when the expense list can't take its lean path
+        resource = v1_api.canonical_resource_for('dashboard').expenses
+        resource.lean_list = False
+        try:
+            self.assertEqual(self.get(self.base_url, limit=5, order_by='date'), dashboard)
+        finally:
+            del resource.lean_list
+
+    def test_get_list_search(self):
+        # The matches aren't in date order, and only the weeks of the page's two are read
+        dashboard = self.get(self.base_url, q='expense', limit=2)
+        expenses = self.get('/api/v1/expense/', q='expense', limit=2)
+        self.assertEqual(dashboard['objects'], expenses['objects'])
+        dates = [timezone.localtime(Expense.objects.get(pk=obj['id']).date).date() for obj in expenses['objects']]
+        self.assertEqual(dashboard['weekly_totals'], self.weeks(*[
+            (date - datetime.timedelta(days=date.weekday())).isoformat() for date in dates]))
+        self.assertLessEqual(len(dashboard['weekly_totals']), 2)
+
+    def test_get_list_empty(self):
+        dashboard = self.get(self.base_url, date__range='2015-01-01,2015-01-31')
+        self.assertEqual(dashboard['objects'], [])
+        self.assertEqual(dashboard['weekly_totals'], [])
+
+    def test_get_list_filtered(self):
+        # 2014-07-01 is a Tuesday, so the week starting on the Monday before overlaps the range
+        dashboard = self.get(self.base_url, date__range='2014-07-01,2014-07-31', fields='description')
+        expenses = self.get('/api/v1/expense/', date__range='2014-07-01,2014-07-31', fields='description')
+        self.assertEqual(dashboard['objects'], expenses['objects'])
+        self.assertEqual(dashboard['meta'], expenses['meta'])
+        self.assertEqual(dashboard['weekly_totals'], self.get('/api/v1/weeklytotal/', limit=0,
+                                                              start_date__range='2014-06-25,2014-07-31')['objects'])
+        self.assertEqual(dashboard['weekly_totals'][0]['start_date'], '2014-06-30')
+
+    def test_get_list_invalid_range(self):
+        self.assertHttpBadRequest(self.api_client.get(self.base_url, format='json', data={'date__range': '2014-07-01'},
+                                                      authentication=self.get_credentials()))
+
+    def test_get_list_not_modified(self):
+        resp = self.api_client.get(self.base_url, format='json', authentication=self.get_credentials())
+        with self.assertNumQueries(1):
+            resp = self.api_client.get(self.base_url, format='json', authentication=self.get_credentials(),
+                                       HTTP_IF_NONE_MATCH=resp['ETag'])
+        self.assertEqual(resp.status_code, 304)
+
+    def test_get_list_query_budget(self):
+        # The version, the expense page, the totals (the date rollup and the first and last dates)
+        # and the weeks, however many expenses and weeks are listed. The API key is cached by the
+        # first request.
+        credentials = self.get_credentials()
+        self.api_client.get(self.base_url, format='json', authentication=credentials)
+        for extra in (0, 500):
+            create_expenses_bulk(self.user, extra)
+            with self.assertQueryBudget(6):
+                resp = self.api_client.get(self.base_url, format='json', data={'limit': 0}, authentication=credentials)
+            self.assertEqual(len(self.deserialize(resp)['objects']), self.user.expense_set.count())
@@ -0,0 +1,130 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals, print_function, division
+import os
+import shutil
+import tempfile
+import unittest
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connection, connections, transaction
+from django.db.models.signals import pre_save
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import override_settings
+from tastypie.test import TestApiClient
+from expense.database import retry_locked_writes, sqlite_pragmas
+from expense.models import Expense
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'The pragmas are only set on SQLite')
+class SqlitePragmaTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        # A second connection to a database file, as the test database is in memory
+        default = connections[DEFAULT_DB_ALIAS]
+        self.connection = type(default)(dict(default.settings_dict,
+                                             NAME=os.path.join(self.directory, 'pragmas.sqlite3')), 'pragmas')
+
+    def tearDown(self):
+        self.connection.close()
+        shutil.rmtree(self.directory)
+
+    def pragma(self, name):
+        cursor = self.connection.cursor()
+        cursor.execute('PRAGMA {0}'.format(name))
+        return cursor.fetchone()[0]
+
+    def test_pragmas(self):
+        self.assertEqual(self.pragma('journal_mode'), 'wal')
+        self.assertEqual(self.pragma('synchronous'), 1)  # NORMAL
+        self.assertEqual(self.pragma('busy_timeout'), 5000)
+        self.assertEqual(self.pragma('cache_size'), -64000)
+
+    @override_settings(SQLITE_PRAGMAS={'journal_mode': 'DELETE', 'cache_size': 500})
+    def test_configured_pragmas(self):
+        self.assertEqual(self.pragma('journal_mode'), 'delete')
+        self.assertEqual(self.pragma('cache_size'), 500)
+
+    def test_invalid_pragmas(self):
+        for pragmas in ({'journal_mode': 'WAL; DROP TABLE expense_expense'}, {'cache size': 1}):
+            with self.settings(SQLITE_PRAGMAS=pragmas):
+                self.assertRaises(ImproperlyConfigured, sqlite_pragmas)
+
+
+# Transaction test cases, as writes inside the transaction of a TestCase aren't retried
+@override_settings(DATABASE_WRITE_ATTEMPTS=3, DATABASE_WRITE_RETRY_DELAY=0)
+class RetryLockedWritesTest(TransactionTestCase):
+
+    def failing(self, failures, error='database is locked'):
+        """
+        A function which raises an OperationalError the first few times it is called.
+        """
+        calls = []
+
+        @retry_locked_writes
+        def write():
+            calls.append(None)
+            if len(calls) <= failures:
+                raise OperationalError(error)
+            return len(calls)
+        return write, calls
+
+    def test_retried(self):
+        write, calls = self.failing(2)
+        self.assertEqual(write(), 3)
+
+    def test_gives_up(self):
+        write, calls = self.failing(3)
+        self.assertRaises(OperationalError, write)
+        self.assertEqual(len(calls), 3)
+
+    def test_other_errors(self):
+        write, calls = self.failing(1, 'no such table: expense_expense')
+        self.assertRaises(OperationalError, write)
+        self.assertEqual(len(calls), 1)
+
+    def test_outer_transaction(self):
+        # Only the whole transaction could be tried again
+        write, calls = self.failing(1)
+        with transaction.atomic():
+            self.assertRaises(OperationalError, write)
+        self.assertEqual(len(calls), 1)
+
+
+@override_settings(DATABASE_WRITE_ATTEMPTS=3, DATABASE_WRITE_RETRY_DELAY=0)
+class ExpenseWriteRetryTest(TransactionTestCase):
+    fixtures = ['user.json', 'expenses.json']
+
+    def setUp(self):
+        super(ExpenseWriteRetryTest, self).setUp()
+        self.api_client = TestApiClient()
+        self.user = User.objects.get(username='devinb')
+        self.locks = 1
+        pre_save.connect(self.lock_once, sender=Expense)
+
+    def tearDown(self):
+        pre_save.disconnect(self.lock_once, sender=Expense)
+        super(ExpenseWriteRetryTest, self).tearDown()
+
+    def get_credentials(self):
+        return 'ApiKey {0}:{1}'.format(self.user.username, self.user.api_key.key)
+
+    def lock_once(self, sender, instance, **kwargs):
+        # Fail as SQLite does when another connection holds the lock past the busy timeout
+        if self.locks:
+            self.locks -= 1
+            raise OperationalError('database is locked')
+
+    def test_create(self):
+        count = Expense.objects.count()
+        resp = self.api_client.post('/api/v1/expense/', format='json', authentication=self.get_credentials(),
+                                    data={'description': 'Retried', 'amount': '1.50', 'date': '2014-08-01T10:00:00'})
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(Expense.objects.count(), count + 1)
+        self.assertEqual(self.locks, 0)
+
+    def test_update(self):
+        resp = self.api_client.put('/api/v1/expense/3/', format='json', authentication=self.get_credentials(),
+                                    data={'description': 'Retried', 'amount': '1.50', 'date': '2014-08-01T10:00:00'})
+        self.assertEqual(resp.status_code, 204)
+        self.assertEqual(Expense.objects.get(pk=3).description, 'Retried')
@@ -0,0 +1,222 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals, print_function, division
+import datetime
+import random
+from collections import defaultdict
+from decimal import Decimal
+from pytz import timezone
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.utils import six
+from tastypie.test import ResourceTestCase
+from expense.aggregation import bucket_start, rollup_spans, rollup_totals
+from expense.caching import response_cache
+from expense.importer import import_expenses
+from expense.models import DateRollup, Expense, expense_local_date
+
+AUCKLAND = timezone('Pacific/Auckland')
+
+
+def random_date(rand):
+    """
+    A random time between 2012 and 2015 in Auckland, on the hour now and then so some
+    expenses fall exactly at midnight.
+    """
+    date = datetime.datetime(2012, 1, 1) + datetime.timedelta(minutes=rand.randint(0, 3 * 365 * 24 * 60))
+    if rand.random() < 0.2:
+        date = date.replace(hour=0, minute=0)
+    return AUCKLAND.localize(date)
+
+
+def random_day(rand):
+    return datetime.date(2011, 12, 1) + datetime.timedelta(days=rand.randint(0, 3 * 365 + 60))
+
+
+def brute_force_rollup(user):
+    """
+    Count and total the user's expenses per day, month and year in Python.
+    """
+    rollup = defaultdict(lambda: [0, Decimal('0')])
+    for expense in Expense.objects.filter(user=user):
+        date = expense_local_date(expense.date)
+        for bucket in ('day', 'month', 'year'):
+            rollup[(bucket, bucket_start(date, bucket))][0] += 1
+            rollup[(bucket, bucket_start(date, bucket))][1] += expense.amount
+    return dict((key, tuple(value)) for key, value in rollup.items())
+
+
+class RollupSpansTest(TestCase):
+
+    def test_spans(self):
+        self.assertEqual(rollup_spans(datetime.date(2013, 11, 20), datetime.date(2015, 2, 3)), [
+            ('day', datetime.date(2013, 11, 20), datetime.date(2013, 12, 1)),
+            ('month', datetime.date(2013, 12, 1), datetime.date(2014, 1, 1)),
+            ('year', datetime.date(2014, 1, 1), datetime.date(2015, 1, 1)),
+            ('month', datetime.date(2015, 1, 1), datetime.date(2015, 2, 1)),
+            ('day', datetime.date(2015, 2, 1), datetime.date(2015, 2, 3)),
+        ])
+        self.assertEqual(rollup_spans(datetime.date(2014, 7, 1), datetime.date(2014, 8, 1)),
+                         [('month', datetime.date(2014, 7, 1), datetime.date(2014, 8, 1))])
+        self.assertEqual(rollup_spans(datetime.date(2014, 7, 1), datetime.date(2014, 7, 31)),
+                         [('day', datetime.date(2014, 7, 1), datetime.date(2014, 7, 31))])
+        self.assertEqual(rollup_spans(datetime.date(2014, 7, 1), datetime.date(2014, 7, 1)), [])
+
+    def test_random_spans(self):
+        # The spans are whole buckets which cover the range exactly, with fewer than two
+        # months or years of smaller buckets at each end
+        rand = random.Random(0)
+        for _ in range(500):
+            start, end = sorted([random_day(rand), random_day(rand)])
+            spans = rollup_spans(start, end)
+            position = start
+            for bucket, first, stop in spans:
+                self.assertEqual(first, position)
+                self.assertEqual(bucket_start(first, bucket), first)
+                self.assertEqual(bucket_start(stop, bucket), stop)
+                self.assertLess(first, stop)
+                position = stop
+            self.assertEqual(position, end)
+            self.assertLessEqual(len(spans), 5)
+
+
+class DateRollupTest(TestCase):
+    fixtures = ['user.json', 'expenses.json']
+
+    def setUp(self):
+        self.user = User.objects.get(username='devinb')
+
+    def rollup(self):
+        return dict(((r.bucket, r.start_date), (r.count, r.total)) for r in DateRollup.objects.filter(user=self.user))
+
+    def assertRollupMatchesExpenses(self):
+        self.assertEqual(self.rollup(), brute_force_rollup(self.user))
+
+    def assertRangeTotalsMatchExpenses(self, rand, ranges=50):
+        expenses = [(expense_local_date(expense.date), expense.amount) for expense in self.user.expense_set.all()]
+        for _ in range(ranges):
+            start, end = sorted([random_day(rand), random_day(rand)])
+            amounts = [amount for date, amount in expenses if start <= date < end]
+            self.assertEqual(rollup_totals(self.user, rollup_spans(start, end)), (len(amounts), sum(amounts)))
+
+    def test_fixtures(self):
+        self.assertRollupMatchesExpenses()
+
+    def test_random_changes(self):
+        # Create, update (moving between days, months, years and users) and delete expenses
+        # at random, checking the rollup and range totals against the expenses as they go
+        rand = random.Random(1)
+        other = User.objects.get(username='carlr')
+        for step in range(150):
+            expenses = list(Expense.objects.all())
+            action = rand.random()
+            if action < 0.5 or not expenses:
+                Expense.objects.create(user=self.user, date=random_date(rand), description='Random',
+                                       amount=Decimal(rand.randint(1, 99999)).scaleb(-2), comment='')
+            elif action < 0.85:
+                expense = rand.choice(expenses)
+                if rand.random() < 0.7:
+                    expense.date = random_date(rand)
+                if rand.random() < 0.5:
+                    expense.amount = Decimal(rand.randint(1, 99999)).scaleb(-2)
+                if rand.random() < 0.1:
+                    expense.user = other if expense.user_id == self.user.pk else self.user
+                expense.save()
+            else:
+                rand.choice(expenses).delete()
+            if step % 25 == 0:
+                self.assertRollupMatchesExpenses()
+                self.assertRangeTotalsMatchExpenses(rand, ranges=10)
+        self.assertRollupMatchesExpenses()
+        self.assertEqual(DateRollup.objects.filter(user=other).count(), len(brute_force_rollup(other)))
+        self.assertRangeTotalsMatchExpenses(rand)
+
+    def test_import(self):
+        rand = random.Random(2)
+        rows = [{'date': random_date(rand).isoformat(), 'description': 'Imported',
+                 'amount': '{0}.{1:02d}'.format(rand.randint(0, 999), rand.randint(0, 99))} for _ in range(200)]
+        self.assertEqual(import_expenses(self.user, rows, batch_size=50)['created'], 200)
+        self.assertRollupMatchesExpenses()
+
+    def test_rebuild_command(self):
+        # Changes made with update() skip the save signals, so the rollup drifts
+        Expense.objects.filter(pk=1).update(amount=Decimal('1.00'))
+        DateRollup.objects.filter(user=self.user, bucket='month').delete()
+        self.assertRaises(CommandError, call_command, 'date_rollup', verify=True, stdout=six.StringIO())
+
+        call_command('date_rollup', stdout=six.StringIO())
+        self.assertRollupMatchesExpenses()
+        call_command('date_rollup', verify=True, stdout=six.StringIO())
+
+    def test_verify_command_queries(self):
+        # The bounds, the days of every user and the rollups, however many users have expenses
+        other = User.objects.get(username='carlr')
+        Expense.objects.create(user=other, date=AUCKLAND.localize(datetime.datetime(2013, 3, 31, 23, 30)),
+                               description='Other', amount=Decimal('2.50'), comment='')
+        with self.assertNumQueries(3):
+            call_command('date_rollup', verify=True, stdout=six.StringIO())
+
+
+class ExpenseListRangeTotalsTest(ResourceTestCase):
+    fixtures = ['user.json', 'expenses.json']
+
+    def setUp(self):
+        super(ExpenseListRangeTotalsTest, self).setUp()
+        response_cache().clear()
+        self.username = 'devinb'
+        self.user = User.objects.get(username=self.username)
+
+        rand = random.Random(3)
+        for _ in range(100):
+            Expense.objects.create(user=self.user, date=random_date(rand), description='Random',
+                                   amount=Decimal(rand.randint(1, 99999)).scaleb(-2), comment='')
+
+    def get_meta(self, **params):
+        resp = self.api_client.get('/api/v1/expense/', format='json', data=dict({'limit': 1}, **params),
+                                   authentication=self.create_apikey(username=self.username,
+                                                                     api_key=self.user.api_key.key))
+        self.assertValidJSONResponse(resp)
+        meta = self.deserialize(resp)['meta']
+        return (meta['total_count'], Decimal(meta['total_amount']), meta['first_date'], meta['last_date'])
+
+    def brute_force_meta(self, start=None, end=None):
+        # date__range includes both midnights
+        start = start and AUCKLAND.localize(datetime.datetime.combine(start, datetime.time()))
+        end = end and AUCKLAND.localize(datetime.datetime.combine(end, datetime.time()))
+        expenses = [expense for expense in self.user.expense_set.all()
+                    if (start is None or expense.date >= start) and (end is None or expense.date <= end)]
+        # The dates are serialized in local time
+        dates = sorted(expense.date.astimezone(AUCKLAND).strftime('%Y-%m-%dT%H:%M:%S') for expense in expenses)
+        return (len(expenses), sum((expense.amount for expense in expenses), Decimal('0')),
+                dates[0] if dates else None, dates[-1] if dates else None)
+
+    def assertMetaMatchesExpenses(self, start=None, end=None):
+        params = {'date__range': '{0},{1}'.format(start, end)} if start else {}
+        total_count, total_amount, first_date, last_date = self.get_meta(**params)
+        self.assertEqual((total_count, total_amount, first_date and first_date[:19], last_date and last_date[:19]),
+                         self.brute_force_meta(start, end), params)
+
+    def test_unfiltered(self):
+        self.assertMetaMatchesExpenses()
+
+    def test_random_ranges(self):
+        rand = random.Random(4)
+        for _ in range(40):
+            start, end = sorted([random_day(rand), random_day(rand)])
+            self.assertMetaMatchesExpenses(start, end)
+
+    def test_range_ending_at_midnight(self):
+        # An expense at the very midnight a range ends on is in the range
+        start, end = datetime.date(2013, 6, 1), datetime.date(2014, 3, 1)
+        Expense.objects.create(user=self.user, date=AUCKLAND.localize(datetime.datetime(2014, 3, 1)),
+                               description='Midnight', amount=Decimal('3.21'), comment='')
+        Expense.objects.create(user=self.user, date=AUCKLAND.localize(datetime.datetime(2014, 3, 1, 0, 1)),
+                               description='Past midnight', amount=Decimal('1.23'), comment='')
+        self.assertMetaMatchesExpenses(start, end)
+        self.assertEqual(self.get_meta(date__range='2014-03-01,2014-03-01')[0], 1)
+
+    def test_empty_range(self):
+        self.assertEqual(self.get_meta(date__range='2009-01-01,2010-06-01')[:3], (0, Decimal('0'), None))
+        # The wrong way round
+        self.assertEqual(self.get_meta(date__range='2015-01-01,2012-01-01')[:3], (0, Decimal('0'), None))
@@ -1,13 +1,28 @@
 # coding=utf-8
 from __future__ import absolute_import, unicode_literals, print_function, division
+import copy
 import datetime
+import json
+import os
+import tempfile
+from decimal import Decimal
 from pytz import timezone
 from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import six
 from tastypie.test import ResourceTestCase
-from expense.models import Expense
+from expense.aggregation import weekly_totals
+from expense.authentication import api_key_cache
+from expense.factories import create_expenses_bulk
+from expense.importer import import_expenses
+from expense.models import Expense, WeeklyRollup
+from expense.tests.query_budget import QueryBudgetMixin
+from expense_tracker.urls import v1_api
 
 
-class ExpenseResourceTest(ResourceTestCase):
+class ExpenseResourceTest(QueryBudgetMixin, ResourceTestCase):
     # We need user and expenses fixtures during this test
     fixtures = ['user.json', 'expenses.json']
 
@@ -24,6 +39,8 @@ class ExpenseResourceTest(ResourceTestCase):
 
         # We also build a detail URI, since we will be using it all over. DRY, baby. DRY.
         self.base_url = '/api/v1/expense/'
+        # The resource serving the API, whose options a test may change for itself alone
+        self.resource = v1_api.canonical_resource_for('expense')
         self.detail_url = self.base_url + '{0}/'.format(self.expense3.pk)
 
         # The data we'll send on POST requests. Again, because we'll use it frequently (enough).
@@ -47,6 +64,150 @@ class ExpenseResourceTest(ResourceTestCase):
     def test_get_list_unauthorized(self):
         self.assertHttpUnauthorized(self.api_client.get(self.base_url, format='json'))
 
+    def test_get_list_not_modified(self):
+        resp = self.api_client.get(self.base_url, format='json', authentication=self.get_credentials())
+        etag = resp['ETag']
+        self.assertTrue(resp.has_header('Last-Modified'))
+
+        # Only the version is read, not the expenses
+        with self.assertNumQueries(1):
+            resp = self.api_client.get(self.base_url, format='json', authentication=self.get_credentials(),
+                                       HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.content, b'')
+        resp = self.api_client.get(self.base_url, format='json', authentication=self.get_credentials(),
+                                   HTTP_IF_MODIFIED_SINCE=resp['Last-Modified'])
+        self.assertEqual(resp.status_code, 304)
+
+        # Other pages and filters have their own tags
+        resp = self.api_client.get(self.base_url, format='json', data={'limit': 2},
+                                   authentication=self.get_credentials(), HTTP_IF_NONE_MATCH=etag)
+        self.assertHttpOK(resp)
+        self.assertNotEqual(resp['ETag'], etag)
+
+        # Any change to the expenses changes the tag
+        Expense.objects.create(user=self.user, description='New', amount=1, date=timezone('UTC').localize(
+            datetime.datetime(2014, 7, 1)))
+        resp = self.api_client.get(self.base_url, format='json', authentication=self.get_credentials(),
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertValidJSONResponse(resp)
+        self.assertNotEqual(resp['ETag'], etag)
+        self.assertEqual(self.deserialize(resp)['meta']['total_count'], Expense.objects.count())
+
+    def test_get_list_query_budget(self):
+        # Authentication (user and key), the version, the page and the totals (the count and
+        # total from the date rollup, and the first and last dates), however many expenses are listed
+        for extra in (0, 50):
+            create_expenses_bulk(self.user, extra)
+            for params in ({'limit': 0}, {'limit': 0, 'cursor': ''}):
+                api_key_cache().clear()
+                credentials = self.get_credentials()
+                with self.assertQueryBudget(7):
+                    resp = self.api_client.get(self.base_url, format='json', data=params, authentication=credentials)
+                self.assertEqual(len(self.deserialize(resp)['objects']), Expense.objects.filter(user=self.user).count())
+
+    def test_get_detail_query_budget(self):
+        api_key_cache().clear()
+        credentials = self.get_credentials()
+        # Authentication (user and key) and the expense
+        with self.assertQueryBudget(3):
+            self.assertValidJSONResponse(self.api_client.get(self.detail_url, format='json',
+                                                             authentication=credentials))
+
+    def test_get_list_lean(self):
+        Expense.objects.create(user=self.user, description='Caf\xe9 \u2615 "quoted"', comment='Line\nbreak\\',
+                               amount=Decimal('0.5'),
+                               date=timezone('UTC').localize(datetime.datetime(2014, 7, 2, 1, 2, 3, 456)))
+        for params in ({}, {'limit': 0}, {'limit': 5, 'offset': 3}, {'limit': 4, 'cursor': ''},
+                       {'limit': 4, 'cursor': '', 'order_by': '-date'}, {'date__range': '2014-07-01,2014-07-31'},
+                       {'order_by': '-date', 'limit': 4, 'offset': 4}):
+            lean = self.api_client.get(self.base_url, format='json', data=params, authentication=self.get_credentials())
+            self.resource.lean_list = False
+            try:
+                full = self.api_client.get(self.base_url, format='json', data=params,
+                                           authentication=self.get_credentials())
+            finally:
+                del self.resource.lean_list
+            self.assertValidJSONResponse(lean)
+            self.assertEqual(lean['Content-Type'], full['Content-Type'])
+            self.assertEqual(lean.content, full.content)
+
+    def test_get_list_lean_falls_back(self):
+        # Fields the values() rows can't stand in for take the full path, which gives the same object
+        def use_in_detail(resource):
+            resource.fields['comment'].use_in = 'detail'
+
+        def default_for_none(resource):
+            resource.fields['comment'].null = True
+            resource.fields['comment']._default = 'No comment'
+
+        def dehydrate_description(resource):
+            resource.dehydrate_description = lambda bundle: bundle.data['description'].upper()
+
+        params = {'limit': 1, 'order_by': 'date'}
+        fields = self.resource.fields
+        for change in (use_in_detail, default_for_none, dehydrate_description):
+            self.resource.fields = dict((name, copy.copy(field)) for name, field in fields.items())
+            change(self.resource)
+            try:
+                self.assertIsNone(self.resource.lean_list_converters())
+                lean = self.api_client.get(self.base_url, format='json', data=params,
+                                           authentication=self.get_credentials())
+                self.resource.lean_list = False
+                full = self.api_client.get(self.base_url, format='json', data=params,
+                                           authentication=self.get_credentials())
+            finally:
+                self.resource.fields = fields
+                for name in ('lean_list', 'dehydrate_description'):
+                    if name in vars(self.resource):
+                        delattr(self.resource, name)
+            self.assertValidJSONResponse(lean)
+            self.assertEqual(lean.content, full.content)
+        self.assertIsNotNone(self.resource.lean_list_converters())
+
+    def test_get_list_fields(self):
+        params = {'fields': 'date,description,amount', 'limit': 4, 'cursor': ''}
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.api_client.get(self.base_url, format='json', data=params,
+                                       authentication=self.get_credentials())
+        self.assertValidJSONResponse(resp)
+        for obj in self.deserialize(resp)['objects']:
+            self.assertEqual(sorted(obj), ['amount', 'date', 'description', 'resource_uri'])
+        # The comment isn't read from the database
+        self.assertFalse(any('"comment"' in query['sql'] for query in queries.captured_queries))
+
+        # The full list path gives the same response
+        self.resource.lean_list = False
+        try:
+            full = self.api_client.get(self.base_url, format='json', data=params, authentication=self.get_credentials())
+        finally:
+            del self.resource.lean_list
+        self.assertEqual(resp.content, full.content)
+
+    def test_get_list_fields_uri_only(self):
+        params = {'fields': 'resource_uri', 'limit': 4, 'order_by': 'date'}
+        resp = self.api_client.get(self.base_url, format='json', data=params, authentication=self.get_credentials())
+        self.assertValidJSONResponse(resp)
+        for obj in self.deserialize(resp)['objects']:
+            self.assertEqual(sorted(obj), ['resource_uri'])
+        self.resource.lean_list = False
+        try:
+            full = self.api_client.get(self.base_url, format='json', data=params, authentication=self.get_credentials())
+        finally:
+            del self.resource.lean_list
+        self.assertEqual(resp.content, full.content)
+
+        # The sync still takes the lean path
+        with CaptureQueriesContext(connection) as queries:
+            changes = self.get_sync(fields='resource_uri')
+        self.assertEqual([sorted(expense) for expense in changes['saved']], [['resource_uri']] * 17)
+        self.assertFalse(any('"description"' in query['sql'] for query in queries.captured_queries))
+
+    def test_get_list_fields_invalid(self):
+        resp = self.api_client.get(self.base_url, format='json', data={'fields': 'date,colour'},
+                                   authentication=self.get_credentials())
+        self.assertHttpBadRequest(resp)
+
     def test_get_list_json(self):
         resp = self.api_client.get(self.base_url, format='json', authentication=self.get_credentials())
         self.assertValidJSONResponse(resp)
@@ -70,6 +231,168 @@ class ExpenseResourceTest(ResourceTestCase):
             'resource_uri': '/api/v1/expense/{0}/'.format(self.expense1.pk)
         })
 
+    def test_get_list_meta_totals(self):
+        # The totals should cover every expense, not just those on the first page
+        resp = self.api_client.get(self.base_url, format='json', data={'limit': 2},
+                                   authentication=self.get_credentials())
+        self.assertValidJSONResponse(resp)
+        meta = self.deserialize(resp)['meta']
+
+        expenses = Expense.objects.filter(user=self.user)
+        total_amount = sum(expense.amount for expense in expenses)
+        self.assertEqual(Decimal(meta['total_amount']), total_amount)
+        self.assertEqual(Decimal(meta['average']), total_amount / expenses.count())
+        self.assertEqual(meta['total_count'], expenses.count())
+
+    def test_get_list_meta_totals_filtered(self):
+        # Only the expenses within the date range should be totalled
+        resp = self.api_client.get(self.base_url, format='json', data={'date__range': '2014-07-01,2014-07-31'},
+                                   authentication=self.get_credentials())
+        self.assertValidJSONResponse(resp)
+        meta = self.deserialize(resp)['meta']
+
+        expenses = Expense.objects.filter(user=self.user, date__range=('2014-07-01', '2014-07-31'))
+        self.assertEqual(Decimal(meta['total_amount']), sum(expense.amount for expense in expenses))
+        self.assertEqual(meta['first_date'][:10], '2014-07-01')
+        self.assertEqual(meta['last_date'][:10], '2014-07-23')
+
+    def test_get_list_cursor(self):
+        # Walk through every page using the cursor in each next link
+        expected = list(Expense.objects.filter(user=self.user).order_by('date', 'id').values_list('id', flat=True))
+        seen = []
+        url, data = self.base_url, {'cursor': '', 'limit': 5}
+        while url:
+            resp = self.api_client.get(url, format='json', data=data, authentication=self.get_credentials())
+            self.assertValidJSONResponse(resp)
+            page = self.deserialize(resp)
+            self.assertEqual(page['meta']['total_count'], len(expected))
+            seen.extend(obj['id'] for obj in page['objects'])
+            url, data = page['meta']['next'], {}
+        self.assertEqual(seen, expected)
+
+    def test_get_list_cursor_descending(self):
+        expected = list(Expense.objects.filter(user=self.user).order_by('-date', '-id').values_list('id', flat=True))
+        resp = self.api_client.get(self.base_url, format='json', data={'cursor': '', 'limit': 5, 'order_by': '-date'},
+                                   authentication=self.get_credentials())
+        page = self.deserialize(resp)
+        self.assertEqual([obj['id'] for obj in page['objects']], expected[:5])
+        resp = self.api_client.get(page['meta']['next'], format='json', authentication=self.get_credentials())
+        self.assertEqual([obj['id'] for obj in self.deserialize(resp)['objects']], expected[5:10])
+
+    def test_get_list_cursor_without_count(self):
+        resp = self.api_client.get(self.base_url, format='json', data={'cursor': '', 'count': 'false'},
+                                   authentication=self.get_credentials())
+        self.assertValidJSONResponse(resp)
+        self.assertNotIn('total_count', self.deserialize(resp)['meta'])
+
+    def test_get_list_invalid_cursor(self):
+        self.assertHttpBadRequest(self.api_client.get(self.base_url, format='json', data={'cursor': 'nonsense'},
+                                                      authentication=self.get_credentials()))
+
+    def get_export(self, **data):
+        resp = self.api_client.get(self.base_url + 'export/', data=data, authentication=self.get_credentials())
+        self.assertHttpOK(resp)
+        return b''.join(resp.streaming_content).decode('utf-8')
+
+    def test_export_unauthenticated(self):
+        self.assertHttpUnauthorized(self.api_client.get(self.base_url + 'export/'))
+
+    def test_export_csv(self):
+        # Export in small chunks, so that several queries are needed
+        self.resource.export_chunk_size = 4
+        try:
+            lines = self.get_export().splitlines()
+        finally:
+            del self.resource.export_chunk_size
+
+        expenses = Expense.objects.filter(user=self.user).order_by('date', 'id')
+        self.assertEqual(lines[0], 'id,date,description,amount,comment')
+        self.assertEqual(len(lines), expenses.count() + 1)
+        self.assertEqual([int(line.split(',')[0]) for line in lines[1:]], [expense.pk for expense in expenses])
+        self.assertEqual(lines[1], '15,2013-05-12T03:03:00+12:00,expense 2,26.56,More boring expenses')
+
+    def test_export_ndjson(self):
+        lines = self.get_export(format='ndjson', date__range='2014-07-01,2014-07-31').splitlines()
+        expenses = Expense.objects.filter(user=self.user, date__range=('2014-07-01', '2014-07-31'))
+        self.assertEqual(len(lines), expenses.count())
+        self.assertEqual(json.loads(lines[0]), {
+            'id': 10,
+            'date': '2014-07-01T12:12:00+12:00',
+            'description': 'Maths',
+            'amount': '-345.57',
+            'comment': 'I can has sums',
+        })
+
+    def test_export_invalid_format(self):
+        self.assertHttpBadRequest(self.api_client.get(self.base_url + 'export/', data={'format': 'xls'},
+                                                      authentication=self.get_credentials()))
+
+    def get_sync(self, **params):
+        resp = self.api_client.get(self.base_url + 'sync/', format='json', data=params,
+                                   authentication=self.get_credentials())
+        self.assertValidJSONResponse(resp)
+        return self.deserialize(resp)
+
+    def test_sync_unauthenticated(self):
+        self.assertHttpUnauthorized(self.api_client.get(self.base_url + 'sync/'))
+
+    def test_sync(self):
+        # The first sync returns every expense
+        changes = self.get_sync()
+        expenses = Expense.objects.filter(user=self.user)
+        self.assertEqual(sorted(expense['id'] for expense in changes['saved']), sorted(e.pk for e in expenses))
+        self.assertEqual(changes['deleted'], [])
+        self.assertFalse(changes['more'])
+        full = self.deserialize(self.api_client.get(self.base_url, format='json', data={'limit': 0},
+                                                    authentication=self.get_credentials()))['objects']
+        self.assertEqual(sorted(changes['saved'], key=lambda expense: expense['id']),
+                         sorted(full, key=lambda expense: expense['id']))
+
+        # Then only the changes since the previous sync
+        token = changes['token']
+        self.assertEqual(self.get_sync(since=token), {'saved': [], 'deleted': [], 'token': token, 'more': False})
+        resp = self.api_client.post(self.base_url, format='json', data=self.post_data,
+                                    authentication=self.get_credentials())
+        created = int(resp['Location'].rstrip('/').rsplit('/', 1)[-1])
+        self.expense3.description = 'Changed'
+        self.expense3.save()
+        self.expense1.delete()
+
+        changes = self.get_sync(since=token)
+        self.assertEqual([(expense['id'], expense['description']) for expense in changes['saved']],
+                         [(created, self.post_data['description']), (self.expense3.pk, 'Changed')])
+        self.assertEqual(changes['deleted'], [1])
+        self.assertEqual(self.get_sync(since=changes['token'])['saved'], [])
+
+        # An expense given to another user is deleted from the previous owner's copy
+        self.expense3.user = User.objects.create_user('other', 'other@example.com', 'password')
+        self.expense3.save()
+        changes = self.get_sync(since=changes['token'])
+        self.assertEqual((changes['saved'], changes['deleted']), ([], [self.expense3.pk]))
+
+    def test_sync_pages(self):
+        token = self.get_sync()['token']
+        import_expenses(self.user, [{'date': '2014-08-0{0}'.format(day), 'description': 'Imported', 'amount': day}
+                                    for day in range(1, 8)])
+        self.expense3.save()
+
+        # The imported expenses share one revision, which the pages have to split
+        seen = []
+        changes = {'token': token, 'more': True}
+        while changes['more']:
+            changes = self.get_sync(since=changes['token'], limit=3, fields='description')
+            self.assertLessEqual(len(changes['saved']), 3)
+            for expense in changes['saved']:
+                self.assertEqual(sorted(expense), ['description', 'resource_uri'])
+            seen.extend(int(expense['resource_uri'].rstrip('/').rsplit('/', 1)[-1]) for expense in changes['saved'])
+        imported = Expense.objects.filter(description='Imported').order_by('id').values_list('id', flat=True)
+        self.assertEqual(seen, list(imported) + [self.expense3.pk])
+
+    def test_sync_invalid(self):
+        for params in ({'since': 'abc'}, {'since': '1.x'}, {'limit': 0}):
+            self.assertHttpBadRequest(self.api_client.get(self.base_url + 'sync/', data=params,
+                                                          authentication=self.get_credentials()))
+
     def test_get_detail_unauthenticated(self):
         self.assertHttpUnauthorized(self.api_client.get(self.detail_url, format='json'))
 
@@ -93,6 +416,79 @@ class ExpenseResourceTest(ResourceTestCase):
         # Verify a new one has been added.
         self.assertEqual(Expense.objects.count(), object_count + 1)
 
+    def assertRollupMatchesExpenses(self):
+        expected = [(t.year, t.week_number, t.count, t.total)
+                    for t in weekly_totals(Expense.objects.filter(user=self.user))]
+        self.assertEqual([(r.year, r.week_number, r.count, r.total)
+                          for r in WeeklyRollup.objects.filter(user=self.user).order_by('year', 'week_number')],
+                         expected)
+
+    def test_bulk_import_unauthenticated(self):
+        self.assertHttpUnauthorized(self.api_client.post(self.base_url + 'bulk/', format='json', data=[]))
+
+    def test_bulk_import_json(self):
+        object_count = Expense.objects.count()
+        data = [
+            {'date': '2012-05-01T22:05:12', 'description': 'First', 'amount': '10.50', 'comment': 'One'},
+            {'date': '2012-05-08', 'description': 'Second', 'amount': 7},
+            {'date': '2012-05-09T09:00:00Z', 'description': 'Rounded', 'amount': '-1.005'},
+            {'date': 'not a date', 'description': '', 'amount': 'lots'},
+            {'date': '2012-04-01T02:30:00', 'description': 'Ambiguous', 'amount': '1'},
+        ]
+        resp = self.api_client.post(self.base_url + 'bulk/?batch_size=1', format='json', data=data,
+                                    authentication=self.get_credentials())
+        self.assertHttpCreated(resp)
+        report = self.deserialize(resp)
+        self.assertEqual(report['created'], 3)
+        self.assertEqual(report['success'], False)
+        self.assertEqual(report['errors'][0]['row'], 4)
+        self.assertKeys(report['errors'][0]['errors'], ['amount', 'date', 'description'])
+        self.assertEqual(report['errors'][1]['row'], 5)
+        self.assertKeys(report['errors'][1]['errors'], ['date'])
+
+        self.assertEqual(Expense.objects.count(), object_count + 3)
+        self.assertEqual(Expense.objects.get(description='Rounded').amount, Decimal('-1.00'))
+        expense = Expense.objects.get(description='Second')
+        self.assertEqual(expense.user, self.user)
+        self.assertEqual(expense.amount, Decimal('7'))
+        self.assertEqual(expense.date, timezone('Pacific/Auckland').localize(datetime.datetime(2012, 5, 8)))
+        self.assertRollupMatchesExpenses()
+
+    def test_bulk_import_csv(self):
+        body = ('date,description,amount,comment\n'
+                '2012-05-01T22:05:12,From the bank,12.34,\n'
+                '2012-05-02T10:00:00+12:00,"Coffee, large",4.5,Flat white\n')
+        resp = self.client.post(self.base_url + 'bulk/', data=body, content_type='text/csv',
+                                HTTP_AUTHORIZATION=self.get_credentials())
+        self.assertHttpCreated(resp)
+        self.assertEqual(self.deserialize(resp), {'created': 2, 'errors': [], 'success': True})
+        self.assertEqual(Expense.objects.get(description='Coffee, large').comment, 'Flat white')
+        self.assertRollupMatchesExpenses()
+
+    def test_bulk_import_invalid(self):
+        object_count = Expense.objects.count()
+        self.assertHttpBadRequest(self.api_client.post(self.base_url + 'bulk/', format='json',
+                                                       data=[{'amount': '1e12'}],
+                                                       authentication=self.get_credentials()))
+        self.assertHttpBadRequest(self.api_client.post(self.base_url + 'bulk/', format='json',
+                                                       data={'description': 'Not a list'},
+                                                       authentication=self.get_credentials()))
+        self.assertEqual(Expense.objects.count(), object_count)
+
+    def test_import_command(self):
+        import_file = tempfile.NamedTemporaryFile(suffix='.json', delete=False)
+        try:
+            import_file.write(json.dumps([{'date': '2012-05-01', 'description': 'Imported', 'amount': '1.00'},
+                                          {'date': '2012-05-02'}]).encode('utf-8'))
+            import_file.close()
+            out = six.StringIO()
+            call_command('import_expenses', import_file.name, username=self.username, stdout=out)
+        finally:
+            os.remove(import_file.name)
+        self.assertIn('Imported 1 expenses, 1 rows had errors', out.getvalue())
+        self.assertTrue(Expense.objects.filter(user=self.user, description='Imported').exists())
+        self.assertRollupMatchesExpenses()
+
     def test_put_detail_unauthenticated(self):
         self.assertHttpUnauthorized(self.api_client.put(self.detail_url, format='json', data={}))
 
@@ -0,0 +1,68 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals, print_function, division
+import json
+import logging
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import override_settings
+from tastypie.test import ResourceTestCase
+
+
+class RecordingHandler(logging.Handler):
+
+    def __init__(self):
+        super(RecordingHandler, self).__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class ProfilingMiddlewareTest(ResourceTestCase):
+    fixtures = ['user.json', 'expenses.json']
+
+    def setUp(self):
+        super(ProfilingMiddlewareTest, self).setUp()
+        self.user = User.objects.get(username='devinb')
+        # Record the log lines in place of writing them to the console
+        self.logger = logging.getLogger('expense_tracker.profiling')
+        self.handlers = self.logger.handlers
+        self.handler = RecordingHandler()
+        self.logger.handlers = [self.handler]
+
+    def tearDown(self):
+        self.logger.handlers = self.handlers
+        super(ProfilingMiddlewareTest, self).tearDown()
+
+    def get(self):
+        return self.api_client.get('/api/v1/expense/', format='json', authentication=self.create_apikey(
+            username=self.user.username, api_key=self.user.api_key.key))
+
+    def test_not_profiled_by_default(self):
+        resp = self.get()
+        self.assertValidJSONResponse(resp)
+        self.assertFalse(resp.has_header('Server-Timing'))
+        self.assertEqual(self.handler.messages, [])
+
+    @override_settings(PROFILING_SAMPLE_RATE=1)
+    def test_profiled(self):
+        queries = len(connection.queries)
+        resp = self.get()
+        self.assertValidJSONResponse(resp)
+
+        timings = dict((timing.split(';')[0], timing) for timing in resp['Server-Timing'].split(', '))
+        self.assertKeys(timings, ['total', 'sql', 'dehydrate', 'alter_list', 'serialize'])
+        # The expense list dehydrates every row in one call
+        self.assertIn('desc="1 calls"', timings['dehydrate'])
+
+        self.assertEqual(len(self.handler.messages), 1)
+        line = json.loads(self.handler.messages[0])
+        self.assertEqual(line['path'], '/api/v1/expense/')
+        self.assertEqual(line['status'], 200)
+        self.assertTrue(line['queries'] > 0)
+        self.assertIn('desc="{0} queries"'.format(line['queries']), timings['sql'])
+        self.assertKeys(line['sections'], ['dehydrate', 'alter_list', 'serialize'])
+
+        # The recorded queries are dropped again when not debugging
+        self.assertEqual(len(connection.queries), queries)
+        self.assertFalse(connection.use_debug_cursor)
@@ -0,0 +1,158 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals, print_function, division
+import datetime
+import re
+import unittest
+from contextlib import contextmanager
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from tastypie.test import ResourceTestCase
+from expense.aggregation import local_midnight
+from expense.archive import archive_expenses
+from expense.models import Expense
+
+# Matches SQLite plan steps which read every row of one of the expense tables
+FULL_SCAN = re.compile(
+    r'^SCAN (TABLE )?(expense_expense|expense_archivedexpense|expense_weeklyrollup)\b(?! USING (COVERING )?INDEX)')
+# Matches SQLite plan steps which sort the rows rather than reading them in index order
+SORT = re.compile(r'^USE TEMP B-TREE FOR (RIGHT PART OF )?ORDER BY')
+
+
+@contextmanager
+def capture_statements():
+    """
+    Record the SQL and parameters of every statement run on the connection, so
+    they can be run again with EXPLAIN. connection.queries only keeps the SQL with
+    the parameters already interpolated, which the database can't run.
+    """
+    statements = []
+    last_executed_query = connection.ops.last_executed_query
+
+    def capture(cursor, sql, params):
+        statements.append((sql, params))
+        return last_executed_query(cursor, sql, params)
+
+    connection.ops.last_executed_query = capture
+    try:
+        with CaptureQueriesContext(connection):
+            yield statements
+    finally:
+        del connection.ops.last_executed_query
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'The query plans are checked on SQLite')
+class QueryPlanTest(ResourceTestCase):
+    fixtures = ['user.json', 'expenses.json']
+
+    def setUp(self):
+        super(QueryPlanTest, self).setUp()
+        self.user = User.objects.get(username='devinb')
+        self.expense = Expense.objects.get(pk=3)
+
+    def get_credentials(self):
+        return self.create_apikey(username=self.user.username, api_key=self.user.api_key.key)
+
+    def explain(self, statements):
+        """
+        Run EXPLAIN QUERY PLAN for every SELECT and UPDATE captured.
+        :return: A list of the SQL and the plan of each statement
+        """
+        cursor = connection.cursor()
+        plans = []
+        for sql, params in statements:
+            if sql.lstrip().split(' ', 1)[0].upper() in ('SELECT', 'UPDATE', 'DELETE'):
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                plans.append((sql, [row[-1] for row in cursor.fetchall()]))
+        return plans
+
+    def assertNoFullScans(self, statements, sorts=False):
+        """
+        Check that no statement reads every row of an expense table, or sorts unless sorts is True.
+        """
+        for sql, plan in self.explain(statements):
+            scans = [step for step in plan if FULL_SCAN.match(step) or (SORT.match(step) and not sorts)]
+            if scans:
+                self.fail('Full table scan ({0}) in query plan of:\n{1}\n{2}'.format(
+                    ', '.join(scans), sql, '\n'.join(plan)))
+
+    def assertIndexUsed(self, statements, step):
+        """
+        Check that the plan of at least one statement contains the step, e.g. an index search on some columns.
+        """
+        plans = self.explain(statements)
+        if not any(step in plan_step for sql, plan in plans for plan_step in plan):
+            self.fail('No query plan contains {0}:\n{1}'.format(step, '\n'.join(
+                '{0}\n  {1}'.format(sql, '\n  '.join(plan)) for sql, plan in plans)))
+
+    def test_expense_list(self):
+        with capture_statements() as statements:
+            self.api_client.get('/api/v1/expense/', format='json', authentication=self.get_credentials())
+        self.assertNoFullScans(statements)
+
+    def test_expense_list_date_range(self):
+        with capture_statements() as statements:
+            self.api_client.get('/api/v1/expense/', format='json', data={'date__range': '2014-07-01,2014-07-31'},
+                                authentication=self.get_credentials())
+        self.assertNoFullScans(statements)
+        self.assertIndexUsed(statements, '(user_id=? AND date>? AND date<?)')
+
+    def test_expense_list_cursor(self):
+        cursor = 'MjAxNC0wNi0zMFQwMToxMzowMCswMDowMHwx'  # After expense 1
+        with capture_statements() as statements:
+            self.api_client.get('/api/v1/expense/', format='json', data={'cursor': cursor, 'order_by': '-date'},
+                                authentication=self.get_credentials())
+        self.assertNoFullScans(statements)
+        self.assertIndexUsed(statements, '(user_id=? AND date<?)')
+
+    def test_expense_search(self):
+        # The matches come from the search index and are sorted by rank, while the
+        # expenses are looked up by id
+        with capture_statements() as statements:
+            self.api_client.get('/api/v1/expense/', format='json',
+                                data={'q': 'car', 'date__range': '2014-07-01,2014-07-31'},
+                                authentication=self.get_credentials())
+        self.assertNoFullScans(statements, sorts=True)
+        self.assertIndexUsed(statements, 'expense_expense_search VIRTUAL TABLE INDEX')
+
+    def test_expense_list_archived(self):
+        # Both tables are read in date order from their indexes and merged
+        archive_expenses(local_midnight(datetime.date(2014, 1, 1)))
+        for params in ({'date__range': '2013-11-01,2014-01-31', 'order_by': '-date'},
+                       {'cursor': '', 'date__range': '2013-11-01,2014-01-31'}):
+            with capture_statements() as statements:
+                self.api_client.get('/api/v1/expense/', format='json', data=params,
+                                    authentication=self.get_credentials())
+            self.assertNoFullScans(statements)
+            self.assertIndexUsed(statements, 'SEARCH expense_archivedexpense USING INDEX')
+            self.assertIndexUsed(statements, 'MERGE (UNION ALL)')
+
+    def test_expense_search_archived(self):
+        # Both search indexes are read, and the matches of each looked up by id
+        archive_expenses(local_midnight(datetime.date(2014, 1, 1)))
+        with capture_statements() as statements:
+            self.api_client.get('/api/v1/expense/', format='json',
+                                data={'q': 'expense', 'date__range': '2013-11-01,2014-01-31'},
+                                authentication=self.get_credentials())
+        self.assertNoFullScans(statements, sorts=True)
+        self.assertIndexUsed(statements, 'expense_expense_search VIRTUAL TABLE INDEX')
+        self.assertIndexUsed(statements, 'expense_archivedexpense_search VIRTUAL TABLE INDEX')
+
+    def test_expense_detail(self):
+        with capture_statements() as statements:
+            self.api_client.get('/api/v1/expense/3/', format='json', authentication=self.get_credentials())
+        self.assertNoFullScans(statements)
+
+    def test_expense_write(self):
+        with capture_statements() as statements:
+            self.expense.amount = Decimal('10.00')
+            self.expense.save()
+            self.expense.delete()
+        self.assertNoFullScans(statements)
+
+    def test_weekly_totals(self):
+        with capture_statements() as statements:
+            self.api_client.get('/api/v1/weeklytotal/', format='json', data={'start_date__gte': '2014-06-01'},
+                                authentication=self.get_credentials())
+        self.assertNoFullScans(statements)
@@ -0,0 +1,130 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals, print_function, division
+import os
+import shutil
+import tempfile
+import unittest
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connection, connections, router, transaction
+from django.test import TransactionTestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from django.utils import timezone
+from tastypie.test import TestApiClient
+from expense.caching import response_cache
+from expense.factories import UserFactory
+from expense.models import Expense
+from expense.routers import replica_reads
+
+REPLICA = 'replica'
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'The replica is a copy of the SQLite test database')
+@override_settings(READ_REPLICAS=(REPLICA,))
+class ReplicaRouterTest(TransactionTestCase):
+    """
+    A second SQLite file stands in for the replica. It is a copy of the test database
+    made by replicate, so it lags behind until the next copy.
+    """
+    fixtures = ['user.json', 'expenses.json']
+
+    def setUp(self):
+        super(ReplicaRouterTest, self).setUp()
+        cache.clear()
+        response_cache().clear()
+        self.directory = tempfile.mkdtemp()
+        connections.databases[REPLICA] = dict(connections[DEFAULT_DB_ALIAS].settings_dict,
+                                              NAME=os.path.join(self.directory, 'replica.sqlite3'))
+        self.replicate()
+        self.api_client = TestApiClient()
+        self.user = User.objects.get(username='devinb')
+
+    def tearDown(self):
+        connections[REPLICA].close()
+        del connections[REPLICA]
+        del connections.databases[REPLICA]
+        shutil.rmtree(self.directory)
+        super(ReplicaRouterTest, self).tearDown()
+
+    def replicate(self):
+        """
+        Bring the replica up to date with a fresh copy of the test database.
+        """
+        connections[REPLICA].close()
+        path = connections.databases[REPLICA]['NAME']
+        if os.path.exists(path):
+            os.remove(path)
+        connection.cursor().execute('VACUUM INTO %s', [path])
+
+    def get(self, path, user=None, **params):
+        user = user or self.user
+        resp = self.api_client.get(path, format='json', data=dict({'limit': 0}, **params),
+                                   authentication='ApiKey {0}:{1}'.format(user.username, user.api_key.key))
+        self.assertEqual(resp.status_code, 200)
+        return self.api_client.serializer.deserialize(resp.content, format='application/json')
+
+    def create_expense(self, user=None):
+        return Expense.objects.create(user=user or self.user, date=timezone.now(), description='Replicated?',
+                                      amount=Decimal('1.00'), comment='')
+
+    def test_routing(self):
+        self.assertEqual(router.db_for_write(Expense), DEFAULT_DB_ALIAS)
+        self.assertFalse(router.allow_syncdb(REPLICA, Expense))
+        self.assertTrue(router.allow_syncdb(DEFAULT_DB_ALIAS, Expense))
+        # Outside an API read request
+        self.assertEqual(Expense.objects.all().db, DEFAULT_DB_ALIAS)
+
+    def test_list_reads_replica(self):
+        count = self.get('/api/v1/expense/')['meta']['total_count']
+        self.create_expense()
+        # Once the user is no longer stuck to the primary, the replica's lag shows
+        cache.clear()
+        self.assertEqual(self.get('/api/v1/expense/')['meta']['total_count'], count)
+        self.replicate()
+        self.assertEqual(self.get('/api/v1/expense/')['meta']['total_count'], count + 1)
+
+    def test_aggregates_read_replica(self):
+        weeks = self.get('/api/v1/weeklytotal/')['objects']
+        expense = self.create_expense()
+        cache.clear()
+        response_cache().clear()
+        self.assertEqual(self.get('/api/v1/weeklytotal/')['objects'], weeks)
+        self.assertEqual(self.get('/api/v1/total/', bucket='year')['objects'][-1]['start_date'], '2014-01-01')
+        self.replicate()
+        response_cache().clear()
+        self.assertEqual(self.get('/api/v1/total/', bucket='year')['objects'][-1]['start_date'],
+                         '{0}-01-01'.format(timezone.localtime(expense.date).year))
+
+    def test_read_your_writes(self):
+        count = self.get('/api/v1/expense/')['meta']['total_count']
+        resp = self.api_client.post('/api/v1/expense/', format='json', data={
+            'description': 'Mine', 'amount': '2.00', 'date': '2014-08-01T10:00:00'},
+            authentication='ApiKey {0}:{1}'.format(self.user.username, self.user.api_key.key))
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(self.get('/api/v1/expense/')['meta']['total_count'], count + 1)
+
+        # Other users still read from the replica
+        other = User.objects.get(username='carlr')
+        other_count = self.get('/api/v1/expense/', user=other)['meta']['total_count']
+        self.create_expense(other)
+        cache.delete('replica-sticky:{0}'.format(other.pk))
+        self.assertEqual(self.get('/api/v1/expense/', user=other)['meta']['total_count'], other_count)
+
+    def test_authentication_reads_primary(self):
+        # A new user and API key which haven't reached the replica yet
+        user = UserFactory()
+        self.assertEqual(self.get('/api/v1/expense/', user=user)['objects'], [])
+
+    def test_reads_in_request(self):
+        request = RequestFactory().get('/api/v1/expense/')
+        with replica_reads(request):
+            # Not authenticated yet
+            self.assertEqual(router.db_for_read(Expense), DEFAULT_DB_ALIAS)
+            request.user = self.user
+            self.assertEqual(router.db_for_read(Expense), REPLICA)
+            self.assertEqual(router.db_for_read(User), DEFAULT_DB_ALIAS)
+            with transaction.atomic():
+                self.assertEqual(router.db_for_read(Expense), DEFAULT_DB_ALIAS)
+        self.assertEqual(router.db_for_read(Expense), DEFAULT_DB_ALIAS)
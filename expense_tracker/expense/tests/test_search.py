@@ -0,0 +1,125 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals, print_function, division
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+from tastypie.test import ResourceTestCase
+from expense.caching import response_cache
+from expense.importer import import_expenses
+from expense.models import Expense
+from expense.search import search_expenses, search_terms
+
+
+class SearchTest(TestCase):
+    fixtures = ['user.json', 'expenses.json']
+
+    def setUp(self):
+        self.user = User.objects.get(username='devinb')
+
+    def search(self, q):
+        return list(search_expenses(Expense.objects.filter(user=self.user), q).values_list('id', flat=True))
+
+    def test_search_terms(self):
+        self.assertEqual(search_terms('car "rep*" -engine'), ['car', 'rep', 'engine'])
+        self.assertEqual(search_terms('Café déjà'), ['Café', 'déjà'])
+        self.assertEqual(search_terms(' *"() '), [])
+
+    def test_description_and_comment(self):
+        self.assertEqual(self.search('ferrari'), [3])
+        self.assertEqual(sorted(self.search('car')), [3, 7, 14])
+        # Every word must match, in either field
+        self.assertEqual(self.search('car engine'), [14])
+
+    def test_prefix(self):
+        self.assertEqual(sorted(self.search('birth')), [9, 16])
+        self.assertEqual(self.search('ferr'), [3])
+        self.assertEqual(self.search('errari'), [])
+
+    def test_ranking(self):
+        # The expense mentioning the word most often comes first
+        expense = Expense.objects.create(user=self.user, date=timezone.now(), description='Car car',
+                                         amount=Decimal('1.00'), comment='Car')
+        self.assertEqual(self.search('car')[0], expense.pk)
+
+    def test_no_terms(self):
+        self.assertEqual(self.search(''), [])
+        self.assertEqual(self.search('"*'), [])
+
+    def test_writes(self):
+        expense = Expense.objects.create(user=self.user, date=timezone.now(), description='Lawnmower',
+                                         amount=Decimal('250.00'), comment='')
+        self.assertEqual(self.search('lawn'), [expense.pk])
+
+        expense.description, expense.comment = 'Hedge trimmer', 'Replaces the lawnmower'
+        expense.save()
+        self.assertEqual(self.search('hedge lawn'), [expense.pk])
+        Expense.objects.filter(pk=expense.pk).update(comment='')
+        self.assertEqual(self.search('lawn'), [])
+
+        expense.delete()
+        self.assertEqual(self.search('hedge'), [])
+
+    def test_bulk_import(self):
+        import_expenses(self.user, [{'date': '2014-08-01T10:00:00', 'description': 'Imported groceries',
+                                     'amount': '12.50'}])
+        self.assertEqual(len(self.search('groceries')), 1)
+
+
+class ExpenseSearchResourceTest(ResourceTestCase):
+    fixtures = ['user.json', 'expenses.json']
+
+    def setUp(self):
+        super(ExpenseSearchResourceTest, self).setUp()
+        response_cache().clear()
+        self.username = 'devinb'
+        self.user = User.objects.get(username=self.username)
+        self.base_url = '/api/v1/expense/'
+
+    def get(self, username=None, **params):
+        user = User.objects.get(username=username or self.username)
+        resp = self.api_client.get(self.base_url, format='json', data=params,
+                                   authentication=self.create_apikey(username=user.username, api_key=user.api_key.key))
+        self.assertValidJSONResponse(resp)
+        return self.deserialize(resp)
+
+    def ids(self, data):
+        return [int(expense['resource_uri'].rstrip('/').rsplit('/', 1)[-1]) for expense in data['objects']]
+
+    def test_get_list_search(self):
+        data = self.get(q='car')
+        self.assertEqual(sorted(self.ids(data)), [3, 7, 14])
+        self.assertEqual(data['meta']['total_count'], 3)
+        expenses = Expense.objects.filter(pk__in=[3, 7, 14])
+        self.assertEqual(Decimal(data['meta']['total_amount']), sum(expense.amount for expense in expenses))
+
+    def test_get_list_search_own_expenses(self):
+        other = User.objects.get(username='carlr')
+        Expense.objects.create(user=other, date=timezone.now(), description='Car', amount=Decimal('5.00'))
+        self.assertEqual(sorted(self.ids(self.get(q='car'))), [3, 7, 14])
+        self.assertEqual(len(self.get(username='carlr', q='car')['objects']), 1)
+
+    def test_get_list_search_date_range(self):
+        data = self.get(q='car', date__range='2014-07-02,2014-07-31')
+        self.assertEqual(sorted(self.ids(data)), [7, 14])
+        self.assertEqual(data['meta']['total_count'], 2)
+        self.assertEqual(data['meta']['first_date'][:19], '2014-07-23T09:09:00')
+
+    def test_get_list_search_pages(self):
+        # Pages follow the ranking, and can still be ordered by date or paged by cursor
+        ranked = self.ids(self.get(q='expense', limit=0))
+        self.assertEqual(len(ranked), 8)
+        self.assertEqual(self.ids(self.get(q='expense', limit=3)) + self.ids(self.get(q='expense', limit=3, offset=3)) +
+                         self.ids(self.get(q='expense', limit=3, offset=6)), ranked)
+
+        by_date = self.ids(self.get(q='expense', limit=0, order_by='date'))
+        self.assertEqual(sorted(by_date), sorted(ranked))
+        first = self.get(q='expense', limit=5, cursor='')
+        second = self.api_client.get(first['meta']['next'], format='json', authentication=self.create_apikey(
+            username=self.username, api_key=self.user.api_key.key))
+        self.assertEqual(self.ids(first) + self.ids(self.deserialize(second)), by_date)
+
+    def test_get_list_search_nothing(self):
+        data = self.get(q='"')
+        self.assertEqual(data['objects'], [])
+        self.assertEqual(data['meta']['total_count'], 0)
@@ -0,0 +1,171 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals, print_function, division
+import datetime
+import random
+from collections import defaultdict
+from decimal import Decimal
+from pytz import timezone
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone as django_timezone
+from tastypie.test import ResourceTestCase
+from expense import analytics
+from expense.analytics import spending_analytics
+from expense.caching import response_cache
+from expense.models import Expense
+
+CENT = Decimal('0.01')
+
+
+def reference_percentile(ordered, percent):
+    if not ordered:
+        return None
+    rank = Decimal(len(ordered) - 1) * percent / 100
+    lower = int(rank)
+    value = ordered[lower]
+    if rank > lower:
+        value += (ordered[lower + 1] - value) * (rank - lower)
+    return value.quantize(CENT)
+
+
+def reference_analytics(user, first=None, last=None):
+    """
+    Build the weekly spending and summary of a user from their expenses with Decimals,
+    as plainly as possible.
+    """
+    expenses = [(django_timezone.localtime(expense.date).date(), expense.amount)
+                for expense in Expense.objects.filter(user=user)]
+    weeks = defaultdict(list)
+    for date, amount in expenses:
+        weeks[date - datetime.timedelta(days=date.weekday())].append(amount)
+    if not weeks:
+        return [], None
+
+    mondays = [min(weeks)]
+    while mondays[-1] < max(weeks):
+        mondays.append(mondays[-1] + datetime.timedelta(weeks=1))
+    totals = [sum(weeks[monday], Decimal('0.00')) for monday in mondays]
+
+    rows = []
+    for index, monday in enumerate(mondays):
+        if (first is not None and monday < first) or (last is not None and monday > last):
+            continue
+        previous = totals[index - 1] if index else None
+        rows.append({
+            'start_date': monday,
+            'count': len(weeks[monday]),
+            'total': totals[index],
+            'rolling_average_4': (sum(totals[index - 3:index + 1]) / 4).quantize(CENT) if index >= 3 else None,
+            'rolling_average_12': (sum(totals[index - 11:index + 1]) / 12).quantize(CENT) if index >= 11 else None,
+            'change': totals[index] - previous if previous is not None else None,
+            'change_percent': ((totals[index] - previous) * 100 / previous).quantize(CENT) if previous else None,
+        })
+
+    listed = [row['total'] for row in rows]
+    amounts = sorted(amount for date, amount in expenses
+                     if rows and rows[0]['start_date'] <= date < rows[-1]['start_date'] + datetime.timedelta(weeks=1))
+    slope, intercept = None, None
+    if len(listed) > 1:
+        mean_x = Decimal(len(listed) - 1) / 2
+        mean_y = sum(listed) / len(listed)
+        slope = (sum((x - mean_x) * (y - mean_y) for x, y in enumerate(listed)) /
+                 sum((x - mean_x) ** 2 for x in range(len(listed))))
+        intercept = (mean_y - slope * mean_x).quantize(CENT)
+        slope = slope.quantize(CENT)
+    summary = {
+        'expense_percentiles': dict(('p{0}'.format(percent), reference_percentile(amounts, percent))
+                                    for percent in analytics.PERCENTILES),
+        'weekly_percentiles': dict(('p{0}'.format(percent), reference_percentile(sorted(listed), percent))
+                                   for percent in analytics.PERCENTILES),
+        'trend': {'slope': slope, 'intercept': intercept},
+    }
+    return rows, summary
+
+
+class SpendingAnalyticsTest(TestCase):
+    fixtures = ['user.json', 'expenses.json']
+
+    def setUp(self):
+        self.user = User.objects.get(username='devinb')
+        auckland = timezone('Pacific/Auckland')
+        rand = random.Random(0)
+        for _ in range(300):
+            date = datetime.datetime(2013, 1, 1) + datetime.timedelta(minutes=rand.randint(0, 2 * 365 * 24 * 60))
+            Expense.objects.create(user=self.user, date=auckland.localize(date), description='Random',
+                                   amount=Decimal(rand.choice([rand.randint(-500, 5000), rand.randint(1, 99) * 100])
+                                                  ).scaleb(-2), comment='')
+
+    def assertMatchesReference(self, first=None, last=None):
+        weeks, summary = spending_analytics(self.user, first, last)
+        expected_weeks, expected_summary = reference_analytics(self.user, first, last)
+        self.assertEqual([dict((name, getattr(week, name)) for name in expected_weeks[0]) for week in weeks],
+                         expected_weeks)
+        self.assertEqual(summary, expected_summary)
+
+    def assertMatchesReferenceWithAndWithoutNumpy(self, first=None, last=None):
+        self.assertMatchesReference(first, last)
+        numpy, analytics.numpy = analytics.numpy, None
+        try:
+            self.assertMatchesReference(first, last)
+        finally:
+            analytics.numpy = numpy
+
+    def test_all_weeks(self):
+        self.assertMatchesReferenceWithAndWithoutNumpy()
+
+    def test_some_weeks(self):
+        # The first week isn't a Monday, so starts the week after
+        self.assertMatchesReferenceWithAndWithoutNumpy(datetime.date(2013, 9, 4), datetime.date(2014, 3, 31))
+
+    def test_no_weeks(self):
+        self.assertEqual(spending_analytics(self.user, datetime.date(2016, 1, 4)),
+                         ([], {'expense_percentiles': dict.fromkeys(['p10', 'p25', 'p50', 'p75', 'p90', 'p95']),
+                               'weekly_percentiles': dict.fromkeys(['p10', 'p25', 'p50', 'p75', 'p90', 'p95']),
+                               'trend': {'slope': None, 'intercept': None}}))
+        self.assertEqual(spending_analytics(User.objects.get(username='carlr'))[0], [])
+
+
+class SpendingResourceTest(ResourceTestCase):
+    fixtures = ['user.json', 'expenses.json']
+
+    def setUp(self):
+        super(SpendingResourceTest, self).setUp()
+        response_cache().clear()
+        self.username = 'devinb'
+        self.user = User.objects.get(username=self.username)
+        self.base_url = '/api/v1/spending/'
+
+    def get_credentials(self):
+        return self.create_apikey(username=self.username, api_key=self.user.api_key.key)
+
+    def get(self, **params):
+        resp = self.api_client.get(self.base_url, format='json', data=dict({'limit': 0}, **params),
+                                   authentication=self.get_credentials())
+        self.assertValidJSONResponse(resp)
+        return self.deserialize(resp)
+
+    def test_get_list_unauthorized(self):
+        self.assertHttpUnauthorized(self.api_client.get(self.base_url, format='json'))
+
+    def test_get_list(self):
+        data = self.get()
+        weeks, summary = reference_analytics(self.user)
+        self.assertEqual(len(data['objects']), len(weeks))
+        self.assertEqual(data['objects'][-1]['start_date'], weeks[-1]['start_date'].isoformat())
+        self.assertEqual(Decimal(data['objects'][-1]['rolling_average_12']), weeks[-1]['rolling_average_12'])
+        self.assertIsNone(data['objects'][0]['change'])
+        self.assertEqual(Decimal(data['meta']['expense_percentiles']['p50']), summary['expense_percentiles']['p50'])
+        self.assertEqual(Decimal(data['meta']['trend']['slope']), summary['trend']['slope'])
+        self.assertEqual(self.get(order_by='-start_date')['objects'], data['objects'][::-1])
+
+    def test_get_list_filtered(self):
+        data = self.get(start_date__range='2014-06-01,2014-07-31')
+        weeks, summary = reference_analytics(self.user, datetime.date(2014, 6, 1), datetime.date(2014, 7, 31))
+        self.assertEqual([week['start_date'] for week in data['objects']],
+                         [week['start_date'].isoformat() for week in weeks])
+        self.assertEqual(data['objects'][0]['start_date'], '2014-06-02')
+        self.assertEqual(Decimal(data['meta']['weekly_percentiles']['p90']), summary['weekly_percentiles']['p90'])
+
+    def test_get_list_invalid(self):
+        self.assertHttpBadRequest(self.api_client.get(self.base_url, format='json', data={'start_date': 'yesterday'},
+                                                      authentication=self.get_credentials()))
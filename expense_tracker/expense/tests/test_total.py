@@ -0,0 +1,119 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals, print_function, division
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+from pytz import timezone
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone as django_timezone
+from tastypie.test import ResourceTestCase
+from expense.aggregation import BUCKETS, bucket_start, bucket_totals, next_bucket_start
+from expense.caching import response_cache
+from expense.models import Expense
+
+
+def expected_totals(expenses, bucket):
+    """
+    Total the expenses per bucket in Python, in the local time zone.
+    """
+    buckets = defaultdict(list)
+    for expense in expenses:
+        buckets[bucket_start(django_timezone.localtime(expense.date).date(), bucket)].append(expense.amount)
+    return [(start, len(amounts), sum(amounts), min(amounts), max(amounts))
+            for start, amounts in sorted(buckets.items())]
+
+
+class BucketTest(TestCase):
+
+    def test_bucket_start(self):
+        date = datetime.date(2014, 8, 14)
+        self.assertEqual([bucket_start(date, bucket) for bucket in BUCKETS], [
+            date, datetime.date(2014, 8, 11), datetime.date(2014, 8, 1), datetime.date(2014, 7, 1),
+            datetime.date(2014, 1, 1)])
+
+    def test_next_bucket_start(self):
+        date = datetime.date(2014, 12, 31)
+        self.assertEqual([next_bucket_start(date, bucket) for bucket in BUCKETS], [
+            datetime.date(2015, 1, 1), datetime.date(2015, 1, 5), datetime.date(2015, 1, 1),
+            datetime.date(2015, 1, 1), datetime.date(2015, 1, 1)])
+
+
+class TotalResourceTest(ResourceTestCase):
+    fixtures = ['user.json', 'expenses.json']
+
+    def setUp(self):
+        super(TotalResourceTest, self).setUp()
+        response_cache().clear()
+        self.username = 'devinb'
+        self.user = User.objects.get(username=self.username)
+        self.base_url = '/api/v1/total/'
+
+        # Expenses either side of the changes to and from daylight saving in Auckland, at the
+        # end of a month and a quarter, which fall in a different bucket in UTC
+        utc = timezone('UTC')
+        for date in (datetime.datetime(2014, 4, 5, 13, 59), datetime.datetime(2014, 4, 5, 14, 1),
+                     datetime.datetime(2014, 9, 27, 13, 59), datetime.datetime(2014, 9, 27, 14, 1),
+                     datetime.datetime(2014, 3, 31, 11, 30), datetime.datetime(2014, 9, 30, 12, 30)):
+            Expense.objects.create(user=self.user, description='Boundary', amount=Decimal('1.25'),
+                                   date=utc.localize(date))
+
+    def get_credentials(self):
+        return self.create_apikey(username=self.username, api_key=self.user.api_key.key)
+
+    def get(self, **params):
+        resp = self.api_client.get(self.base_url, format='json', data=dict({'limit': 0}, **params),
+                                   authentication=self.get_credentials())
+        self.assertValidJSONResponse(resp)
+        return self.deserialize(resp)['objects']
+
+    def test_get_list_unauthorized(self):
+        self.assertHttpUnauthorized(self.api_client.get(self.base_url, format='json'))
+
+    def test_bucket_totals(self):
+        expenses = Expense.objects.filter(user=self.user)
+        for bucket in BUCKETS:
+            self.assertEqual([(total.start_date, total.count, total.total, total.minimum, total.maximum)
+                              for total in bucket_totals(expenses, bucket)],
+                             expected_totals(expenses, bucket), bucket)
+
+    def test_get_list(self):
+        expected = expected_totals(Expense.objects.filter(user=self.user), 'quarter')
+        totals = self.get(bucket='quarter')
+        self.assertEqual([(total['start_date'], total['count'], Decimal(total['total']), Decimal(total['minimum']),
+                           Decimal(total['maximum'])) for total in totals],
+                         [(start.isoformat(), count, total, minimum, maximum)
+                          for start, count, total, minimum, maximum in expected])
+        self.assertEqual(Decimal(totals[0]['average_expense']), expected[0][2] / expected[0][1])
+        self.assertEqual(self.get(bucket='quarter', order_by='-start_date'), totals[::-1])
+
+    def test_get_list_default_month(self):
+        self.assertEqual(len(self.get()), len(expected_totals(Expense.objects.filter(user=self.user), 'month')))
+
+    def test_get_list_filtered(self):
+        # Only whole months which start within the range. Months without expenses are left out.
+        months = self.get(start_date__range='2014-04-15,2014-09-01')
+        self.assertEqual([month['start_date'] for month in months], [
+            start.isoformat() for start, _, _, _, _ in expected_totals(Expense.objects.filter(user=self.user), 'month')
+            if datetime.date(2014, 5, 1) <= start <= datetime.date(2014, 9, 1)])
+        self.assertEqual(months[-1]['start_date'], '2014-09-01')
+        september = [expense for expense in Expense.objects.filter(user=self.user)
+                     if django_timezone.localtime(expense.date).date().month == 9]
+        self.assertEqual(months[-1]['count'], len(september))
+        self.assertEqual([month['start_date'] for month in self.get(start_date='2014-07-01')], ['2014-07-01'])
+        self.assertEqual(self.get(start_date='2014-07-02'), [])
+        self.assertEqual([month['start_date'] for month in self.get(start_date__gt='2014-06-01',
+                                                                    start_date__lt='2014-08-01')], ['2014-07-01'])
+
+    def test_get_list_weeks(self):
+        # The week bucket matches the weekly totals
+        weeks = self.get(bucket='week')
+        weekly_totals = self.deserialize(self.api_client.get('/api/v1/weeklytotal/', format='json', data={'limit': 0},
+                                                             authentication=self.get_credentials()))['objects']
+        self.assertEqual([(week['start_date'], week['count'], week['total']) for week in weeks],
+                         [(week['start_date'], week['count'], week['total']) for week in weekly_totals])
+
+    def test_get_list_invalid(self):
+        for params in ({'bucket': 'fortnight'}, {'start_date': 'yesterday'}):
+            self.assertHttpBadRequest(self.api_client.get(self.base_url, format='json', data=params,
+                                                          authentication=self.get_credentials()))
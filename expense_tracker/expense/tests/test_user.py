@@ -2,9 +2,10 @@
 from __future__ import absolute_import, unicode_literals, print_function, division
 from tastypie.test import ResourceTestCase
 from django.contrib.auth.models import User
+from expense.tests.query_budget import QueryBudgetMixin
 
 
-class UserResourceTest(ResourceTestCase):
+class UserResourceTest(QueryBudgetMixin, ResourceTestCase):
     # Use ``fixtures`` & ``urls`` as normal. See Django's ``TestCase`` documentation for the gory details.
     fixtures = ['user.json']
 
@@ -67,6 +68,11 @@ class UserResourceTest(ResourceTestCase):
         self.assertEqual(data['username'], 'jamesw')
         self.assertEqual(data['success'], True)
 
+    def test_post_user_authenticate_query_budget(self):
+        # The user and their API key
+        with self.assertQueryBudget(2):
+            self.assertHttpOK(self.api_client.post(self.auth_url, format='json', data=self.auth_post_data))
+
     def test_delete_user_authenticate(self):
         self.assertHttpMethodNotAllowed(self.api_client.delete(self.auth_url, format='json'))
 
@@ -87,6 +93,12 @@ class UserResourceTest(ResourceTestCase):
         # Verify a new one has been added.
         self.assertEqual(User.objects.count(), 5)
 
+    def test_post_user_register_query_budget(self):
+        # Check the username, create the user, get or create their API key (in a savepoint), save their
+        # names and then authenticate them
+        with self.assertQueryBudget(9):
+            self.assertHttpOK(self.api_client.post(self.reg_url, format='json', data=self.reg_post_data))
+
     def test_delete_user_register(self):
         self.assertHttpMethodNotAllowed(self.api_client.delete(self.reg_url, format='json'))
 
@@ -1,15 +1,30 @@
 # coding=utf-8
 from __future__ import absolute_import, unicode_literals, print_function, division
+import datetime
+from decimal import Decimal
+from pytz import timezone
 from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.utils import six
 from tastypie.test import ResourceTestCase
+from expense.aggregation import weekly_totals
+from expense.authentication import api_key_cache
+from expense.caching import cache_stats, response_cache
+from expense.factories import create_expenses_bulk
+from expense.models import Expense, WeeklyRollup
+from expense.resources import _build_weekly_totals
+from expense.tests.query_budget import QueryBudgetMixin
 
 
-class WeeklyTotalResourceTest(ResourceTestCase):
+class WeeklyTotalResourceTest(QueryBudgetMixin, ResourceTestCase):
     # WeeklyTotal depends upon the existence of expenses
     fixtures = ['user.json', 'expenses.json']
 
     def setUp(self):
         super(WeeklyTotalResourceTest, self).setUp()
+        response_cache().clear()
 
         # Create a user.
         self.username = 'devinb'
@@ -47,6 +62,110 @@ class WeeklyTotalResourceTest(ResourceTestCase):
         # Check that all the keys we expect are in the returned data
         self.assertKeys(objects[0], ['count', 'average', 'year', 'week_number', 'total', 'start_date', 'resource_uri'])
 
+    def test_get_list_not_modified(self):
+        resp = self.api_client.get(self.base_url, format='json', authentication=self.get_credentials())
+        etag = resp['ETag']
+        with self.assertNumQueries(1):
+            resp = self.api_client.get(self.base_url, format='json', authentication=self.get_credentials(),
+                                       HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 304)
+
+        Expense.objects.filter(user=self.user).order_by('date')[0].delete()
+        resp = self.api_client.get(self.base_url, format='json', authentication=self.get_credentials(),
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertValidJSONResponse(resp)
+        self.assertNotEqual(resp['ETag'], etag)
+
+    def test_get_list_query_budget(self):
+        # Authentication (user and key), the version, the count and the page, however many weeks are listed
+        for extra in (0, 500):
+            create_expenses_bulk(self.user, extra)
+            api_key_cache().clear()
+            credentials = self.get_credentials()
+            with self.assertQueryBudget(5):
+                resp = self.api_client.get(self.base_url, format='json', data={'limit': 0}, authentication=credentials)
+            self.assertEqual(len(self.deserialize(resp)['objects']),
+                             WeeklyRollup.objects.filter(user=self.user).count())
+
+    def test_get_list_cached(self):
+        resp = self.api_client.get(self.base_url, format='json', authentication=self.get_credentials())
+        self.assertEqual(resp['X-Cache'], 'MISS')
+        data = self.deserialize(resp)
+        # Only the version is read once the list is cached
+        with self.assertNumQueries(1):
+            resp = self.api_client.get(self.base_url, format='json', authentication=self.get_credentials())
+        self.assertValidJSONResponse(resp)
+        self.assertEqual(resp['X-Cache'], 'HIT')
+        self.assertEqual(self.deserialize(resp), data)
+        self.assertEqual(cache_stats(), {'hits': 1, 'misses': 1})
+
+        # Each query string is cached separately
+        resp = self.api_client.get(self.base_url, format='json', data={'order_by': '-start_date'},
+                                   authentication=self.get_credentials())
+        self.assertEqual(resp['X-Cache'], 'MISS')
+
+    def test_get_list_cache_invalidated(self):
+        self.api_client.get(self.base_url, format='json', authentication=self.get_credentials())
+
+        expense = Expense.objects.filter(user=self.user).order_by('-date')[0]
+        expense.amount += 10
+        expense.save()
+        resp = self.api_client.get(self.base_url, format='json', authentication=self.get_credentials())
+        self.assertEqual(resp['X-Cache'], 'MISS')
+        latest = self.deserialize(resp)['objects'][-1]
+        self.assertEqual(Decimal(latest['total']), WeeklyRollup.objects.get(
+            user=self.user, start_date=latest['start_date']).total)
+
+        # Another user's changes leave the cached list in place
+        other = User.objects.create_user('other', password='other')
+        Expense.objects.create(user=other, description='Other', amount=5, date=expense.date)
+        resp = self.api_client.get(self.base_url, format='json', authentication=self.get_credentials())
+        self.assertEqual(resp['X-Cache'], 'HIT')
+
+    def test_cache_stats_command(self):
+        self.api_client.get(self.base_url, format='json', authentication=self.get_credentials())
+        self.api_client.get(self.base_url, format='json', authentication=self.get_credentials())
+        out = six.StringIO()
+        call_command('cache_stats', reset=True, stdout=out)
+        self.assertIn('Hits: 1, misses: 1, hit ratio: 50.0%', out.getvalue())
+        self.assertEqual(cache_stats(), {'hits': 0, 'misses': 0})
+
+    def test_get_list_filtered(self):
+        resp = self.api_client.get(self.base_url, format='json', data={'start_date__range': '2014-06-01,2014-7-31'},
+                                   authentication=self.get_credentials())
+        self.assertValidJSONResponse(resp)
+        objects = self.deserialize(resp)['objects']
+        self.assertEqual([obj['start_date'] for obj in objects],
+                         ['2014-06-09', '2014-06-30', '2014-07-07', '2014-07-21'])
+
+        resp = self.api_client.get(self.base_url, format='json', data={'start_date__gte': '2014-07-21'},
+                                   authentication=self.get_credentials())
+        self.assertEqual([obj['start_date'] for obj in self.deserialize(resp)['objects']],
+                         ['2014-07-21', '2014-12-22'])
+
+    def test_get_list_invalid_filter(self):
+        self.assertHttpBadRequest(self.api_client.get(self.base_url, format='json',
+                                                      data={'start_date__range': 'yesterday,today'},
+                                                      authentication=self.get_credentials()))
+        self.assertHttpBadRequest(self.api_client.get(self.base_url, format='json',
+                                                      data={'start_date__contains': '2014'},
+                                                      authentication=self.get_credentials()))
+
+    def test_get_list_ordering(self):
+        resp = self.api_client.get(self.base_url, format='json', data={'order_by': '-start_date'},
+                                   authentication=self.get_credentials())
+        start_dates = [obj['start_date'] for obj in self.deserialize(resp)['objects']]
+        self.assertEqual(start_dates, sorted(start_dates, reverse=True))
+        self.assertHttpBadRequest(self.api_client.get(self.base_url, format='json', data={'order_by': 'total'},
+                                                      authentication=self.get_credentials()))
+
+    def test_get_list_paginated(self):
+        resp = self.api_client.get(self.base_url, format='json', data={'limit': 3, 'offset': 3},
+                                   authentication=self.get_credentials())
+        data = self.deserialize(resp)
+        self.assertEqual(data['meta']['total_count'], 8)
+        self.assertEqual([obj['start_date'] for obj in data['objects']], ['2014-06-09', '2014-06-30', '2014-07-07'])
+
     def test_get_detail_unauthenticated(self):
         self.assertHttpMethodNotAllowed(self.api_client.get(self.detail_url, format='json'))
 
@@ -74,3 +193,93 @@ class WeeklyTotalResourceTest(ResourceTestCase):
     def test_delete_detail(self):
         self.assertHttpMethodNotAllowed(self.api_client.delete(self.detail_url, format='json',
                                                                authentication=self.get_credentials()))
+
+
+class WeeklyTotalAggregationTest(TestCase):
+    fixtures = ['user.json', 'expenses.json']
+
+    def setUp(self):
+        self.user = User.objects.get(username='devinb')
+        auckland = timezone('Pacific/Auckland')
+        # Expenses either side of ISO year boundaries. Just after midnight on Monday 29th December 2014
+        # local time is still Sunday in UTC, so it must be counted in week 1 of 2015.
+        for date, amount in [(datetime.datetime(2014, 12, 29, 0, 30), '10.00'),
+                             (datetime.datetime(2015, 12, 31, 12, 0), '20.50'),
+                             (datetime.datetime(2016, 1, 3, 23, 59), '30.25'),
+                             (datetime.datetime(2016, 1, 4, 0, 1), '40.00')]:
+            Expense.objects.create(user=self.user, date=auckland.localize(date), description='Boundary',
+                                   amount=Decimal(amount), comment='')
+
+    def assertWeeklyTotalsEqual(self, first, second):
+        self.assertEqual([(t.year, t.week_number, t.start_date, t.count, t.total, t.average) for t in first],
+                         [(t.year, t.week_number, t.start_date, t.count, t.total, t.average) for t in second])
+
+    def test_matches_python_totals(self):
+        expenses = Expense.objects.filter(user=self.user)
+        self.assertWeeklyTotalsEqual(weekly_totals(expenses), _build_weekly_totals(expenses))
+
+    def test_year_boundaries(self):
+        totals = dict(((t.year, t.week_number), t) for t in weekly_totals(Expense.objects.filter(user=self.user)))
+        self.assertEqual(totals[(2015, 1)].count, 1)
+        self.assertEqual(totals[(2015, 1)].start_date, datetime.date(2014, 12, 29))
+        self.assertEqual(totals[(2015, 53)].count, 2)
+        self.assertEqual(totals[(2015, 53)].total, Decimal('50.75'))
+        self.assertEqual(totals[(2016, 1)].total, Decimal('40.00'))
+
+    def test_no_expenses(self):
+        self.assertEqual(weekly_totals(Expense.objects.filter(user__username='carlr')), [])
+
+
+class WeeklyRollupTest(TestCase):
+    fixtures = ['user.json', 'expenses.json']
+
+    def setUp(self):
+        self.user = User.objects.get(username='devinb')
+        self.auckland = timezone('Pacific/Auckland')
+
+    def rollup(self):
+        return [(r.year, r.week_number, r.count, r.total)
+                for r in WeeklyRollup.objects.filter(user=self.user).order_by('year', 'week_number')]
+
+    def assertRollupMatchesExpenses(self):
+        expected = [(t.year, t.week_number, t.count, t.total)
+                    for t in weekly_totals(Expense.objects.filter(user=self.user))]
+        self.assertEqual(self.rollup(), expected)
+
+    def test_fixtures(self):
+        self.assertRollupMatchesExpenses()
+
+    def test_create(self):
+        Expense.objects.create(user=self.user, date=self.auckland.localize(datetime.datetime(2014, 6, 30, 9)),
+                               description='New', amount=Decimal('1.25'), comment='')
+        self.assertRollupMatchesExpenses()
+
+    def test_update_amount(self):
+        expense = Expense.objects.get(pk=1)
+        expense.amount = Decimal('700.10')
+        expense.save()
+        self.assertRollupMatchesExpenses()
+
+    def test_update_moves_week(self):
+        # Expense 15 is the only expense in week 19 of 2013, so the week should disappear when it moves
+        expense = Expense.objects.get(pk=15)
+        expense.date = self.auckland.localize(datetime.datetime(2014, 12, 29, 0, 30))
+        expense.amount = Decimal('12.34')
+        expense.save()
+        self.assertNotIn((2013, 19), [(year, week_number) for year, week_number, count, total in self.rollup()])
+        self.assertRollupMatchesExpenses()
+
+    def test_delete(self):
+        Expense.objects.get(pk=3).delete()
+        Expense.objects.filter(pk__in=[15, 16]).delete()
+        self.assertRollupMatchesExpenses()
+
+    def test_rebuild_command(self):
+        # Changes made with update() skip the save signals, so the rollup drifts
+        Expense.objects.filter(pk=1).update(amount=Decimal('1.00'))
+        WeeklyRollup.objects.filter(user=self.user, year=2013).delete()
+        self.assertRaises(CommandError, call_command, 'weekly_rollup', verify=True, stdout=six.StringIO())
+
+        call_command('weekly_rollup', stdout=six.StringIO())
+        self.assertRollupMatchesExpenses()
+        call_command('weekly_rollup', verify=True, stdout=six.StringIO())
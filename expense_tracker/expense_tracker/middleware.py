@@ -0,0 +1,85 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals, print_function, division
+import json
+import logging
+import random
+import time
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from expense.profiling import start_profile, stop_profile
+
+logger = logging.getLogger('expense_tracker.profiling')
+
+
+class ProfilingMiddleware(object):
+    """
+    Profile a sample of requests, recording the wall time, the number of SQL
+    queries and the time spent running them, and the time the API resources
+    spend dehydrating, altering the list data and serializing. The timings are
+    sent back in a Server-Timing header and logged as a line of JSON to the
+    expense_tracker.profiling logger.
+
+    settings.PROFILING_SAMPLE_RATE is the fraction of requests profiled, from 0
+    to 1. At 0 (the default) the middleware removes itself at startup, and only
+    a thread local lookup per resource call remains.
+
+    Queries are recorded by turning on the debug cursor for the sampled request
+    only, so SQL time is only as precise as Django records it (a millisecond).
+    The timings of streamed responses (e.g. the export) stop when the response
+    starts, so they don't include the streaming.
+    """
+
+    def __init__(self):
+        self.sample_rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0)
+        if not self.sample_rate:
+            raise MiddlewareNotUsed
+
+    def process_request(self, request):
+        if random.random() >= self.sample_rate:
+            return None
+
+        request._profiling = {
+            'start': time.time(),
+            'queries': dict((connection.alias, (connection.use_debug_cursor, len(connection.queries)))
+                            for connection in connections.all()),
+        }
+        for connection in connections.all():
+            connection.use_debug_cursor = True
+        start_profile()
+        return None
+
+    def process_response(self, request, response):
+        profiling = getattr(request, '_profiling', None)
+        if profiling is None:
+            return response
+        profile = stop_profile()
+        total = (time.time() - profiling['start']) * 1000
+
+        queries = []
+        for connection in connections.all():
+            use_debug_cursor, first_query = profiling['queries'].get(connection.alias, (None, 0))
+            queries.extend(connection.queries[first_query:])
+            connection.use_debug_cursor = use_debug_cursor
+            if not settings.DEBUG:
+                # Only keep the queries Django would have kept without profiling
+                del connection.queries[first_query:]
+        sql = sum(float(query['time']) for query in queries) * 1000
+
+        timings = [('total', total, None), ('sql', sql, '{0} queries'.format(len(queries)))]
+        timings.extend((name, duration, '{0} calls'.format(profile.calls[name]))
+                       for name, duration in sorted(profile.durations.items()))
+        response['Server-Timing'] = ', '.join(
+            '{0};dur={1:.2f}'.format(name, duration) + (';desc="{0}"'.format(desc) if desc else '')
+            for name, duration, desc in timings)
+
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(total, 2),
+            'sql_ms': round(sql, 2),
+            'queries': len(queries),
+            'sections': dict((name, round(duration, 2)) for name, duration in profile.durations.items()),
+        }, sort_keys=True))
+        return response
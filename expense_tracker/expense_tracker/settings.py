@@ -42,6 +42,8 @@ INSTALLED_APPS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    # First, so that it times the whole request. Only active if PROFILING_SAMPLE_RATE is set.
+    'expense_tracker.middleware.ProfilingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -65,6 +67,98 @@ DATABASES = {
     }
 }
 
+# Pragmas set on every new SQLite connection, see expense.database. Write-ahead logging
+# lets reads carry on while another worker writes, and is safe with synchronous=NORMAL.
+# The busy timeout (in milliseconds) makes a writer wait for the lock rather than fail.
+# The cache size is in KiB when negative, and the memory map size in bytes.
+SQLITE_PRAGMAS = (
+    ('busy_timeout', 5000),
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -64000),
+    ('mmap_size', 256 * 1024 * 1024),
+)
+
+# The number of times a write transaction which finds the database locked is tried in
+# all, and the seconds waited before the first retry, which doubles with each retry
+DATABASE_WRITE_ATTEMPTS = 5
+DATABASE_WRITE_RETRY_DELAY = 0.05
+
+# The API read requests read from these aliases of DATABASES, which must be read replicas
+# of the default database, see expense.routers. For example, to try it out locally with a
+# copy of the database standing in for a replica:
+#     DATABASES['replica'] = {'ENGINE': 'django.db.backends.sqlite3',
+#                             'NAME': os.path.join(BASE_DIR, 'replica.sqlite3')}
+#     READ_REPLICAS = ('replica',)
+READ_REPLICAS = ()
+# The number of seconds a user's reads stay on the default database after they change an expense
+REPLICA_STICKY_SECONDS = 10
+DATABASE_ROUTERS = ['expense.routers.ReplicaRouter']
+
+# The number of years, counting the current one, which the archive_expenses command keeps
+# in the expense table. Older expenses are moved to the archive, see expense.archive.
+ARCHIVE_KEEP_YEARS = 2
+
+# Caches
+# https://docs.djangoproject.com/en/1.6/topics/cache/
+
+# The local memory cache is per process, so with several worker processes a change to
+# an API key or user only reaches the other processes when their entry expires. Use a
+# shared cache (e.g. memcached) in production.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'api_keys': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'api_keys',
+        'TIMEOUT': 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    'responses': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'responses',
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
+# The cache used by expense.authentication.CachedApiKeyAuthentication
+API_KEY_CACHE = 'api_keys'
+# The cache of serialized weekly total lists, see expense.caching
+RESPONSE_CACHE = 'responses'
+
+# The fraction of requests profiled by expense_tracker.middleware.ProfilingMiddleware,
+# from 0 (off) to 1 (every request)
+PROFILING_SAMPLE_RATE = 0
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'expense_tracker.profiling': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        # The rebuilds of the expense table, see expense.archive.create_id_sequence
+        'expense_tracker.archive': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.6/topics/i18n/
 
@@ -4,12 +4,16 @@ from tastypie.api import Api
 from django.conf.urls import patterns, include, url
 from django.conf import settings
 from django.contrib import admin
-from expense.resources import ExpenseResource, UserResource, WeeklyTotalResource
+from expense.resources import (DashboardResource, ExpenseResource, SpendingResource, TotalResource, UserResource,
+                               WeeklyTotalResource)
 
 v1_api = Api(api_name='v1')
 v1_api.register(UserResource())
 v1_api.register(ExpenseResource())
 v1_api.register(WeeklyTotalResource())
+v1_api.register(TotalResource())
+v1_api.register(SpendingResource())
+v1_api.register(DashboardResource())
 
 admin.autodiscover()
 
@@ -0,0 +1,50 @@
+"use strict";
+
+(function() {
+    var app = angular.module("expenseManager.conditional", []);
+
+    // Service makes conditional GET requests. The last response to each URL is kept along with
+    // its ETag, which is sent back as If-None-Match; if the server answers 304 Not Modified the
+    // kept response is used instead of fetching and parsing the same data again.
+    app.service('ConditionalHttp', ['$http', '$q', function($http, $q) {
+        var responses = {};
+
+        this.get = function(url, config) {
+            config = angular.extend({}, config);
+            var key = url + angular.toJson(config.params || {});
+            var cached = responses[key];
+            if (cached) {
+                config.headers = angular.extend({}, config.headers, {'If-None-Match': cached.etag});
+            }
+
+            var promise = $http.get(url, config).then(function(response) {
+                var etag = response.headers('ETag');
+                if (etag) {
+                    responses[key] = {etag: etag, data: angular.copy(response.data)};
+                }
+                return response;
+            }, function(response) {
+                if (response.status === 304 && cached) {
+                    return angular.extend({}, response, {status: 200, data: angular.copy(cached.data)});
+                }
+                return $q.reject(response);
+            });
+
+            // Provide the same success and error shortcuts as $http
+            promise.success = function(fn) {
+                promise.then(function(response) {
+                    fn(response.data, response.status, response.headers, response.config);
+                });
+                return promise;
+            };
+            promise.error = function(fn) {
+                promise.then(null, function(response) {
+                    fn(response.data, response.status, response.headers, response.config);
+                });
+                return promise;
+            };
+            return promise;
+        };
+    }]);
+
+})();
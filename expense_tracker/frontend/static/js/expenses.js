@@ -1,7 +1,7 @@
 "use strict";
 
 (function() {
-    var app = angular.module("expenseManager.expenses", ["ui.bootstrap"]);
+    var app = angular.module("expenseManager.expenses", ["ui.bootstrap", "expenseManager.conditional"]);
     var apiBase = '/api/v1/';
 
     app.config(function($httpProvider) {
@@ -10,13 +10,13 @@
     });
 
     // Service provides RESTful methods to manage expenses on the server
-    app.service('ExpenseService', ['$http', function($http) {
+    app.service('ExpenseService', ['$http', 'ConditionalHttp', function($http, ConditionalHttp) {
         var urlBase = apiBase + 'expense/';
         this.getExpenses = function(dates) {
             if (dates) {
-                return $http.get(urlBase, {params:{date__range: [dates.from, dates.to]}});
+                return ConditionalHttp.get(urlBase, {params:{date__range: [dates.from, dates.to]}});
             }
-            return $http.get(urlBase);
+            return ConditionalHttp.get(urlBase);
         };
         this.getExpense = function(id) {
             return $http.get(urlBase + id + "/");
@@ -29,6 +29,22 @@
         };
     }]);
 
+    // Service fetches the expense list page, its totals and the weekly totals in one request
+    app.service('DashboardService', ['ConditionalHttp', function(ConditionalHttp) {
+        var urlBase = apiBase + 'dashboard/';
+        var service = this;
+        // The weekly totals of the last unfiltered dashboard, so the weekly totals page can show them straight away
+        this.weeklyTotals = null;
+        this.getDashboard = function(dates) {
+            var config = dates ? {params: {date__range: [dates.from, dates.to]}} : {};
+            return ConditionalHttp.get(urlBase, config).success(function(dashboard) {
+                if (!dates) {
+                    service.weeklyTotals = dashboard.weekly_totals;
+                }
+            });
+        };
+    }]);
+
     // Service used to set the to and from filtering dates
     app.service('FilterService', ['$log', function($log) {
         var dates = {from: new Date(), to: new Date()};
@@ -55,8 +71,8 @@
     }]);
 
     // Controller for expense list page
-    app.controller('ExpenseListController', ['$scope', 'ExpenseService', 'FilterService',
-        function($scope, ExpenseService, FilterService) {
+    app.controller('ExpenseListController', ['$scope', 'ExpenseService', 'DashboardService', 'FilterService',
+        function($scope, ExpenseService, DashboardService, FilterService) {
             $scope.message = '';
             $scope.expenses = [];
             $scope.totals = {};
@@ -77,13 +93,13 @@
 
             // Get expenses, supplying the dates as a filter
             $scope.getFilteredExpenses = function() {
-                ExpenseService.getExpenses(FilterService.getDates())
+                DashboardService.getDashboard(FilterService.getDates())
                     .success(handleSuccess)
                     .error(handleError);
             };
             // Get all expenses, unfiltered
             $scope.getExpenses = function() {
-                ExpenseService.getExpenses()
+                DashboardService.getDashboard()
                     .success(handleSuccess)
                     .error(handleError);
             };
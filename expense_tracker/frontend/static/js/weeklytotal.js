@@ -1,7 +1,7 @@
 "use strict";
 
 (function() {
-    var app = angular.module("expenseManager.weeklyTotal", []);
+    var app = angular.module("expenseManager.weeklyTotal", ["expenseManager.conditional", "expenseManager.expenses"]);
     var apiBase = '/api/v1/';
 
     app.config(function($httpProvider) {
@@ -10,18 +10,20 @@
     });
 
     // Service provides RESTful methods to manage weekly totals on the server
-    app.service('WeeklyTotalService', ['$http', function($http) {
+    app.service('WeeklyTotalService', ['ConditionalHttp', function(ConditionalHttp) {
         var urlBase = apiBase + 'weeklytotal/';
-        this.getWeeklyTotals = function() {
-            return $http.get(urlBase);
+        // params may contain start_date filters, order_by, limit and offset
+        this.getWeeklyTotals = function(params) {
+            return ConditionalHttp.get(urlBase, {params: params});
         };
     }]);
 
     // Controller for Weekly totals list
-    app.controller('WeeklyTotalController', ['$scope', 'WeeklyTotalService',
-        function($scope, WeeklyTotalService) {
+    app.controller('WeeklyTotalController', ['$scope', 'WeeklyTotalService', 'DashboardService',
+        function($scope, WeeklyTotalService, DashboardService) {
             $scope.message = '';
-            $scope.weeklyTotals = [];
+            // Show the weeks from the expense list's dashboard, most recent first, until they are refreshed
+            $scope.weeklyTotals = (DashboardService.weeklyTotals || []).slice().reverse();
 
             // Handle successful API call.
             var handleSuccess = function(weeklyTotals) {
@@ -32,9 +34,9 @@
                 $scope.message = "Unable to fetch weekly totals";
             };
 
-            // Get all weekly totals, unfiltered
+            // Get the most recent weekly totals first
             $scope.getTotals = function() {
-                WeeklyTotalService.getWeeklyTotals()
+                WeeklyTotalService.getWeeklyTotals({order_by: '-start_date'})
                     .success(handleSuccess)
                     .error(handleError);
             };